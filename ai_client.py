@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash')
+# 'grpc' (padrao do SDK) ou 'rest'; as duas mantem a conexao aberta entre chamadas
+GEMINI_TRANSPORT = os.environ.get('GEMINI_TRANSPORT') or None
+# 'gemini' ou 'fake' (modelo local de fake_llm.py, para testes de carga sem gastar cota)
+AI_BACKEND = os.environ.get('AI_BACKEND', 'gemini')
+
+class Timing:
+    """Contagem, soma e maximo de uma duracao, em segundos"""
+
+    __slots__ = ('count', 'total', 'max', 'errors')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def record(self, seconds, error=False):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.errors += error
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total / self.count * 1000, 1) if self.count else None,
+            'max_ms': round(self.max * 1000, 1),
+        }
+
+class TimedStream:
+    """Resposta em stream que so registra os tempos quando a iteracao termina
+
+    generate_content(stream=True) volta antes do primeiro token; o tempo ate a
+    primeira parte vai para first_chunk:<modelo> e o total (ate a ultima parte,
+    um erro ou o fechamento do stream) para generate:<modelo>.
+    """
+
+    def __init__(self, response, name, registry, start):
+        self._response = response
+        self._name = name
+        self._registry = registry
+        self._start = start
+
+    def __iter__(self):
+        error = True
+        first = True
+        try:
+            for chunk in self._response:
+                if first:
+                    first = False
+                    self._registry.record(f'first_chunk:{self._name}', time.perf_counter() - self._start)
+                yield chunk
+            error = False
+        except GeneratorExit:
+            # Quem consumia desistiu (ex: cliente desconectou); nao e erro do modelo
+            error = False
+            raise
+        finally:
+            self._registry.record(f'generate:{self._name}', time.perf_counter() - self._start, error)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+class TimedModel:
+    """GenerativeModel com o tempo de cada generate_content registrado no registry"""
+
+    def __init__(self, model, name, registry):
+        self._model = model
+        self._name = name
+        self._registry = registry
+
+    def generate_content(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._model.generate_content(*args, **kwargs)
+        except Exception:
+            self._registry.record(f'generate:{self._name}', time.perf_counter() - start, error=True)
+            raise
+        if kwargs.get('stream'):
+            return TimedStream(response, self._name, self._registry, start)
+        self._registry.record(f'generate:{self._name}', time.perf_counter() - start)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+class ClientRegistry:
+    """Um cliente Gemini configurado por processo e um modelo por nome
+
+    O backend vem de AI_BACKEND: o Gemini de verdade ou o modelo local de fake_llm.py.
+
+    O SDK guarda o cliente (canal gRPC ou sessao HTTP) criado em genai.configure();
+    antes ele era recriado a cada requisicao, pagando import, configuracao e um
+    novo handshake TLS. Canais gRPC nao sobrevivem a fork, entao tudo e recriado
+    quando o pid muda (ex: workers do gunicorn iniciados com --preload).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._genai = None
+        self._models = {}
+        self._timings = {}
+
+    def _reset_after_fork(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._genai = None
+            self._models = {}
+            self._timings = {}
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            self._timings.setdefault(name, Timing()).record(seconds, error)
+
+    def _create_model(self, model_name):
+        if AI_BACKEND == 'fake':
+            from fake_llm import FakeModel
+            return FakeModel(model_name)
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.environ['GOOGLE_API_KEY'], transport=GEMINI_TRANSPORT)
+            self._genai = genai
+        return self._genai.GenerativeModel(model_name)
+
+    def get(self, model_name=GEMINI_MODEL):
+        self._reset_after_fork()
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+
+        if AI_BACKEND == 'gemini' and not os.environ.get('GOOGLE_API_KEY'):
+            print("GOOGLE_API_KEY nao encontrada nas variaveis de ambiente")
+            return None
+
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is not None:
+                return model
+            start = time.perf_counter()
+            try:
+                model = TimedModel(self._create_model(model_name), model_name, self)
+            except Exception as e:
+                print(f"Erro ao configurar o modelo ({AI_BACKEND}): {e}")
+                return None
+            self._timings.setdefault('setup', Timing()).record(time.perf_counter() - start)
+            self._models[model_name] = model
+            return model
+
+    def warm_up(self, model_name=GEMINI_MODEL):
+        """Cria o cliente e abre a conexao em segundo plano, antes da primeira requisicao"""
+        def run():
+            if self.get(model_name) is None or self._genai is None:
+                return
+            start = time.perf_counter()
+            try:
+                # Chamada de metadados, sem custo de geracao: so abre o canal (DNS + TLS)
+                self._genai.get_model(f'models/{model_name}')
+                self.record('warm_up', time.perf_counter() - start)
+            except Exception as e:
+                self.record('warm_up', time.perf_counter() - start, error=True)
+                print(f"Erro ao aquecer o cliente Gemini: {e}")
+
+        threading.Thread(target=run, name='gemini-warm-up', daemon=True).start()
+
+    def stats(self):
+        self._reset_after_fork()
+        with self._lock:
+            return {
+                'pid': self._pid,
+                'backend': AI_BACKEND,
+                'models': sorted(self._models),
+                'timings': {name: timing.as_dict() for name, timing in sorted(self._timings.items())},
+            }
+
+registry = ClientRegistry()
+
+def get_gemini_client(model_name=GEMINI_MODEL):
+    return registry.get(model_name)
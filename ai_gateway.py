@@ -0,0 +1,423 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from ai_client import get_gemini_client
+from ai_tasks import AI_TASKS, TaskError, describe_ai_error
+from database import get_db, release_db, transaction, after_commit
+
+# Tarefas de IA rodando ao mesmo tempo por processo; 0 desliga (ex: quando `python ai_gateway.py` roda a parte)
+AI_GATEWAY_CONCURRENCY = int(os.environ.get('AI_GATEWAY_CONCURRENCY', 16))
+# Chamadas simultaneas ao modelo no processo, somando todas as tarefas (um resumo longo faz varias)
+AI_MAX_MODEL_CALLS = int(os.environ.get('AI_MAX_MODEL_CALLS', 8))
+# Intervalo (segundos) para procurar jobs enviados por outros processos
+AI_GATEWAY_POLL_INTERVAL = float(os.environ.get('AI_GATEWAY_POLL_INTERVAL', 1))
+# O gateway renova heartbeat_at dos jobs que esta rodando a cada AI_JOB_HEARTBEAT_SECONDS;
+# um job 'running' sem heartbeat ha AI_JOB_STALE_SECONDS e de um processo que morreu e
+# falha (nao e repetido). Jobs vivos nunca sao tocados, por mais que o modelo demore
+AI_JOB_HEARTBEAT_SECONDS = 10
+AI_JOB_STALE_SECONDS = int(os.environ.get('AI_JOB_STALE_SECONDS', 60))
+# Espera maxima de uma requisicao que pediu para esperar o job (Prefer: wait); abaixo do --timeout do gunicorn
+AI_JOB_WAIT_SECONDS = float(os.environ.get('AI_JOB_WAIT_SECONDS', 100))
+# Jobs concluidos ficam esse tempo para consulta e depois sao apagados
+AI_JOB_RETENTION = '-1 day'
+# Intervalo entre gravacoes do texto parcial no banco. Quem acompanha o job pelo
+# mesmo processo (o stream SSE) le o texto da memoria na hora; o banco serve o
+# polling que cai em outro worker (e a checagem de cancelamento), entao o
+# intervalo fica bem abaixo do 1s que o primeiro token pode levar
+AI_PROGRESS_FLUSH_SECONDS = float(os.environ.get('AI_PROGRESS_FLUSH_SECONDS', 0.25))
+# Espera maxima do stream entre consultas; jobs deste processo acordam a cada parte
+STREAM_POLL_SECONDS = 0.5
+
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+_gateway = None
+_gateway_pid = None
+_gateway_lock = threading.Lock()
+_model_calls = threading.BoundedSemaphore(AI_MAX_MODEL_CALLS)
+# Acorda quem espera um job deste processo assim que ele termina
+_finished = threading.Condition()
+# Jobs rodando neste processo (JobContext por id), com o texto parcial completo
+_live = {}
+
+class JobCancelled(Exception):
+    pass
+
+class LimitedModel:
+    """Modelo com as chamadas simultaneas do processo limitadas a AI_MAX_MODEL_CALLS"""
+
+    def __init__(self, model):
+        self._model = model
+
+    def generate_content(self, *args, **kwargs):
+        if kwargs.get('stream'):
+            return self._stream(*args, **kwargs)
+        with _model_calls:
+            return self._model.generate_content(*args, **kwargs)
+
+    def _stream(self, *args, **kwargs):
+        # A vaga fica ocupada ate o fim do stream (ou ate o gerador ser fechado)
+        with _model_calls:
+            yield from self._model.generate_content(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+class JobContext:
+    """O que uma tarefa de ai_tasks.py recebe: dono, parametros, cliente e progresso"""
+
+    def __init__(self, job, client):
+        self.id = job['id']
+        self.user_id = job['user_id']
+        self.kind = job['kind']
+        self.payload = json.loads(job['payload'])
+        self.client = client
+        self.cancelled = False
+        self.finished = False
+        # O resultado ja foi gravado por commit(), junto com as escritas da tarefa
+        self.committed = False
+        # Texto gerado ate agora; o banco tem os primeiros `_flushed` caracteres
+        self.text = ''
+        # Acorda o stream deste job a cada parte
+        self.changed = threading.Condition()
+        self._flushed = 0
+        # A primeira parte vai para o banco na hora (primeiro token para o polling de outro worker)
+        self._last_flush = float('-inf')
+
+    def progress(self, text):
+        """Texto gerado ate agora, visivel para quem acompanha o job; levanta JobCancelled"""
+        if self.cancelled:
+            raise JobCancelled()
+        with self.changed:
+            self.text += text
+            self.changed.notify_all()
+        if time.monotonic() - self._last_flush >= AI_PROGRESS_FLUSH_SECONDS:
+            self.flush()
+
+    def wait_change(self, offset, timeout):
+        """Espera passar de `offset` caracteres ou o job terminar"""
+        with self.changed:
+            if len(self.text) == offset and not self.finished:
+                self.changed.wait(timeout)
+
+    def finish(self):
+        with self.changed:
+            self.finished = True
+            self.changed.notify_all()
+
+    def take_pending(self):
+        text = self.text[self._flushed:]
+        self._flushed = len(self.text)
+        return text
+
+    def commit(self, write):
+        """Grava o resultado da tarefa no mesmo commit que passa o job para 'done'
+
+        write(cursor) faz as escritas da tarefa (mensagens, XP, registros) e
+        retorna o resultado. Se o job nao estiver mais 'running' (cancelado, ou
+        dado como perdido por claim_job), levanta JobCancelled e a transacao
+        inteira e desfeita: o cliente nunca ve um job falho cujo conteudo ficou.
+        """
+        with transaction() as cursor:
+            result = write(cursor)
+            cursor.execute('''
+                UPDATE ai_jobs SET status = 'done', partial = partial || ?, result = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running'
+            ''', (self.take_pending(), json.dumps(result, ensure_ascii=False), self.id))
+            if cursor.rowcount == 0:
+                raise JobCancelled()
+        self.committed = True
+        return result
+
+    def flush(self):
+        with transaction() as cursor:
+            cursor.execute('''
+                UPDATE ai_jobs SET partial = partial || ? WHERE id = ? AND status = 'running'
+            ''', (self.take_pending(), self.id))
+            if cursor.rowcount == 0:
+                raise JobCancelled()
+        self._last_flush = time.monotonic()
+
+def submit(cursor, user_id, kind, payload):
+    """Envia uma tarefa de IA ao gateway na transacao atual; ele e acordado apos o commit"""
+    if kind not in AI_TASKS:
+        raise ValueError(f'Tarefa de IA desconhecida: {kind}')
+    cursor.execute('''
+        INSERT INTO ai_jobs (user_id, kind, payload) VALUES (?, ?, ?)
+    ''', (user_id, kind, json.dumps(payload, ensure_ascii=False)))
+    after_commit(_wake_gateway)
+    start_gateway()
+    return cursor.lastrowid
+
+def job_status(cursor, job_id, user_id, after=0):
+    """Estado do job e o texto parcial a partir do caractere `after`; None se nao for do usuario"""
+    cursor.execute('''
+        SELECT id, kind, status, substr(partial, ? + 1) as text, length(partial) as offset,
+               result, error, error_status
+        FROM ai_jobs WHERE id = ? AND user_id = ?
+    ''', (max(after, 0), job_id, user_id))
+    job = cursor.fetchone()
+    if job is None:
+        return None
+
+    text, offset = job['text'], job['offset']
+    live = _live.get(job['id']) if job['status'] == 'running' else None
+    if live is not None:
+        # Rodando neste processo: o texto da memoria esta a frente do banco
+        text, offset = live.text[max(after, 0):], len(live.text)
+    elif after > offset:
+        # O cliente ja leu da memoria de outro processo mais do que o banco tem
+        offset = after
+
+    status = {'id': job['id'], 'kind': job['kind'], 'status': job['status'], 'text': text, 'offset': offset}
+    if job['status'] == 'done':
+        status['result'] = json.loads(job['result'])
+    elif job['status'] in ('failed', 'cancelled'):
+        status['error'] = job['error'] or 'Tarefa cancelada'
+        status['error_status'] = job['error_status'] or 500
+    return status
+
+def cancel_job(job_id):
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE ai_jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status IN ('queued', 'running')
+        ''', (job_id,))
+    # Job deste processo para na proxima parte; o de outro processo, no proximo flush
+    live = _live.get(job_id)
+    if live is not None:
+        live.cancelled = True
+
+def wait_job(job_id, user_id, timeout=AI_JOB_WAIT_SECONDS):
+    """Espera o job terminar (ou o timeout) e retorna o estado; ocupa a thread que chama"""
+    deadline = time.monotonic() + timeout
+    delay = 0.02
+    while True:
+        status = job_status(get_db().cursor(), job_id, user_id)
+        if status is None or status['status'] in FINISHED_STATUSES or time.monotonic() >= deadline:
+            return status
+        # Jobs deste processo acordam na hora; os de outro gateway sao vistos no proximo poll
+        with _finished:
+            _finished.wait(delay)
+        delay = min(delay * 2, 0.5)
+
+class JobStream:
+    """Texto do job conforme e gerado, para sse_response; fechar antes do fim cancela o job"""
+
+    def __init__(self, job_id, user_id):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.result = None
+        self._done = False
+
+    def __iter__(self):
+        offset = 0
+        delay = 0.02
+        while True:
+            status = job_status(get_db().cursor(), self.job_id, self.user_id, after=offset)
+            offset = status['offset']
+            if status['text']:
+                yield status['text']
+            if status['status'] == 'done':
+                self._done = True
+                self.result = status['result']
+                return
+            if status['status'] in FINISHED_STATUSES:
+                self._done = True
+                raise TaskError(status['error'], status['error_status'])
+            live = _live.get(self.job_id)
+            if live is not None:
+                live.wait_change(offset, STREAM_POLL_SECONDS)
+            else:
+                # Ainda na fila ou em outro processo: consultas cada vez mais espacadas
+                time.sleep(delay)
+                delay = min(delay * 2, STREAM_POLL_SECONDS)
+
+    def close(self):
+        if not self._done:
+            cancel_job(self.job_id)
+
+def claim_job():
+    """Pega o proximo job da fila de forma atomica entre processos
+
+    Antes, falha os jobs de processos mortos (sem heartbeat). Se o processo
+    ainda estiver vivo mas travado, o commit() da tarefa encontra o job fora de
+    'running' e desfaz as escritas dela.
+    """
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE ai_jobs SET status = 'failed', error = 'Tempo esgotado. Tente novamente.', error_status = 504,
+                               finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND heartbeat_at < datetime('now', ?)
+        ''', (f'-{AI_JOB_STALE_SECONDS} seconds',))
+        cursor.execute('''
+            UPDATE ai_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (SELECT id FROM ai_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+            RETURNING id, user_id, kind, payload
+        ''')
+        return cursor.fetchone()
+
+def heartbeat(job_ids):
+    """Renova o heartbeat dos jobs que este processo esta rodando"""
+    if not job_ids:
+        return
+    with transaction() as cursor:
+        cursor.execute(f'''
+            UPDATE ai_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id IN ({','.join('?' * len(job_ids))}) AND status = 'running'
+        ''', list(job_ids))
+
+def _finish_job(job_id, status, partial='', result=None, error=None, error_status=None):
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE ai_jobs
+            SET status = ?, partial = partial || ?, result = ?, error = ?, error_status = ?,
+                finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running'
+        ''', (status, partial, result, error, error_status, job_id))
+
+def run_job(job):
+    client = get_gemini_client()
+    context = JobContext(job, LimitedModel(client) if client else None)
+    _live[context.id] = context
+    try:
+        try:
+            result = AI_TASKS[job['kind']](context)
+        except JobCancelled:
+            # Quem acompanhava desistiu (ex: cliente desconectou do stream) ou o job foi
+            # dado como perdido; nada da tarefa e gravado
+            return
+        except Exception as e:
+            if not isinstance(e, TaskError):
+                print(f"[{datetime.now()}] Erro no job de IA {job['id']} ({job['kind']}): {e}")
+            message, status = describe_ai_error(e)
+            _finish_job(job['id'], 'failed', context.take_pending(), error=message, error_status=status)
+            return
+
+        # Tarefas com escritas proprias ja passaram o job para 'done' em commit()
+        if not context.committed:
+            _finish_job(job['id'], 'done', context.take_pending(), result=json.dumps(result, ensure_ascii=False))
+    finally:
+        # Depois do commit: quem le o job ja encontra o estado final no banco
+        _live.pop(context.id, None)
+        context.finish()
+        with _finished:
+            _finished.notify_all()
+
+def purge_jobs():
+    with transaction() as cursor:
+        cursor.execute('''
+            DELETE FROM ai_jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < datetime('now', ?)
+        ''', (AI_JOB_RETENTION,))
+
+class Gateway:
+    """Pool de threads que tira jobs de ai_jobs e executa no maximo `concurrency` por vez
+
+    As requisicoes so gravam o job e voltam 202; o worker do gunicorn fica livre
+    enquanto o modelo responde. O SDK do Gemini e o SQLite sao bloqueantes, entao
+    cada job ocupa uma thread do pool do inicio ao fim. Uma thread despachante
+    pega o proximo job sempre que ha vaga e dorme ate ser acordada (submit deste
+    processo) ou ate AI_GATEWAY_POLL_INTERVAL (jobs enviados por outro processo).
+    Outra thread renova o heartbeat dos jobs em execucao.
+    """
+
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self.running = set()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._wakeup = threading.Event()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ai-job')
+        self._thread = threading.Thread(target=self._dispatch, name='ai-gateway', daemon=True)
+        self._heartbeat = threading.Thread(target=self._beat, name='ai-gateway-heartbeat', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._heartbeat.start()
+
+    def _beat(self):
+        while True:
+            time.sleep(AI_JOB_HEARTBEAT_SECONDS)
+            try:
+                heartbeat(list(self.running))
+            except Exception as e:
+                print(f"[{datetime.now()}] Erro no heartbeat do gateway de IA: {e}")
+            finally:
+                release_db()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _dispatch(self):
+        last_purge = 0
+        while True:
+            self._slots.acquire()
+            self._wakeup.clear()
+            try:
+                job = claim_job()
+            except Exception as e:
+                job = None
+                print(f"[{datetime.now()}] Erro no gateway de IA: {e}")
+            finally:
+                release_db()
+
+            if job is None:
+                self._slots.release()
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    try:
+                        purge_jobs()
+                    finally:
+                        release_db()
+                self._wakeup.wait(AI_GATEWAY_POLL_INTERVAL)
+                continue
+
+            self.running.add(job['id'])
+            self._pool.submit(self._execute, job)
+
+    def _execute(self, job):
+        try:
+            run_job(job)
+        except Exception as e:
+            print(f"[{datetime.now()}] Erro no job de IA {job['id']}: {e}")
+        finally:
+            release_db()
+            self.running.discard(job['id'])
+            self._slots.release()
+
+def _wake_gateway():
+    if _gateway is not None and _gateway_pid == os.getpid():
+        _gateway.wake()
+
+def start_gateway(concurrency=AI_GATEWAY_CONCURRENCY):
+    """Inicia o gateway deste processo (de novo apos um fork)"""
+    global _gateway, _gateway_pid
+    if _gateway_pid == os.getpid() or concurrency <= 0:
+        return
+    with _gateway_lock:
+        if _gateway_pid == os.getpid():
+            return
+        _gateway = Gateway(concurrency)
+        _gateway.start()
+        _gateway_pid = os.getpid()
+
+def gateway_stats(cursor):
+    cursor.execute('''
+        SELECT kind, status, COUNT(*) as jobs FROM ai_jobs
+        WHERE status IN ('queued', 'running') OR finished_at > datetime('now', '-1 hour')
+        GROUP BY kind, status
+    ''')
+    jobs = {}
+    for row in cursor.fetchall():
+        jobs.setdefault(row['kind'], {})[row['status']] = row['jobs']
+    running_here = len(_gateway.running) if _gateway is not None and _gateway_pid == os.getpid() else 0
+    return {'concurrency': AI_GATEWAY_CONCURRENCY, 'running_here': running_here, 'jobs_last_hour': jobs}
+
+if __name__ == '__main__':
+    # Gateway dedicado; rode o app com AI_GATEWAY_CONCURRENCY=0 para usar so este
+    start_gateway(max(AI_GATEWAY_CONCURRENCY, 1))
+    print(f"Gateway de IA rodando ({max(AI_GATEWAY_CONCURRENCY, 1)} jobs simultaneos)")
+    while True:
+        time.sleep(3600)
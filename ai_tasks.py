@@ -0,0 +1,267 @@
+import json
+from datetime import datetime, timedelta
+
+from database import get_db, add_xp, bump_daily_stats
+from dedup import Signature, find_duplicate, index_flashcard
+from ingest import pdf_text
+from llm_cache import cached
+from scheduler import forecast_cache
+from summarizer import summarize, parse_json_response
+
+MISSING_KEY_ERROR = 'Chave da API Google nao configurada. Configure GOOGLE_API_KEY nas configuracoes.'
+
+# Tarefas de IA por nome, executadas pelo gateway (ver ai_gateway.py)
+AI_TASKS = {}
+
+class TaskError(Exception):
+    """Erro esperado de uma tarefa, devolvido ao cliente com a mensagem e o status HTTP"""
+
+    def __init__(self, message, status=500):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def describe_ai_error(error):
+    """(mensagem, status HTTP) para um erro da chamada ao modelo"""
+    if isinstance(error, TaskError):
+        return error.message, error.status
+    error_msg = str(error)
+    if 'API_KEY' in error_msg.upper():
+        return 'Chave da API nao configurada. Configure GOOGLE_API_KEY nas Secrets.', 400
+    if 'quota' in error_msg.lower():
+        return 'Limite de uso da API atingido. Tente novamente mais tarde.', 429
+    return f'Erro ao processar mensagem: {error_msg}', 500
+
+def ai_task(name):
+    def register(function):
+        AI_TASKS[name] = function
+        return function
+    return register
+
+def _require_client(job):
+    if job.client is None:
+        raise TaskError(MISSING_KEY_ERROR, 400)
+    return job.client
+
+def _stream(job, model, prompt):
+    """Texto completo da resposta, repassando cada parte ao job enquanto o modelo gera"""
+    parts = []
+    for part in model.stream(prompt):
+        parts.append(part)
+        job.progress(part)
+    text = ''.join(parts)
+    if not text:
+        raise TaskError('API retornou resposta vazia. Tente novamente.')
+    return text
+
+@ai_task('chat')
+def chat_task(job):
+    client = _require_client(job)
+    payload = job.payload
+    prompt = f"""Voce e o MentorMind, um tutor de estudos inteligente e amigavel.
+O aluno se chama {payload['user_name']} e esta no nivel {payload['user_level']}.
+
+Suas funcoes:
+- Explicar materias de forma clara e didatica
+- Ajudar com exercicios passo a passo
+- Dar dicas de estudo e memorizacao
+- Motivar o aluno
+- Adaptar a linguagem ao nivel do aluno
+- Corrigir redacoes quando solicitado
+
+Seja amigavel, paciente e encorajador. Use exemplos praticos.
+Responda sempre em portugues brasileiro.
+
+Pergunta do aluno: {payload['message']}"""
+
+    # A resposta do assistente so e gravada se a geracao chegar ao fim
+    reply = _stream(job, cached(client, 'chat'), prompt)
+
+    def save(cursor):
+        cursor.execute('''
+            INSERT INTO chat_messages (user_id, role, content)
+            VALUES (?, 'assistant', ?)
+        ''', (job.user_id, reply))
+        add_xp(cursor, job.user_id, 2)
+        return {'reply': reply}
+
+    return job.commit(save)
+
+@ai_task('explain')
+def explain_task(job):
+    client = _require_client(job)
+    prompt = f"""Voce e um professor. Explique o texto de forma simples e didatica. Use exemplos se necessario. Responda em portugues brasileiro.
+
+        Explique este trecho:
+
+        {job.payload['text']}"""
+    return {'explanation': _stream(job, cached(client, 'explain'), prompt)}
+
+@ai_task('summary')
+def summary_task(job):
+    client = _require_client(job)
+    pdf_id = job.payload.get('pdf_id')
+    text = pdf_text(get_db().cursor(), pdf_id) if pdf_id else job.payload['text']
+
+    try:
+        result = summarize(cached(client, 'summary'), text)
+    except json.JSONDecodeError:
+        raise TaskError('Erro ao processar resposta da IA. Tente novamente.')
+    except Exception as e:
+        raise TaskError(f'Erro ao gerar resumo: {str(e)}')
+
+    # Assinaturas calculadas fora da transacao, para nao segurar o lock de escrita
+    new_cards = [(fc, Signature.of(fc['front'])) for fc in result.get('flashcards', [])[:10]]
+
+    def save(cursor):
+        skipped = 0
+        cursor.execute('''
+            INSERT INTO summaries (user_id, pdf_id, title, original_text, short_summary, full_summary, topics, mind_map)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            job.user_id,
+            pdf_id,
+            result.get('title', 'Resumo'),
+            text[:5000],
+            result.get('short_summary', ''),
+            result.get('full_summary', ''),
+            json.dumps(result.get('topics', [])),
+            json.dumps(result.get('mind_map', {}))
+        ))
+
+        summary_id = cursor.lastrowid
+
+        for fc, signature in new_cards:
+            if find_duplicate(cursor, job.user_id, fc['front'], signature):
+                skipped += 1
+                continue
+            cursor.execute('''
+                INSERT INTO flashcards (user_id, summary_id, front, back, next_review)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (job.user_id, summary_id, fc['front'], fc['back'], datetime.now().strftime('%Y-%m-%d')))
+            index_flashcard(cursor, job.user_id, cursor.lastrowid, fc['front'], signature)
+
+        bump_daily_stats(cursor, job.user_id, summaries_generated=1)
+        add_xp(cursor, job.user_id, 25)
+        forecast_cache.invalidate(cursor, job.user_id)
+        return {'summary': result, 'summary_id': summary_id, 'duplicates_skipped': skipped}
+
+    return job.commit(save)
+
+@ai_task('quiz')
+def quiz_task(job):
+    client = _require_client(job)
+    payload = job.payload
+    prompt = f"""Voce cria questoes de estudo. Responda em JSON:
+        {{"questions": [{{"question": "pergunta", "options": ["a", "b", "c", "d"], "correct": 0, "explanation": "explicacao"}}]}}
+        Crie questoes educativas e claras. O campo 'correct' e o indice da resposta correta (0-3).
+
+        Crie {payload['num_questions']} questoes sobre {payload['subject']}. Topico especifico: {payload['topic']}"""
+
+    response = cached(client, 'quiz').generate_content(prompt)
+    result = parse_json_response(response.text)
+
+    def save(cursor):
+        cursor.execute('''
+            INSERT INTO quizzes (user_id, title, subject, questions, total_questions)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (job.user_id, f"Quiz de {payload['subject']}", payload['subject'], json.dumps(result['questions']), len(result['questions'])))
+        return {'quiz_id': cursor.lastrowid, 'questions': result['questions']}
+
+    return job.commit(save)
+
+@ai_task('plan')
+def plan_task(job):
+    payload = job.payload
+    deadline = payload['deadline']
+    subjects = payload['subjects']
+
+    # A chamada a IA acontece antes da transacao para nao segurar o lock de escrita
+    tasks = []
+    if deadline and subjects and job.client:
+        prompt = f"""Voce e um planejador de estudos. Crie um cronograma de tarefas.
+            Responda em JSON:
+            {{"tasks": [{{"title": "titulo", "subject": "materia", "description": "descricao", "duration_minutes": 30, "priority": 1-5}}]}}
+            Crie tarefas variadas e distribuidas entre as materias. Maximo 20 tarefas.
+
+            Crie um plano de estudos para {payload['objective']}. Materias: {', '.join(subjects)}. {payload['daily_hours']}h por dia ate {deadline}."""
+
+        response = cached(job.client, 'plan').generate_content(prompt)
+        try:
+            result = parse_json_response(response.text)
+            start_date = datetime.now()
+            days_available = (datetime.strptime(deadline, '%Y-%m-%d') - start_date).days
+        except ValueError as e:
+            # Resposta fora do formato (ou prazo invalido): o plano e criado sem tarefas
+            print(f"[{datetime.now()}] Plano {job.id} sem tarefas: {e}")
+            result = {}
+
+        raw_tasks = result.get('tasks') if isinstance(result, dict) else None
+        for i, task in enumerate((raw_tasks if isinstance(raw_tasks, list) else [])[:20]):
+            if not isinstance(task, dict) or not task.get('title'):
+                continue
+            task_date = start_date + timedelta(days=i % max(1, days_available))
+            tasks.append((task['title'], task.get('subject', ''),
+                          task.get('description', ''), task_date.strftime('%Y-%m-%d'),
+                          task.get('duration_minutes', 30), task.get('priority', 3)))
+
+    def save(cursor):
+        cursor.execute('''
+            INSERT INTO study_plans (user_id, title, objective, daily_hours, deadline, subjects)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (job.user_id, payload['title'], payload['objective'], payload['daily_hours'], deadline, json.dumps(subjects)))
+
+        plan_id = cursor.lastrowid
+
+        cursor.executemany('''
+            INSERT INTO study_tasks (plan_id, user_id, title, subject, description, scheduled_date, duration_minutes, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(plan_id, job.user_id) + task for task in tasks])
+
+        add_xp(cursor, job.user_id, 20)
+        return {'plan_id': plan_id}
+
+    return job.commit(save)
+
+@ai_task('mentor')
+def mentor_task(job):
+    client = _require_client(job)
+    cursor = get_db().cursor()
+
+    cursor.execute('SELECT * FROM users WHERE id = ?', (job.user_id,))
+    user = cursor.fetchone()
+
+    today = datetime.now().strftime('%Y-%m-%d')
+    cursor.execute('SELECT * FROM daily_goals WHERE user_id = ? AND date = ?', (job.user_id, today))
+    goals = cursor.fetchone()
+
+    prompt = f"""Voce e um mentor de estudos DISCIPLINADOR.
+        Seu estilo e: firme, direto, motivador mas exigente.
+
+        - Se o aluno nao estudou: cobre com firmeza
+        - Se estudou pouco: incentive a fazer mais
+        - Se esta bem: elogie mas desafie a ir alem
+        - Use frases de impacto e motivacao
+
+        Seja breve (2-3 frases). Use um tom de coach rigoroso.
+        Responda em portugues brasileiro.
+
+        Gere uma mensagem de mentor para este aluno:
+        Nome: {user['name']}
+        Nivel: {user['level']}
+        Streak: {user['streak_days']} dias
+        Foco hoje: {goals['focus_achieved_minutes'] if goals else 0}/{goals['focus_goal_minutes'] if goals else 60} min
+        Flashcards: {goals['flashcards_done'] if goals else 0}/{goals['flashcards_goal'] if goals else 10}
+        Tarefas: {goals['tasks_done'] if goals else 0}/{goals['tasks_goal'] if goals else 3}"""
+
+    response = cached(client, 'mentor').generate_content(prompt)
+    message = response.text
+
+    def save(cursor):
+        cursor.execute('''
+            INSERT INTO mentor_messages (user_id, message, message_type)
+            VALUES (?, ?, 'motivation')
+        ''', (job.user_id, message))
+        return {'message': message}
+
+    return job.commit(save)
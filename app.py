@@ -1,24 +1,57 @@
 
 import os
+import multiprocessing
 import json
 import secrets
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file, abort
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-import PyPDF2
-from database import get_db, init_db, add_xp, calculate_level, sm2_algorithm, start_ping_thread
+from leaderboard import focus_ranking, xp_ranking
+from scheduler import Deck, shift_overdue, balance_due_dates, forecast_due, forecast_cache
+from dedup import Signature, find_duplicate, index_flashcard
+import blobstore
+from search import search, SEARCH_KINDS, SEARCH_PAGE_SIZE
+from images import sniff_mimetype, IMAGE_VARIANTS
+from ai_client import registry as gemini_registry
+from llm_cache import response_cache
+from streaming import wants_stream, stream_supported, requested_wait, sse_response
+from ai_tasks import describe_ai_error
+from ai_gateway import (submit as submit_ai_job, job_status as ai_job_state, wait_job as wait_ai_job, AI_JOB_WAIT_SECONDS, JobStream,
+                        gateway_stats, start_gateway as start_ai_gateway)
+from ingest import enqueue_pdf, enqueue_image, job_status, pdf_text, start_workers as start_ingest_workers
+from database import (get_db, release_db, transaction, init_db, add_xp, bump_daily_goals, bump_daily_stats, record_study_day,
+                      calculate_level, sm2_algorithm, day_number, day_to_date, start_ping_thread, Row,
+                      due_flashcards, count_due_flashcards, DUE_QUEUE_PAGE_SIZE)
+
+class JSONProvider(DefaultJSONProvider):
+    """Serializa as linhas do banco (database.Row) em jsonify e no filtro tojson"""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Row):
+            return o.as_dict()
+        return DefaultJSONProvider.default(o)
 
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.secret_key = os.environ.get('SESSION_SECRET', secrets.token_hex(32))
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 # Inicia o ping automático ao SQLite Cloud apenas em ambientes não-serverless
 # Vercel define VERCEL=1 em produção, não iniciar thread lá
-if not os.environ.get('VERCEL'):
+# Nem nos processos extratores de PDF (spawn), que reimportam o modulo principal
+if not os.environ.get('VERCEL') and multiprocessing.parent_process() is None:
     start_ping_thread()
+    # Retoma jobs de extracao que ficaram na fila antes de um restart
+    start_ingest_workers()
+    # Cliente Gemini pronto (e conectado) antes da primeira chamada de IA
+    gemini_registry.warm_up()
+    # Retoma tarefas de IA enfileiradas antes de um restart
+    start_ai_gateway()
 
 # Configurações de produção
 if os.environ.get('REPLIT_DEPLOYMENT'):
@@ -27,22 +60,21 @@ if os.environ.get('REPLIT_DEPLOYMENT'):
     app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
+INVALID_CONTENT_ERROR = 'O conteudo do arquivo nao corresponde ao tipo informado'
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_gemini_client():
-    api_key = os.environ.get('GOOGLE_API_KEY')
-    if not api_key:
-        print("GOOGLE_API_KEY nao encontrada nas variaveis de ambiente")
-        return None
-    try:
-        import google.generativeai as genai
-        genai.configure(api_key=api_key)
-        return genai.GenerativeModel('gemini-2.0-flash')
-    except Exception as e:
-        print(f"Erro ao configurar Gemini: {e}")
-        return None
+def upload_kind(filename, path):
+    """'pdf' ou 'image' pelo conteudo do arquivo salvo, conferido com a extensao do nome original
+
+    Retorna None se o conteudo nao for do tipo que a extensao promete.
+    """
+    if filename.rsplit('.', 1)[-1].lower() == 'pdf':
+        with open(path, 'rb') as f:
+            # O cabecalho pode vir depois de alguns bytes de lixo, dentro do primeiro KB
+            return 'pdf' if b'%PDF-' in f.read(1024) else None
+    return 'image' if sniff_mimetype(path) in ('image/png', 'image/jpeg') else None
 
 def login_required(f):
     @wraps(f)
@@ -57,21 +89,21 @@ def get_user_stats(user_id):
     cursor = conn.cursor()
     
     today = datetime.now().strftime('%Y-%m-%d')
+    today_day = day_number(datetime.now())
     
-    cursor.execute('SELECT SUM(duration_minutes) as total FROM focus_sessions WHERE user_id = ? AND DATE(started_at) = ?', (user_id, today))
-    focus_today = cursor.fetchone()['total'] or 0
+    cursor.execute('SELECT focus_minutes FROM user_daily_stats WHERE user_id = ? AND day = ?', (user_id, today_day))
+    row = cursor.fetchone()
+    focus_today = row['focus_minutes'] if row else 0
     
-    cursor.execute('SELECT COUNT(*) as count FROM flashcards WHERE user_id = ? AND (next_review IS NULL OR DATE(next_review) <= ?)', (user_id, today))
+    cursor.execute('SELECT COUNT(*) as count FROM flashcards WHERE user_id = ? AND (next_review_day IS NULL OR next_review_day <= ?)', (user_id, today_day))
     pending_flashcards = cursor.fetchone()['count']
     
     cursor.execute('SELECT COUNT(*) as count FROM study_tasks WHERE user_id = ? AND scheduled_date = ? AND is_completed = 0', (user_id, today))
     pending_tasks = cursor.fetchone()['count']
     
-    week_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    cursor.execute('SELECT DATE(started_at) as day, SUM(duration_minutes) as total FROM focus_sessions WHERE user_id = ? AND DATE(started_at) >= ? GROUP BY DATE(started_at)', (user_id, week_ago))
-    weekly_progress = {row['day']: row['total'] for row in cursor.fetchall()}
-    
-    conn.close()
+    week_ago = day_number(datetime.now() - timedelta(days=7))
+    cursor.execute('SELECT day, focus_minutes FROM user_daily_stats WHERE user_id = ? AND day >= ? AND focus_minutes > 0', (user_id, week_ago))
+    weekly_progress = {day_to_date(row['day']): row['focus_minutes'] for row in cursor.fetchall()}
     
     return {
         'focus_today': focus_today,
@@ -98,29 +130,25 @@ def register():
             flash('Preencha todos os campos', 'error')
             return render_template('register.html')
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
-        if cursor.fetchone():
-            flash('Usuario ou email ja existe', 'error')
-            conn.close()
-            return render_template('register.html')
-        
-        cursor.execute('''
-            INSERT INTO users (username, email, password_hash, name)
-            VALUES (?, ?, ?, ?)
-        ''', (username, email, generate_password_hash(password), name))
-        
-        user_id = cursor.lastrowid
+        password_hash = generate_password_hash(password)
         
-        today = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute('''
-            INSERT INTO daily_goals (user_id, date) VALUES (?, ?)
-        ''', (user_id, today))
-        
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
+            if cursor.fetchone():
+                flash('Usuario ou email ja existe', 'error')
+                return render_template('register.html')
+            
+            cursor.execute('''
+                INSERT INTO users (username, email, password_hash, name)
+                VALUES (?, ?, ?, ?)
+            ''', (username, email, password_hash, name))
+            
+            user_id = cursor.lastrowid
+            
+            today = datetime.now().strftime('%Y-%m-%d')
+            cursor.execute('''
+                INSERT INTO daily_goals (user_id, date) VALUES (?, ?)
+            ''', (user_id, today))
         
         session['user_id'] = user_id
         session['username'] = username
@@ -139,7 +167,6 @@ def login():
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
-        conn.close()
         
         if user and check_password_hash(user['password_hash'], password):
             session['user_id'] = user['id']
@@ -179,8 +206,6 @@ def dashboard():
     
     level, current_xp, xp_needed = calculate_level(user['xp'])
     
-    conn.close()
-    
     return render_template('dashboard.html', 
                           user=user, 
                           stats=stats, 
@@ -198,18 +223,10 @@ def focus():
     cursor.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],))
     user = cursor.fetchone()
     
-    cursor.execute('''
-        SELECT u.username, u.name, SUM(f.duration_minutes) as total_focus 
-        FROM users u 
-        LEFT JOIN focus_sessions f ON u.id = f.user_id AND DATE(f.started_at) >= DATE('now', '-7 days')
-        GROUP BY u.id 
-        ORDER BY total_focus DESC 
-        LIMIT 10
-    ''')
-    ranking = cursor.fetchall()
-    
-    conn.close()
-    return render_template('focus.html', user=user, ranking=ranking)
+    ranking = focus_ranking.top()
+    my_rank, my_focus = focus_ranking.rank_of(session['user_id'])
+    
+    return render_template('focus.html', user=user, ranking=ranking, my_rank=my_rank, my_focus=my_focus)
 
 @app.route('/api/focus/complete', methods=['POST'])
 @login_required
@@ -217,41 +234,20 @@ def complete_focus():
     data = request.get_json()
     duration = data.get('duration', 25)
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO focus_sessions (user_id, duration_minutes, completed)
-        VALUES (?, ?, 1)
-    ''', (session['user_id'], duration))
-    
     xp_earned = duration * 2
-    add_xp(session['user_id'], xp_earned)
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('''
-        INSERT INTO daily_goals (user_id, date, focus_achieved_minutes)
-        VALUES (?, ?, ?)
-        ON CONFLICT(user_id, date) DO UPDATE SET
-        focus_achieved_minutes = focus_achieved_minutes + ?
-    ''', (session['user_id'], today, duration, duration))
     
-    cursor.execute('SELECT last_study_date, streak_days FROM users WHERE id = ?', (session['user_id'],))
-    user = cursor.fetchone()
-    
-    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
-    if user['last_study_date'] == yesterday:
-        new_streak = user['streak_days'] + 1
-    elif user['last_study_date'] == today:
-        new_streak = user['streak_days']
-    else:
-        new_streak = 1
-    
-    cursor.execute('UPDATE users SET last_study_date = ?, streak_days = ?, total_focus_time = total_focus_time + ? WHERE id = ?',
-                  (today, new_streak, duration, session['user_id']))
+    with transaction() as cursor:
+        cursor.execute('''
+            INSERT INTO focus_sessions (user_id, duration_minutes, completed)
+            VALUES (?, ?, 1)
+        ''', (session['user_id'], duration))
+        
+        add_xp(cursor, session['user_id'], xp_earned)
+        bump_daily_goals(cursor, session['user_id'], focus_minutes=duration)
+        bump_daily_stats(cursor, session['user_id'], focus_minutes=duration, focus_sessions=1)
+        record_study_day(cursor, session['user_id'], focus_minutes=duration)
     
-    conn.commit()
-    conn.close()
+    focus_ranking.invalidate()
     
     return jsonify({'success': True, 'xp_earned': xp_earned})
 
@@ -260,15 +256,50 @@ def complete_focus():
 def library():
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM pdfs WHERE user_id = ? ORDER BY uploaded_at DESC', (session['user_id'],))
+    cursor.execute('''
+        SELECT p.*, j.id as job_id, j.status as job_status, j.pages_done, j.pages_total
+        FROM pdfs p LEFT JOIN ingest_jobs j ON j.pdf_id = p.id
+        WHERE p.user_id = ? ORDER BY p.uploaded_at DESC
+    ''', (session['user_id'],))
     pdfs = cursor.fetchall()
     
     cursor.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],))
     user = cursor.fetchone()
-    conn.close()
     
     return render_template('library.html', pdfs=pdfs, user=user)
 
+def save_upload(user_id, file, subject):
+    """Guarda o arquivo na biblioteca e enfileira a ingestao; retorna (pdf_id, job_id)
+
+    A extracao do texto roda nos workers de ingestao; o cliente acompanha por /api/ingest/<job_id>.
+    Retorna None se o conteudo nao corresponder a extensao (ver upload_kind).
+    """
+    # O nome so e exibido (o arquivo fica no store pelo hash); secure_filename apagaria
+    # nomes fora do ASCII, como "файл.pdf" -> "pdf"
+    original_name = os.path.basename(file.filename.replace('\\', '/')).strip()[:255] or secure_filename(file.filename)
+    # Conteudo identico ja enviado por qualquer usuario reaproveita o mesmo arquivo
+    sha256, size, temp_path = blobstore.save_stream(file.stream)
+    kind = upload_kind(file.filename, temp_path)
+    if kind is None:
+        os.remove(temp_path)
+        return None
+    
+    with transaction() as cursor:
+        filepath = blobstore.store(cursor, sha256, size, temp_path)
+        cursor.execute('''
+            INSERT INTO pdfs (user_id, filename, original_name, subject, content_text, page_count, blob_sha256)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, blobstore.blob_name(sha256), original_name, subject, '', 0, sha256))
+        
+        pdf_id = cursor.lastrowid
+        if kind == 'pdf':
+            job_id = enqueue_pdf(cursor, user_id, pdf_id, filepath)
+        else:
+            # Imagens sao reduzidas e recodificadas pelos mesmos workers
+            job_id = enqueue_image(cursor, user_id, pdf_id, filepath)
+        add_xp(cursor, user_id, 10)
+    return pdf_id, job_id
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -280,43 +311,117 @@ def upload_file():
         return jsonify({'error': 'Nenhum arquivo selecionado'}), 400
     
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        unique_filename = f"{session['user_id']}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
-        
-        content_text = ""
-        page_count = 0
-        
-        if filename.lower().endswith('.pdf'):
-            try:
-                with open(filepath, 'rb') as f:
-                    reader = PyPDF2.PdfReader(f)
-                    page_count = len(reader.pages)
-                    for page in reader.pages[:10]:
-                        content_text += page.extract_text() or ""
-            except:
-                pass
-        
-        subject = request.form.get('subject', 'Geral')
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO pdfs (user_id, filename, original_name, subject, content_text, page_count)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (session['user_id'], unique_filename, filename, subject, content_text[:10000], page_count))
-        
-        pdf_id = cursor.lastrowid
-        add_xp(session['user_id'], 10)
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'pdf_id': pdf_id})
+        saved = save_upload(session['user_id'], file, request.form.get('subject', 'Geral'))
+        if saved is None:
+            return jsonify({'error': INVALID_CONTENT_ERROR}), 400
+        pdf_id, job_id = saved
+        return jsonify({'success': True, 'pdf_id': pdf_id, 'job_id': job_id})
     
     return jsonify({'error': 'Tipo de arquivo nao permitido'}), 400
 
+@app.route('/media/<sha256>/<variant>')
+@login_required
+def media(sha256, variant):
+    # A URL muda junto com o conteudo, entao o navegador pode guardar a resposta para sempre
+    cursor = get_db().cursor()
+    cursor.execute('SELECT 1 FROM pdfs WHERE blob_sha256 = ? AND user_id = ? LIMIT 1', (sha256, session['user_id']))
+    if not cursor.fetchone():
+        abort(404)
+    
+    if variant == 'original':
+        path = blobstore.blob_path(sha256)
+    elif variant in IMAGE_VARIANTS:
+        path = blobstore.variant_path(sha256, variant)
+    else:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+    
+    return send_file(path, mimetype=sniff_mimetype(path), max_age=31536000, etag=sha256 + variant)
+
+@app.route('/api/pdf/<int:pdf_id>/delete', methods=['POST'])
+@login_required
+def delete_pdf(pdf_id):
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM pdfs WHERE id = ? AND user_id = ? RETURNING blob_sha256', (pdf_id, session['user_id']))
+        pdf = cursor.fetchone()
+        if not pdf:
+            return jsonify({'error': 'Arquivo nao encontrado'}), 404
+        
+        cursor.execute('DELETE FROM pdf_chunks WHERE pdf_id = ?', (pdf_id,))
+        cursor.execute('DELETE FROM ingest_jobs WHERE pdf_id = ?', (pdf_id,))
+        cursor.execute('UPDATE summaries SET pdf_id = NULL WHERE pdf_id = ?', (pdf_id,))
+        if pdf['blob_sha256']:
+            blobstore.release(cursor, pdf['blob_sha256'])
+    
+    return jsonify({'success': True})
+
+def ai_job_response(job_id, data=None):
+    """Resposta de uma rota de IA a partir do job enviado ao gateway
+
+    Por padrao volta 202 na hora e o cliente acompanha o job em
+    /api/ai/jobs/<id>, sem ocupar o worker. Com stream o texto vai em SSE
+    conforme e gerado, se o worker aguenta (ver stream_supported). Esperar o
+    job na requisicao so com opt-in explicito (Prefer: wait=<segundos>).
+    """
+    accepted = jsonify({'success': True, 'job_id': job_id, 'status_url': url_for('ai_job_status', job_id=job_id)}), 202
+    
+    if wants_stream(data) and stream_supported():
+        stream = JobStream(job_id, session['user_id'])
+        return sse_response(stream, on_complete=lambda text: stream.result)
+    
+    wait = requested_wait(AI_JOB_WAIT_SECONDS, data)
+    if wait is None:
+        return accepted
+    
+    job = wait_ai_job(job_id, session['user_id'], timeout=wait)
+    if job['status'] == 'done':
+        return jsonify({'success': True, **job['result']})
+    if job['status'] in ('queued', 'running'):
+        # Passou do tempo pedido: o cliente pode continuar acompanhando o job
+        return accepted
+    return jsonify({'error': job['error']}), job['error_status']
+
+@app.route('/api/ai/jobs/<int:job_id>')
+@login_required
+def ai_job_status(job_id):
+    # after: quantos caracteres do texto parcial o cliente ja recebeu
+    job = ai_job_state(get_db().cursor(), job_id, session['user_id'], after=request.args.get('after', 0, type=int))
+    if job is None:
+        return jsonify({'error': 'Job nao encontrado'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/ai/metrics')
+@login_required
+def ai_metrics():
+    # Tempos deste worker: setup (import + configure + modelo), warm_up, cada generate_content (em stream, ate a
+    # ultima parte) e first_chunk dos streams; acertos do cache de respostas
+    return jsonify({'success': True, **gemini_registry.stats(), 'cache': response_cache.stats(),
+                    'gateway': gateway_stats(get_db().cursor())})
+
+@app.route('/api/search')
+@login_required
+def search_api():
+    query = request.args.get('q', '').strip()
+    kinds = [kind for kind in request.args.get('types', '').split(',') if kind]
+    if any(kind not in SEARCH_KINDS for kind in kinds):
+        return jsonify({'error': f'Tipos validos: {", ".join(SEARCH_KINDS)}'}), 400
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), 50)
+    
+    results, has_more = search(get_db().cursor(), session['user_id'], query, kinds, offset, limit)
+    
+    return jsonify({'success': True, 'results': results, 'offset': offset,
+                    'next_offset': offset + limit if has_more else None})
+
+@app.route('/api/ingest/<int:job_id>')
+@login_required
+def ingest_status(job_id):
+    status = job_status(get_db().cursor(), job_id, session['user_id'])
+    if status is None:
+        return jsonify({'error': 'Job nao encontrado'}), 404
+    return jsonify({'success': True, 'job': status})
+
 @app.route('/summary')
 @login_required
 def summary():
@@ -328,101 +433,57 @@ def summary():
     cursor.execute('SELECT * FROM summaries WHERE user_id = ? ORDER BY created_at DESC LIMIT 10', (session['user_id'],))
     summaries = cursor.fetchall()
     
-    conn.close()
-    return render_template('summary.html', user=user, summaries=summaries)
+    # Vindo da biblioteca (?pdf_id=), o resumo e gerado a partir do PDF ja enviado
+    pdf = None
+    if request.args.get('pdf_id', type=int):
+        cursor.execute('SELECT id, original_name, page_count FROM pdfs WHERE id = ? AND user_id = ?',
+                      (request.args.get('pdf_id', type=int), session['user_id']))
+        pdf = cursor.fetchone()
+    
+    return render_template('summary.html', user=user, summaries=summaries, pdf=pdf)
 
 @app.route('/api/generate-summary', methods=['POST'])
 @login_required
 def generate_summary():
     text = request.form.get('text', '')
+    pdf_id = None if text else request.form.get('pdf_id', type=int)
     
-    if not text:
-        if 'file' in request.files:
-            file = request.files['file']
-            if file and file.filename.endswith('.pdf'):
-                try:
-                    reader = PyPDF2.PdfReader(file)
-                    for page in reader.pages[:20]:
-                        text += page.extract_text() or ""
-                except:
-                    return jsonify({'error': 'Erro ao ler PDF'}), 400
+    if pdf_id:
+        # PDF da biblioteca: usa o texto completo ja extraido pela ingestao
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT p.id, j.status FROM pdfs p LEFT JOIN ingest_jobs j ON j.pdf_id = p.id
+            WHERE p.id = ? AND p.user_id = ?
+        ''', (pdf_id, session['user_id']))
+        pdf = cursor.fetchone()
+        if not pdf:
+            return jsonify({'error': 'Arquivo nao encontrado'}), 404
+        if pdf['status'] in ('queued', 'running'):
+            return jsonify({'error': 'O PDF ainda esta sendo processado. Tente novamente em instantes.'}), 409
+        text = pdf_text(cursor, pdf_id)
+    elif not text:
+        file = request.files.get('file')
+        if file and file.filename.lower().endswith('.pdf'):
+            # Extrair aqui seguraria o worker pelo PDF inteiro: o arquivo vai para a
+            # biblioteca e a ingestao, e o cliente pede o resumo pelo pdf_id quando ela terminar
+            saved = save_upload(session['user_id'], file, request.form.get('subject', 'Geral'))
+            if saved is None:
+                return jsonify({'error': INVALID_CONTENT_ERROR}), 400
+            pdf_id, ingest_job_id = saved
+            return jsonify({
+                'success': True, 'pdf_id': pdf_id, 'ingest_job_id': ingest_job_id,
+                'ingest_url': url_for('ingest_status', job_id=ingest_job_id)
+            }), 202
     
     if not text or len(text) < 50:
         return jsonify({'error': 'Texto muito curto para gerar resumo'}), 400
     
-    client = get_gemini_client()
-    if not client:
-        return jsonify({'error': 'Chave da API Google nao configurada. Configure GOOGLE_API_KEY nas configuracoes.'}), 400
+    with transaction() as cursor:
+        # PDF da biblioteca: o gateway le o texto completo; upload direto vai no job
+        payload = {'pdf_id': pdf_id} if pdf_id else {'text': text}
+        job_id = submit_ai_job(cursor, session['user_id'], 'summary', payload)
     
-    try:
-        prompt = f"""Voce e um assistente educacional especializado em criar resumos de estudo. 
-        Responda sempre em portugues brasileiro.
-        Retorne APENAS um JSON valido, sem texto adicional, com a seguinte estrutura:
-        {{
-            "title": "titulo do conteudo",
-            "short_summary": "resumo curto em 2-3 frases",
-            "full_summary": "resumo completo e detalhado",
-            "topics": ["topico 1", "topico 2", "topico 3"],
-            "flashcards": [{{"front": "pergunta", "back": "resposta"}}],
-            "mind_map": {{"central": "tema central", "branches": [{{"name": "subtema", "items": ["item1", "item2"]}}]}}
-        }}
-        
-        Crie um resumo educacional completo do seguinte texto:
-        
-        {text[:8000]}"""
-        
-        response = client.generate_content(prompt)
-        response_text = response.text.strip()
-        
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
-        
-        start_idx = response_text.find('{')
-        end_idx = response_text.rfind('}')
-        if start_idx != -1 and end_idx != -1:
-            response_text = response_text[start_idx:end_idx+1]
-        
-        result = json.loads(response_text)
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO summaries (user_id, title, original_text, short_summary, full_summary, topics, mind_map)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            session['user_id'],
-            result.get('title', 'Resumo'),
-            text[:5000],
-            result.get('short_summary', ''),
-            result.get('full_summary', ''),
-            json.dumps(result.get('topics', [])),
-            json.dumps(result.get('mind_map', {}))
-        ))
-        
-        summary_id = cursor.lastrowid
-        
-        for fc in result.get('flashcards', [])[:10]:
-            cursor.execute('''
-                INSERT INTO flashcards (user_id, summary_id, front, back, next_review)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session['user_id'], summary_id, fc['front'], fc['back'], datetime.now().strftime('%Y-%m-%d')))
-        
-        conn.commit()
-        add_xp(session['user_id'], 25)
-        conn.close()
-        
-        return jsonify({'success': True, 'summary': result, 'summary_id': summary_id})
-        
-    except json.JSONDecodeError as e:
-        return jsonify({'error': 'Erro ao processar resposta da IA. Tente novamente.'}), 500
-    except Exception as e:
-        return jsonify({'error': f'Erro ao gerar resumo: {str(e)}'}), 500
+    return ai_job_response(job_id, request.form)
 
 @app.route('/flashcards')
 @login_required
@@ -432,28 +493,36 @@ def flashcards():
     cursor.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],))
     user = cursor.fetchone()
     
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('''
-        SELECT * FROM flashcards 
-        WHERE user_id = ? AND (next_review IS NULL OR next_review <= ?)
-        ORDER BY next_review ASC
-    ''', (session['user_id'], today))
-    pending = [dict(row) for row in cursor.fetchall()]
+    pending, next_cursor = due_flashcards(cursor, session['user_id'])
+    due_count = count_due_flashcards(cursor, session['user_id'])
     
     cursor.execute('SELECT deck_name, COUNT(*) as count FROM flashcards WHERE user_id = ? GROUP BY deck_name', (session['user_id'],))
-    decks = [dict(row) for row in cursor.fetchall()]
+    decks = cursor.fetchall()
     
+    week_ago = day_number(datetime.now() - timedelta(days=7))
     cursor.execute('''
-        SELECT DATE(reviewed_at) as day, COUNT(*) as count, 
-               SUM(CASE WHEN quality >= 3 THEN 1 ELSE 0 END) as correct
-        FROM flashcard_reviews 
-        WHERE user_id = ? AND reviewed_at >= DATE('now', '-7 days')
-        GROUP BY DATE(reviewed_at)
-    ''', (session['user_id'],))
-    stats = [dict(row) for row in cursor.fetchall()]
+        SELECT day, reviews as count, correct_reviews as correct
+        FROM user_daily_stats 
+        WHERE user_id = ? AND day >= ? AND reviews > 0
+    ''', (session['user_id'], week_ago))
+    stats = [dict(row, day=day_to_date(row['day'])) for row in cursor.fetchall()]
+    
+    return render_template('flashcards.html', user=user, pending=pending, next_cursor=next_cursor,
+                          due_count=due_count, decks=decks, stats=stats)
+
+@app.route('/api/flashcards/due')
+@login_required
+def due_queue():
+    limit = min(max(request.args.get('limit', DUE_QUEUE_PAGE_SIZE, type=int), 1), 100)
+    after = request.args.get('cursor')
     
-    conn.close()
-    return render_template('flashcards.html', user=user, pending=pending, decks=decks, stats=stats)
+    cursor = get_db().cursor()
+    try:
+        cards, next_cursor = due_flashcards(cursor, session['user_id'], after, limit)
+    except ValueError:
+        return jsonify({'error': 'Cursor invalido'}), 400
+    
+    return jsonify({'success': True, 'cards': cards, 'next_cursor': next_cursor})
 
 @app.route('/api/flashcard/review', methods=['POST'])
 @login_required
@@ -462,48 +531,187 @@ def review_flashcard():
     flashcard_id = data.get('flashcard_id')
     quality = data.get('quality', 3)
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM flashcards WHERE id = ? AND user_id = ?', (flashcard_id, session['user_id']))
-    fc = cursor.fetchone()
-    
-    if not fc:
-        conn.close()
-        return jsonify({'error': 'Flashcard nao encontrado'}), 404
-    
-    repetitions, ease_factor, interval = sm2_algorithm(
-        quality, fc['repetitions'], fc['ease_factor'], fc['interval_days']
-    )
-    
-    next_review = (datetime.now() + timedelta(days=interval)).strftime('%Y-%m-%d')
-    
-    cursor.execute('''
-        UPDATE flashcards 
-        SET repetitions = ?, ease_factor = ?, interval_days = ?, next_review = ?, last_reviewed = ?
-        WHERE id = ?
-    ''', (repetitions, ease_factor, interval, next_review, datetime.now().strftime('%Y-%m-%d'), flashcard_id))
+    with transaction() as cursor:
+        cursor.execute('SELECT * FROM flashcards WHERE id = ? AND user_id = ?', (flashcard_id, session['user_id']))
+        fc = cursor.fetchone()
+        
+        if not fc:
+            return jsonify({'error': 'Flashcard nao encontrado'}), 404
+        
+        repetitions, ease_factor, interval = sm2_algorithm(
+            quality, fc['repetitions'], fc['ease_factor'], fc['interval_days']
+        )
+        
+        next_review = (datetime.now() + timedelta(days=interval)).strftime('%Y-%m-%d')
+        
+        cursor.execute('''
+            UPDATE flashcards 
+            SET repetitions = ?, ease_factor = ?, interval_days = ?, next_review = ?, last_reviewed = ?
+            WHERE id = ?
+        ''', (repetitions, ease_factor, interval, next_review, datetime.now().strftime('%Y-%m-%d'), flashcard_id))
+        
+        cursor.execute('''
+            INSERT INTO flashcard_reviews (flashcard_id, user_id, quality)
+            VALUES (?, ?, ?)
+        ''', (flashcard_id, session['user_id'], quality))
+        
+        bump_daily_goals(cursor, session['user_id'], flashcards=1)
+        bump_daily_stats(cursor, session['user_id'], reviews=1, correct_reviews=int(quality >= 3))
+        
+        xp = 5 if quality >= 3 else 2
+        add_xp(cursor, session['user_id'], xp)
+        forecast_cache.invalidate(cursor, session['user_id'])
     
-    cursor.execute('''
-        INSERT INTO flashcard_reviews (flashcard_id, user_id, quality)
-        VALUES (?, ?, ?)
-    ''', (flashcard_id, session['user_id'], quality))
+    return jsonify({'success': True, 'next_review': next_review, 'xp_earned': xp})
+
+MAX_REVIEW_BATCH = 500
+
+def parse_reviewed_at(value):
+    """Converte o reviewed_at ISO-8601 enviado pelo cliente em (UTC para o banco, horario local)
+
+    Valores ausentes, invalidos ou no futuro viram o horario atual.
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        reviewed = datetime.fromisoformat(value) if value else now
+    except (TypeError, ValueError):
+        reviewed = now
+    if reviewed.tzinfo is None:
+        reviewed = reviewed.replace(tzinfo=timezone.utc)
+    reviewed = min(reviewed, now)
+    return reviewed.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'), reviewed.astimezone().replace(tzinfo=None)
+
+@app.route('/api/flashcard/review-batch', methods=['POST'])
+@login_required
+def review_flashcards_batch():
+    data = request.get_json(silent=True) or {}
+    items = data.get('reviews')
     
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('''
-        INSERT INTO daily_goals (user_id, date, flashcards_done)
-        VALUES (?, ?, 1)
-        ON CONFLICT(user_id, date) DO UPDATE SET
-        flashcards_done = flashcards_done + 1
-    ''', (session['user_id'], today))
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Nenhuma revisao enviada'}), 400
+    if len(items) > MAX_REVIEW_BATCH:
+        return jsonify({'error': f'Maximo de {MAX_REVIEW_BATCH} revisoes por lote'}), 400
     
-    xp = 5 if quality >= 3 else 2
-    add_xp(session['user_id'], xp)
+    reviews = []
+    for item in items:
+        try:
+            flashcard_id = int(item['flashcard_id'])
+            quality = int(item.get('quality', 3))
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'Revisao invalida'}), 400
+        if not 0 <= quality <= 5:
+            return jsonify({'error': 'Qualidade deve estar entre 0 e 5'}), 400
+        reviews.append((flashcard_id, quality, item.get('reviewed_at')))
+    
+    card_ids = sorted({flashcard_id for flashcard_id, _, _ in reviews})
+    
+    with transaction() as cursor:
+        placeholders = ','.join('?' * len(card_ids))
+        cursor.execute(f'''
+            SELECT id, repetitions, ease_factor, interval_days FROM flashcards
+            WHERE user_id = ? AND id IN ({placeholders})
+        ''', [session['user_id']] + card_ids)
+        cards = {fc['id']: [fc['repetitions'], fc['ease_factor'], fc['interval_days'], None, None] for fc in cursor.fetchall()}
+        
+        missing = [flashcard_id for flashcard_id in card_ids if flashcard_id not in cards]
+        if missing:
+            return jsonify({'error': 'Flashcard nao encontrado', 'flashcard_ids': missing}), 404
+        
+        # Aplica as revisoes em ordem: o mesmo card pode aparecer mais de uma vez no lote
+        review_rows = []
+        xp = 0
+        # Revisoes feitas offline contam no dia em que aconteceram: {date: [revisoes, acertos]}
+        per_day = {}
+        for flashcard_id, quality, reviewed_at in reviews:
+            reviewed_utc, reviewed_local = parse_reviewed_at(reviewed_at)
+            card = cards[flashcard_id]
+            card[0], card[1], card[2] = sm2_algorithm(quality, card[0], card[1], card[2])
+            card[3] = (reviewed_local + timedelta(days=card[2])).strftime('%Y-%m-%d')
+            card[4] = reviewed_local.strftime('%Y-%m-%d')
+            review_rows.append((flashcard_id, session['user_id'], quality, reviewed_utc))
+            xp += 5 if quality >= 3 else 2
+            day = per_day.setdefault(reviewed_local.date(), [0, 0])
+            day[0] += 1
+            day[1] += quality >= 3
+        
+        cursor.executemany('''
+            UPDATE flashcards 
+            SET repetitions = ?, ease_factor = ?, interval_days = ?, next_review = ?, last_reviewed = ?
+            WHERE id = ?
+        ''', [tuple(card) + (flashcard_id,) for flashcard_id, card in cards.items()])
+        
+        cursor.executemany('''
+            INSERT INTO flashcard_reviews (flashcard_id, user_id, quality, reviewed_at)
+            VALUES (?, ?, ?, ?)
+        ''', review_rows)
+        
+        for day, (count, correct) in per_day.items():
+            bump_daily_goals(cursor, session['user_id'], flashcards=count, day=day)
+            bump_daily_stats(cursor, session['user_id'], day=day, reviews=count, correct_reviews=correct)
+        add_xp(cursor, session['user_id'], xp)
+        forecast_cache.invalidate(cursor, session['user_id'])
     
-    conn.commit()
-    conn.close()
+    return jsonify({
+        'success': True,
+        'reviewed': len(reviews),
+        'xp_earned': xp,
+        'next_review': {flashcard_id: card[3] for flashcard_id, card in cards.items()}
+    })
+
+@app.route('/api/flashcards/shift-overdue', methods=['POST'])
+@login_required
+def shift_overdue_flashcards():
+    data = request.get_json(silent=True) or {}
+    try:
+        days = int(data.get('days', 7))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Numero de dias invalido'}), 400
+    if not 1 <= days <= 365:
+        return jsonify({'error': 'Numero de dias deve estar entre 1 e 365'}), 400
+    
+    with transaction() as cursor:
+        deck = Deck.load(cursor, session['user_id'], data.get('deck_name'))
+        updated = deck.save(cursor, shift_overdue(deck, days))
+        forecast_cache.invalidate(cursor, session['user_id'])
+    
+    return jsonify({'success': True, 'updated': updated})
+
+@app.route('/api/flashcards/balance', methods=['POST'])
+@login_required
+def balance_flashcards():
+    data = request.get_json(silent=True) or {}
+    try:
+        max_per_day = int(data.get('max_per_day', 50))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Limite diario invalido'}), 400
+    if max_per_day < 1:
+        return jsonify({'error': 'Limite diario deve ser pelo menos 1'}), 400
+    
+    with transaction() as cursor:
+        deck = Deck.load(cursor, session['user_id'], data.get('deck_name'))
+        updated = deck.save(cursor, balance_due_dates(deck, max_per_day))
+        forecast_cache.invalidate(cursor, session['user_id'])
+    
+    return jsonify({'success': True, 'updated': updated})
+
+FORECAST_HORIZONS = (7, 30, 90)
+
+@app.route('/api/flashcards/forecast')
+@login_required
+def review_forecast():
+    days = request.args.get('days', 30, type=int)
+    if days not in FORECAST_HORIZONS:
+        return jsonify({'error': f'Periodo deve ser um de {FORECAST_HORIZONS}'}), 400
+    project = request.args.get('project', '0') == '1'
+    user_id = session['user_id']
+    
+    cursor = get_db().cursor()
+    forecast = forecast_cache.get(
+        cursor, user_id, days, project, lambda: forecast_due(cursor, user_id, days, project)
+    )
     
-    return jsonify({'success': True, 'next_review': next_review, 'xp_earned': xp})
+    return jsonify({'success': True, 'days': days, 'forecast': forecast,
+                    'total': sum(day['due'] for day in forecast)})
 
 @app.route('/api/flashcard/create', methods=['POST'])
 @login_required
@@ -516,19 +724,23 @@ def create_flashcard():
     if not front or not back:
         return jsonify({'error': 'Frente e verso sao obrigatorios'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO flashcards (user_id, front, back, deck_name, next_review)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (session['user_id'], front, back, deck_name, datetime.now().strftime('%Y-%m-%d')))
-    
-    flashcard_id = cursor.lastrowid
-    add_xp(session['user_id'], 5)
+    signature = Signature.of(front)
     
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        # force=true cria o card mesmo que ja exista um parecido
+        duplicate_of = None if data.get('force') else find_duplicate(cursor, session['user_id'], front, signature)
+        if duplicate_of:
+            return jsonify({'error': 'Ja existe um flashcard parecido', 'duplicate_of': duplicate_of}), 409
+        
+        cursor.execute('''
+            INSERT INTO flashcards (user_id, front, back, deck_name, next_review)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (session['user_id'], front, back, deck_name, datetime.now().strftime('%Y-%m-%d')))
+        
+        flashcard_id = cursor.lastrowid
+        index_flashcard(cursor, session['user_id'], flashcard_id, front, signature)
+        add_xp(cursor, session['user_id'], 5)
+        forecast_cache.invalidate(cursor, session['user_id'])
     
     return jsonify({'success': True, 'flashcard_id': flashcard_id})
 
@@ -551,7 +763,6 @@ def study_plan():
     ''', (session['user_id'],))
     tasks = cursor.fetchall()
     
-    conn.close()
     return render_template('study_plan.html', user=user, plans=plans, tasks=tasks)
 
 @app.route('/api/create-plan', methods=['POST'])
@@ -559,56 +770,18 @@ def study_plan():
 def create_plan():
     data = request.get_json()
     
-    title = data.get('title', 'Meu Plano de Estudos')
-    objective = data.get('objective', 'ENEM')
-    daily_hours = float(data.get('daily_hours', 2))
-    deadline = data.get('deadline')
-    subjects = data.get('subjects', [])
+    payload = {
+        'title': data.get('title', 'Meu Plano de Estudos'),
+        'objective': data.get('objective', 'ENEM'),
+        'daily_hours': float(data.get('daily_hours', 2)),
+        'deadline': data.get('deadline'),
+        'subjects': data.get('subjects', []),
+    }
     
-    conn = get_db()
-    cursor = conn.cursor()
+    with transaction() as cursor:
+        job_id = submit_ai_job(cursor, session['user_id'], 'plan', payload)
     
-    cursor.execute('''
-        INSERT INTO study_plans (user_id, title, objective, daily_hours, deadline, subjects)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (session['user_id'], title, objective, daily_hours, deadline, json.dumps(subjects)))
-    
-    plan_id = cursor.lastrowid
-    
-    if deadline and subjects:
-        client = get_gemini_client()
-        if client:
-            try:
-                prompt = f"""Voce e um planejador de estudos. Crie um cronograma de tarefas.
-                Responda em JSON:
-                {{"tasks": [{{"title": "titulo", "subject": "materia", "description": "descricao", "duration_minutes": 30, "priority": 1-5}}]}}
-                Crie tarefas variadas e distribuidas entre as materias. Maximo 20 tarefas.
-                
-                Crie um plano de estudos para {objective}. Materias: {', '.join(subjects)}. {daily_hours}h por dia ate {deadline}."""
-                
-                response = client.generate_content(prompt)
-                result = json.loads(response.text)
-                
-                start_date = datetime.now()
-                end_date = datetime.strptime(deadline, '%Y-%m-%d')
-                days_available = (end_date - start_date).days
-                
-                for i, task in enumerate(result.get('tasks', [])[:20]):
-                    task_date = start_date + timedelta(days=i % max(1, days_available))
-                    cursor.execute('''
-                        INSERT INTO study_tasks (plan_id, user_id, title, subject, description, scheduled_date, duration_minutes, priority)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (plan_id, session['user_id'], task['title'], task.get('subject', ''), 
-                          task.get('description', ''), task_date.strftime('%Y-%m-%d'),
-                          task.get('duration_minutes', 30), task.get('priority', 3)))
-            except:
-                pass
-    
-    add_xp(session['user_id'], 20)
-    conn.commit()
-    conn.close()
-    
-    return jsonify({'success': True, 'plan_id': plan_id})
+    return ai_job_response(job_id, data)
 
 @app.route('/api/task/complete', methods=['POST'])
 @login_required
@@ -616,25 +789,19 @@ def complete_task():
     data = request.get_json()
     task_id = data.get('task_id')
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE study_tasks SET is_completed = 1, completed_at = ?
-        WHERE id = ? AND user_id = ?
-    ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), task_id, session['user_id']))
-    
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('''
-        INSERT INTO daily_goals (user_id, date, tasks_done)
-        VALUES (?, ?, 1)
-        ON CONFLICT(user_id, date) DO UPDATE SET
-        tasks_done = tasks_done + 1
-    ''', (session['user_id'], today))
-    
-    add_xp(session['user_id'], 15)
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE study_tasks SET is_completed = 1, completed_at = ?
+            WHERE id = ? AND user_id = ? AND is_completed = 0
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), task_id, session['user_id']))
+        
+        # Tarefa inexistente ou ja concluida (ex: clique duplo): nada e contado de novo
+        if cursor.rowcount == 0:
+            return jsonify({'success': True, 'xp_earned': 0})
+        
+        bump_daily_stats(cursor, session['user_id'], tasks_completed=1)
+        bump_daily_goals(cursor, session['user_id'], tasks=1)
+        add_xp(cursor, session['user_id'], 15)
     
     return jsonify({'success': True, 'xp_earned': 15})
 
@@ -658,47 +825,22 @@ def quiz():
     ''', (session['user_id'],))
     attempts = cursor.fetchall()
     
-    conn.close()
     return render_template('quiz.html', user=user, quizzes=quizzes, attempts=attempts)
 
 @app.route('/api/generate-quiz', methods=['POST'])
 @login_required
 def generate_quiz():
     data = request.get_json()
-    subject = data.get('subject', 'Geral')
-    topic = data.get('topic', '')
-    num_questions = min(int(data.get('num_questions', 5)), 15)
+    payload = {
+        'subject': data.get('subject', 'Geral'),
+        'topic': data.get('topic', ''),
+        'num_questions': min(int(data.get('num_questions', 5)), 15),
+    }
     
-    client = get_gemini_client()
-    if not client:
-        return jsonify({'error': 'Chave da API Google nao configurada. Configure GOOGLE_API_KEY nas configuracoes.'}), 400
+    with transaction() as cursor:
+        job_id = submit_ai_job(cursor, session['user_id'], 'quiz', payload)
     
-    try:
-        prompt = f"""Voce cria questoes de estudo. Responda em JSON:
-        {{"questions": [{{"question": "pergunta", "options": ["a", "b", "c", "d"], "correct": 0, "explanation": "explicacao"}}]}}
-        Crie questoes educativas e claras. O campo 'correct' e o indice da resposta correta (0-3).
-        
-        Crie {num_questions} questoes sobre {subject}. Topico especifico: {topic}"""
-        
-        response = client.generate_content(prompt)
-        result = json.loads(response.text)
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO quizzes (user_id, title, subject, questions, total_questions)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (session['user_id'], f"Quiz de {subject}", subject, json.dumps(result['questions']), len(result['questions'])))
-        
-        quiz_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'quiz_id': quiz_id, 'questions': result['questions']})
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return ai_job_response(job_id, data)
 
 @app.route('/api/quiz/submit', methods=['POST'])
 @login_required
@@ -715,12 +857,12 @@ def submit_quiz():
     quiz = cursor.fetchone()
     
     if not quiz:
-        conn.close()
         return jsonify({'error': 'Quiz nao encontrado'}), 404
     
     questions = json.loads(quiz['questions'])
     score = 0
     results = []
+    weak_points = []
     
     for i, q in enumerate(questions):
         user_answer = answers[i] if i < len(answers) else -1
@@ -737,21 +879,23 @@ def submit_quiz():
         })
         
         if not is_correct:
-            cursor.execute('''
-                INSERT INTO weak_points (user_id, subject, topic)
-                VALUES (?, ?, ?)
-            ''', (session['user_id'], quiz['subject'], q['question'][:100]))
-    
-    cursor.execute('''
-        INSERT INTO quiz_attempts (quiz_id, user_id, answers, score, total, time_spent_seconds)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (quiz_id, session['user_id'], json.dumps(answers), score, len(questions), time_spent))
+            weak_points.append((session['user_id'], quiz['subject'], q['question'][:100]))
     
     xp_earned = score * 10
-    add_xp(session['user_id'], xp_earned)
     
-    conn.commit()
-    conn.close()
+    with transaction() as cursor:
+        cursor.executemany('''
+            INSERT INTO weak_points (user_id, subject, topic)
+            VALUES (?, ?, ?)
+        ''', weak_points)
+        
+        cursor.execute('''
+            INSERT INTO quiz_attempts (quiz_id, user_id, answers, score, total, time_spent_seconds)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (quiz_id, session['user_id'], json.dumps(answers), score, len(questions), time_spent))
+        
+        bump_daily_stats(cursor, session['user_id'], quizzes_taken=1)
+        add_xp(cursor, session['user_id'], xp_earned)
     
     return jsonify({
         'success': True,
@@ -773,7 +917,6 @@ def tutor():
     cursor.execute('SELECT * FROM chat_messages WHERE user_id = ? ORDER BY created_at DESC LIMIT 50', (session['user_id'],))
     messages = list(reversed(cursor.fetchall()))
     
-    conn.close()
     return render_template('tutor.html', user=user, messages=messages)
 
 @app.route('/api/chat', methods=['POST'])
@@ -796,69 +939,27 @@ def chat():
         user = cursor.fetchone()
         
         if not user:
-            conn.close()
             return jsonify({'error': 'Usuario nao encontrado'}), 404
         
         user_name = user['name']
         user_level = user['level']
         
-        cursor.execute('''
-            INSERT INTO chat_messages (user_id, role, content)
-            VALUES (?, 'user', ?)
-        ''', (session['user_id'], message))
-        conn.commit()
-        conn.close()
-        
-        client = get_gemini_client()
-        if not client:
-            return jsonify({'error': 'Chave da API Google nao configurada. Configure GOOGLE_API_KEY nas Secrets.'}), 400
-        
-        prompt = f"""Voce e o MentorMind, um tutor de estudos inteligente e amigavel.
-O aluno se chama {user_name} e esta no nivel {user_level}.
-
-Suas funcoes:
-- Explicar materias de forma clara e didatica
-- Ajudar com exercicios passo a passo
-- Dar dicas de estudo e memorizacao
-- Motivar o aluno
-- Adaptar a linguagem ao nivel do aluno
-- Corrigir redacoes quando solicitado
-
-Seja amigavel, paciente e encorajador. Use exemplos praticos.
-Responda sempre em portugues brasileiro.
-
-Pergunta do aluno: {message}"""
-        
-        response = client.generate_content(prompt)
-        
-        if not response or not response.text:
-            return jsonify({'error': 'API retornou resposta vazia. Tente novamente.'}), 500
-            
-        reply = response.text
-        
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO chat_messages (user_id, role, content)
-            VALUES (?, 'assistant', ?)
-        ''', (session['user_id'], reply))
-        conn.commit()
-        add_xp(session['user_id'], 2)
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute('''
+                INSERT INTO chat_messages (user_id, role, content)
+                VALUES (?, 'user', ?)
+            ''', (session['user_id'], message))
+            # A resposta do assistente e gravada pelo gateway quando a geracao termina
+            job_id = submit_ai_job(cursor, session['user_id'], 'chat', {
+                'message': message, 'user_name': user_name, 'user_level': user_level
+            })
         
-        return jsonify({'success': True, 'reply': reply})
+        return ai_job_response(job_id, data)
         
     except Exception as e:
-        error_msg = str(e)
-        print(f"Erro completo no chat: {error_msg}")
-        
-        if "API_KEY" in error_msg.upper() or "GOOGLE_API_KEY" in error_msg.upper():
-            return jsonify({'error': 'Chave da API nao configurada. Configure GOOGLE_API_KEY nas Secrets.'}), 400
-        
-        if "quota" in error_msg.lower():
-            return jsonify({'error': 'Limite de uso da API atingido. Tente novamente mais tarde.'}), 429
-            
-        return jsonify({'error': f'Erro ao processar mensagem: {error_msg}'}), 500
+        print(f"Erro completo no chat: {e}")
+        message, status = describe_ai_error(e)
+        return jsonify({'error': message}), status
 
 @app.route('/mentor')
 @login_required
@@ -873,71 +974,23 @@ def mentor():
     goals = cursor.fetchone()
     
     if not goals:
-        cursor.execute('INSERT INTO daily_goals (user_id, date) VALUES (?, ?)', (session['user_id'], today))
-        conn.commit()
+        with transaction() as tx:
+            tx.execute('INSERT OR IGNORE INTO daily_goals (user_id, date) VALUES (?, ?)', (session['user_id'], today))
         cursor.execute('SELECT * FROM daily_goals WHERE user_id = ? AND date = ?', (session['user_id'], today))
         goals = cursor.fetchone()
     
     cursor.execute('SELECT * FROM mentor_messages WHERE user_id = ? ORDER BY created_at DESC LIMIT 10', (session['user_id'],))
     messages = cursor.fetchall()
     
-    conn.close()
     return render_template('mentor.html', user=user, goals=goals, messages=messages)
 
 @app.route('/api/mentor/message', methods=['POST'])
 @login_required
 def get_mentor_message():
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],))
-    user = cursor.fetchone()
+    with transaction() as cursor:
+        job_id = submit_ai_job(cursor, session['user_id'], 'mentor', {})
     
-    today = datetime.now().strftime('%Y-%m-%d')
-    cursor.execute('SELECT * FROM daily_goals WHERE user_id = ? AND date = ?', (session['user_id'], today))
-    goals = cursor.fetchone()
-    
-    client = get_gemini_client()
-    if not client:
-        conn.close()
-        return jsonify({'error': 'Chave da API Google nao configurada. Configure GOOGLE_API_KEY nas configuracoes.'}), 400
-    
-    try:
-        prompt = f"""Voce e um mentor de estudos DISCIPLINADOR.
-        Seu estilo e: firme, direto, motivador mas exigente.
-        
-        - Se o aluno nao estudou: cobre com firmeza
-        - Se estudou pouco: incentive a fazer mais
-        - Se esta bem: elogie mas desafie a ir alem
-        - Use frases de impacto e motivacao
-        
-        Seja breve (2-3 frases). Use um tom de coach rigoroso.
-        Responda em portugues brasileiro.
-        
-        Gere uma mensagem de mentor para este aluno:
-        Nome: {user['name']}
-        Nivel: {user['level']}
-        Streak: {user['streak_days']} dias
-        Foco hoje: {goals['focus_achieved_minutes'] if goals else 0}/{goals['focus_goal_minutes'] if goals else 60} min
-        Flashcards: {goals['flashcards_done'] if goals else 0}/{goals['flashcards_goal'] if goals else 10}
-        Tarefas: {goals['tasks_done'] if goals else 0}/{goals['tasks_goal'] if goals else 3}"""
-        
-        response = client.generate_content(prompt)
-        message = response.text
-        
-        cursor.execute('''
-            INSERT INTO mentor_messages (user_id, message, message_type)
-            VALUES (?, ?, 'motivation')
-        ''', (session['user_id'], message))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True, 'message': message})
-        
-    except Exception as e:
-        conn.close()
-        return jsonify({'error': str(e)}), 500
+    return ai_job_response(job_id, request.get_json(silent=True))
 
 @app.route('/gamification')
 @login_required
@@ -957,17 +1010,38 @@ def gamification():
     ''', (session['user_id'],))
     badges = cursor.fetchall()
     
-    cursor.execute('''
-        SELECT u.username, u.name, u.level, u.xp, u.streak_days
-        FROM users u
-        ORDER BY u.xp DESC
-        LIMIT 20
-    ''')
-    ranking = cursor.fetchall()
+    ranking = xp_ranking.page(20)
+    my_rank, _ = xp_ranking.rank_of(session['user_id'])
     
-    conn.close()
     return render_template('gamification.html', user=user, badges=badges, ranking=ranking,
-                          level=level, current_xp=current_xp, xp_needed=xp_needed)
+                          level=level, current_xp=current_xp, xp_needed=xp_needed,
+                          my_rank=my_rank, total_users=xp_ranking.count())
+
+@app.route('/api/ranking')
+@login_required
+def xp_ranking_page():
+    # after: cursor da pagina anterior ("xp:id" do ultimo usuario); sem ele, a primeira pagina
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    after = request.args.get('after')
+    
+    if after:
+        try:
+            ranking = xp_ranking.page_after(after, limit)
+        except ValueError:
+            return jsonify({'error': 'Cursor invalido'}), 400
+    else:
+        ranking = xp_ranking.page(limit)
+    
+    my_rank, my_xp = xp_ranking.rank_of(session['user_id'])
+    
+    return jsonify({
+        'success': True,
+        'limit': limit,
+        'total': xp_ranking.count(),
+        'ranking': ranking,
+        'next_cursor': ranking[-1]['cursor'] if len(ranking) == limit else None,
+        'me': {'position': my_rank, 'xp': my_xp}
+    })
 
 @app.route('/profile')
 @login_required
@@ -977,18 +1051,18 @@ def profile():
     cursor.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],))
     user = cursor.fetchone()
     
-    cursor.execute('SELECT COUNT(*) as count FROM focus_sessions WHERE user_id = ?', (session['user_id'],))
-    focus_count = cursor.fetchone()['count']
-    
-    cursor.execute('SELECT COUNT(*) as count FROM flashcard_reviews WHERE user_id = ?', (session['user_id'],))
-    review_count = cursor.fetchone()['count']
-    
-    cursor.execute('SELECT COUNT(*) as count FROM summaries WHERE user_id = ?', (session['user_id'],))
-    summary_count = cursor.fetchone()['count']
+    cursor.execute('''
+        SELECT SUM(focus_sessions) as focus_count, SUM(reviews) as review_count,
+               SUM(summaries_generated) as summary_count
+        FROM user_daily_stats WHERE user_id = ?
+    ''', (session['user_id'],))
+    totals = cursor.fetchone()
+    focus_count = totals['focus_count'] or 0
+    review_count = totals['review_count'] or 0
+    summary_count = totals['summary_count'] or 0
     
     level, current_xp, xp_needed = calculate_level(user['xp'])
     
-    conn.close()
     return render_template('profile.html', user=user, focus_count=focus_count, 
                           review_count=review_count, summary_count=summary_count,
                           level=level, current_xp=current_xp, xp_needed=xp_needed)
@@ -1002,23 +1076,10 @@ def explain_text():
     if not text:
         return jsonify({'error': 'Texto vazio'}), 400
     
-    client = get_gemini_client()
-    if not client:
-        return jsonify({'error': 'Chave da API Google nao configurada. Configure GOOGLE_API_KEY nas configuracoes.'}), 400
+    with transaction() as cursor:
+        job_id = submit_ai_job(cursor, session['user_id'], 'explain', {'text': text})
     
-    try:
-        prompt = f"""Voce e um professor. Explique o texto de forma simples e didatica. Use exemplos se necessario. Responda em portugues brasileiro.
-        
-        Explique este trecho:
-        
-        {text}"""
-        
-        response = client.generate_content(prompt)
-        explanation = response.text
-        return jsonify({'success': True, 'explanation': explanation})
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return ai_job_response(job_id, data)
 
 @app.route('/weak-points')
 @login_required
@@ -1045,7 +1106,6 @@ def weak_points():
     ''', (session['user_id'],))
     details = cursor.fetchall()
     
-    conn.close()
     return render_template('weak_points.html', user=user, subjects=subjects, details=details)
 
 @app.before_request
@@ -1059,8 +1119,16 @@ def before_request():
     if request.endpoint and request.endpoint not in ['static', 'index', 'login', 'register']:
         pass
 
+@app.teardown_appcontext
+def teardown_db(exception):
+    release_db(exception)
+
 @app.after_request
 def after_request(response):
+    # Imagens em /media/ tem a URL derivada do conteudo: nunca mudam, mas sao por usuario
+    if request.path.startswith('/media/') and response.status_code in (200, 304):
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
     response.headers['Cache-Control'] = 'public, max-age=31536000' if request.path.startswith('/static/') else 'no-cache, no-store, must-revalidate'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '0'
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Teste de carga das rotas de IA com o modelo local (fake_llm.py): latencia p50/p95/p99 e vazao por rota
+
+Sem --url roda o app no proprio processo, com um banco temporario e AI_BACKEND=fake.
+Com --url manda HTTP para um servidor ja no ar, que deve ter sido iniciado com
+AI_BACKEND=fake (ex: AI_BACKEND=fake gunicorn app:app, com o gunicorn.conf.py do repo).
+
+    python benchmark_ai_routes.py --users 32 --duration 30 --mode async
+    FAKE_LLM_QUOTA_RATE=0.05 python benchmark_ai_routes.py --routes chat,page --mode stream
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+# Rotas e peso de cada uma no trafego; 'page' e uma pagina comum, para ver se elas
+# continuam rapidas enquanto as rotas de IA estao ocupadas. Os textos se repetem a
+# cada `variants` requisicoes, entao parte das chamadas acerta o cache de respostas.
+ROUTES = {
+    'page': {'weight': 4, 'method': 'GET', 'path': '/dashboard'},
+    'chat': {'weight': 3, 'path': '/api/chat', 'json': lambda n: {'message': f'Como estudar o assunto {n}?'}, 'variants': 10 ** 9},
+    'explain': {'weight': 2, 'path': '/api/explain', 'json': lambda n: {'text': f'Trecho de estudo numero {n}'}, 'variants': 20},
+    'quiz': {'weight': 1, 'path': '/api/generate-quiz', 'json': lambda n: {'subject': f'Materia {n}', 'topic': 'geral', 'num_questions': 5}, 'variants': 20},
+    'summary': {'weight': 1, 'path': '/api/generate-summary', 'form': lambda n: {'text': f'Conteudo {n}. ' + 'Texto de estudo para resumir. ' * 40}, 'variants': 20},
+    'plan': {'weight': 0.5, 'path': '/api/create-plan', 'json': lambda n: {'title': 'Plano', 'objective': 'ENEM', 'daily_hours': 2, 'deadline': '2030-01-01', 'subjects': [f'Materia {n}']}, 'variants': 20},
+    'mentor': {'weight': 1, 'path': '/api/mentor/message', 'json': lambda n: {}, 'variants': 1},
+}
+STREAM_ROUTES = ('chat', 'explain')
+POLL_INTERVAL = 0.2
+
+class Response:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return {}
+
+class InProcessClient:
+    """Cliente de teste do Flask; cada usuario virtual tem o seu (e o seu cookie de sessao)"""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, json_body=None, form=None, headers=None, on_first_byte=None):
+        response = self._client.open(path, method=method, json=json_body, data=form, headers=headers or {}, buffered=False)
+        chunks = []
+        for chunk in response.response:
+            if on_first_byte and not chunks:
+                on_first_byte()
+            chunks.append(chunk)
+        response.close()
+        return Response(response.status_code, b''.join(chunks))
+
+class HttpClient:
+    """Mesmo trafego por HTTP, contra um servidor em --url"""
+
+    def __init__(self, base_url):
+        self._base_url = base_url.rstrip('/')
+        self._opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, json_body=None, form=None, headers=None, on_first_byte=None):
+        headers = dict(headers or {})
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        request = urllib.request.Request(self._base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self._opener.open(request, timeout=300) as response:
+                return Response(response.status, self._read(response, on_first_byte))
+        except urllib.error.HTTPError as e:
+            return Response(e.code, e.read())
+
+    @staticmethod
+    def _read(response, on_first_byte):
+        chunks = []
+        while True:
+            chunk = response.read1(65536)
+            if not chunk:
+                return b''.join(chunks)
+            if on_first_byte and not chunks:
+                on_first_byte()
+            chunks.append(chunk)
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, route, seconds, status=None):
+        with self._lock:
+            if status is None:
+                self.latencies.setdefault(route, []).append(seconds)
+            else:
+                counts = self.errors.setdefault(route, {})
+                counts[status] = counts.get(status, 0) + 1
+
+def register(client, index):
+    name = f'carga{index}_{random.randrange(10 ** 9)}'
+    response = client.request('POST', '/register', form={'username': name, 'email': f'{name}@teste', 'password': 'senha', 'name': name})
+    if response.status >= 400:
+        raise RuntimeError(f'Falha ao registrar o usuario de teste: HTTP {response.status}')
+
+def stream_error(body):
+    """Status HTTP do evento 'error' de uma resposta SSE; None se ela terminou bem"""
+    for block in body.decode().split('\n\n'):
+        if block.startswith('event: error'):
+            return json.loads(block.split('data: ', 1)[1]).get('status', 500)
+    return None
+
+def call(client, route, n, mode, recorder):
+    """Uma requisicao completa: ate o resultado do job, nao so ate o 202"""
+    spec = ROUTES[route]
+    payload = {}
+    if 'json' in spec:
+        payload['json_body'] = spec['json'](n % spec['variants'])
+    if 'form' in spec:
+        payload['form'] = spec['form'](n % spec['variants'])
+
+    start = time.perf_counter()
+    if route == 'page':
+        response = client.request('GET', spec['path'])
+        status = None if response.status == 200 else response.status
+        recorder.record(route, time.perf_counter() - start, status)
+        return
+
+    if mode == 'stream' and route in STREAM_ROUTES:
+        first = []
+        payload['json_body'] = dict(payload['json_body'], stream=True)
+        response = client.request('POST', spec['path'], on_first_byte=lambda: first.append(time.perf_counter()), **payload)
+        status = response.status if response.status != 200 else stream_error(response.body)
+        if first and status is None:
+            recorder.record(f'{route} (1o token)', first[0] - start)
+        recorder.record(route, time.perf_counter() - start, status)
+        return
+
+    # Esperar na requisicao e opt-in; sem o Prefer as rotas voltam 202
+    headers = {'Prefer': 'wait=100'} if mode == 'sync' else {}
+    response = client.request('POST', spec['path'], headers=headers, **payload)
+    body = response.json()
+    while response.status == 202:
+        time.sleep(POLL_INTERVAL)
+        job = client.request('GET', body['status_url']).json().get('job', {})
+        if job.get('status') == 'done':
+            response = Response(200, b'')
+        elif job.get('status') in ('failed', 'cancelled'):
+            response = Response(job.get('error_status') or 500, b'')
+    recorder.record(route, time.perf_counter() - start, None if response.status == 200 else response.status)
+
+def run(users=16, duration=30.0, mode='async', routes=tuple(ROUTES), url=None, seed=42):
+    if url:
+        make_client = lambda: HttpClient(url)
+    else:
+        # Banco temporario e modelo local, definidos antes de importar o app
+        os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='mentormind-carga-'), 'carga.db')
+        os.environ['AI_BACKEND'] = 'fake'
+        os.environ.setdefault('SESSION_SECRET', 'carga')
+        from app import app
+        make_client = lambda: InProcessClient(app)
+
+    clients = [make_client() for _ in range(users)]
+    for index, client in enumerate(clients):
+        register(client, index)
+
+    recorder = Recorder()
+    counter = iter(range(10 ** 12))
+    counter_lock = threading.Lock()
+    weights = [ROUTES[route]['weight'] for route in routes]
+    deadline = time.perf_counter() + duration
+
+    def virtual_user(client, rng):
+        while time.perf_counter() < deadline:
+            route = rng.choices(routes, weights)[0]
+            with counter_lock:
+                n = next(counter)
+            try:
+                call(client, route, n, mode, recorder)
+            except Exception as e:
+                print(f"Erro em {route}: {e}")
+                recorder.record(route, 0, 'excecao')
+
+    print(f"{users} usuarios por {duration:.0f}s, modo {mode}, {'servidor ' + url if url else 'app no processo (AI_BACKEND=fake)'}")
+    start = time.perf_counter()
+    threads = [threading.Thread(target=virtual_user, args=(client, random.Random(seed + i)), daemon=True)
+               for i, client in enumerate(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"  {'rota':<18} {'ok':>6} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>7}")
+    for route in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = np.array(recorder.latencies.get(route, [])) * 1000
+        errors = recorder.errors.get(route, {})
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (float('nan'),) * 3
+        print(f"  {route:<18} {len(latencies):>6} {sum(errors.values()):>6} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f} "
+              f"{len(latencies) / elapsed:>7.2f}" + (f"  erros: {errors}" if errors else ''))
+    return recorder
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=16, help='usuarios virtuais simultaneos')
+    parser.add_argument('--duration', type=float, default=30, help='segundos de carga')
+    parser.add_argument('--mode', choices=('async', 'sync', 'stream'), default='async',
+                        help='async: 202 + polling; sync: espera na requisicao (Prefer: wait); stream: SSE em chat/explain')
+    parser.add_argument('--routes', default=','.join(ROUTES), help=f"rotas separadas por virgula ({', '.join(ROUTES)})")
+    parser.add_argument('--url', help='servidor ja no ar (com AI_BACKEND=fake); sem isso o app roda no processo')
+    args = parser.parse_args()
+    selected = tuple(route.strip() for route in args.routes.split(',') if route.strip())
+    unknown = [route for route in selected if route not in ROUTES]
+    if unknown:
+        parser.error(f"rotas desconhecidas: {', '.join(unknown)}")
+    run(args.users, args.duration, args.mode, selected, args.url)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""Benchmark do calculo de nivel: loop original vs tabela pre-calculada (bisect) vs lote NumPy"""
+
+import random
+import time
+
+from database import calculate_level, calculate_levels
+
+def calculate_level_loop(xp):
+    """Implementacao original, nivel a nivel, usada como referencia"""
+    level = 1
+    xp_needed = 100
+    total_xp = 0
+    while total_xp + xp_needed <= xp:
+        total_xp += xp_needed
+        level += 1
+        xp_needed = int(xp_needed * 1.5)
+    return level, xp - total_xp, xp_needed
+
+def measure(label, func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    print(f"  {label:<28} {best * 1000:10.2f} ms")
+    return best
+
+def run(count=100_000, max_xp=10 ** 15):
+    rng = random.Random(42)
+    xp_values = [rng.randrange(0, max_xp) for _ in range(count)]
+
+    # Confere que as tres versoes retornam exatamente o mesmo resultado
+    levels, progress, needed = calculate_levels(xp_values)
+    for i, xp in enumerate(xp_values[:5000]):
+        expected = calculate_level_loop(xp)
+        assert calculate_level(xp) == expected
+        assert (int(levels[i]), int(progress[i]), int(needed[i])) == expected
+
+    print(f"{count} valores de XP entre 0 e {max_xp}:")
+    loop = measure('loop original', lambda: [calculate_level_loop(xp) for xp in xp_values])
+    table = measure('tabela + bisect', lambda: [calculate_level(xp) for xp in xp_values])
+    batch = measure('lote NumPy (searchsorted)', lambda: calculate_levels(xp_values))
+    print(f"  bisect: {loop / table:.1f}x mais rapido | lote: {loop / batch:.1f}x mais rapido")
+
+if __name__ == '__main__':
+    run()
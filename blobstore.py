@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from functools import partial
+
+from database import init_db, transaction, after_commit
+
+# Arquivos enviados ficam em uploads/blobs/<2 primeiros hex>/<sha256>, um por conteudo
+UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+BLOB_FOLDER = os.path.join(UPLOAD_ROOT, 'blobs')
+# Derivados de um blob (ex: miniaturas) em uploads/variants/<2 hex>/<sha256>_<nome>
+VARIANT_FOLDER = os.path.join(UPLOAD_ROOT, 'variants')
+READ_CHUNK = 1024 * 1024
+# Arquivos sem registro em blobs (temporarios de transacoes desfeitas, variantes de um
+# blob que nunca foi confirmado) so sao varridos depois dessa idade, em segundos
+ORPHAN_GRACE_SECONDS = 3600
+
+def blob_name(sha256):
+    """Caminho do blob relativo a pasta de uploads, como fica em pdfs.filename"""
+    return os.path.join('blobs', sha256[:2], sha256)
+
+def blob_path(sha256):
+    return os.path.join(UPLOAD_ROOT, blob_name(sha256))
+
+def variant_path(sha256, name):
+    return os.path.join(VARIANT_FOLDER, sha256[:2], f'{sha256}_{name}')
+
+def write_variant(sha256, name, data):
+    """Grava um derivado do blob de forma atomica (quem le nunca ve o arquivo pela metade)"""
+    path = variant_path(sha256, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return path
+
+def save_stream(stream):
+    """Grava o upload em um arquivo temporario calculando o SHA-256 no caminho
+
+    Retorna (sha256, tamanho, caminho temporario); store() decide se ele vira o blob.
+    """
+    os.makedirs(BLOB_FOLDER, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=BLOB_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(READ_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return digest.hexdigest(), size, temp_path
+
+def store(cursor, sha256, size, temp_path):
+    """Registra mais uma referencia ao blob, dentro da transacao do chamador
+
+    O arquivo temporario vira o blob (um rename atomico) antes do commit, ainda
+    com o lock de escrita: quem ler o caminho depois do commit, em qualquer
+    processo, ja encontra o arquivo, e collect_garbage nao roda no meio. Se a
+    transacao for desfeita o blob fica sem registro e e varrido por
+    collect_garbage(sweep_orphans=True). Retorna o caminho do blob.
+    """
+    cursor.execute('''
+        INSERT INTO blobs (sha256, size, refcount) VALUES (?, ?, 1)
+        ON CONFLICT (sha256) DO UPDATE SET refcount = refcount + 1
+    ''', (sha256, size))
+    path = blob_path(sha256)
+    _place(temp_path, path)
+    return path
+
+def _place(temp_path, path):
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+def release(cursor, sha256):
+    """Remove uma referencia; blobs sem referencias sao apagados apos o commit"""
+    cursor.execute('UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ? RETURNING refcount', (sha256,))
+    row = cursor.fetchone()
+    if row and row['refcount'] <= 0:
+        after_commit(collect_garbage)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def collect_garbage(sweep_orphans=False):
+    """Apaga do disco e da tabela os blobs sem referencias; retorna quantos arquivos foram apagados
+
+    Com sweep_orphans tambem percorre as pastas de uploads atras de arquivos sem
+    registro em blobs, mais velhos que ORPHAN_GRACE_SECONDS.
+    """
+    with transaction() as cursor:
+        cursor.execute('DELETE FROM blobs WHERE refcount <= 0 RETURNING sha256')
+        paths = []
+        for row in cursor.fetchall():
+            paths += [blob_path(row['sha256'])] + glob.glob(variant_path(row['sha256'], '*'))
+        if sweep_orphans:
+            paths += _orphans(cursor)
+        # Ainda com o lock de escrita: um store() concorrente so coloca o arquivo
+        # no lugar depois, dentro da propria transacao
+        for path in paths:
+            _remove(path)
+    return len(paths)
+
+def _orphans(cursor):
+    cursor.execute('SELECT sha256 FROM blobs')
+    known = {row['sha256'] for row in cursor.fetchall()}
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    orphans = []
+    for path in glob.glob(os.path.join(BLOB_FOLDER, '*')) + glob.glob(os.path.join(BLOB_FOLDER, '*', '*')) \
+            + glob.glob(os.path.join(VARIANT_FOLDER, '*', '*')):
+        if os.path.isdir(path):
+            continue
+        sha256 = os.path.basename(path).split('_')[0]
+        if (sha256 not in known or path.endswith('.part')) and os.path.getmtime(path) < cutoff:
+            orphans.append(path)
+    return orphans
+
+def import_file(cursor, path):
+    """Copia um arquivo ja salvo para o store (usado para migrar uploads antigos)
+
+    O original so e apagado depois do commit; se a transacao for desfeita ele
+    continua onde estava.
+    """
+    with open(path, 'rb') as f:
+        sha256, size, temp_path = save_stream(f)
+    store(cursor, sha256, size, temp_path)
+    after_commit(partial(_remove, path))
+    return sha256
+
+if __name__ == '__main__':
+    # python blobstore.py gc: blobs sem referencias e arquivos orfaos
+    init_db()
+    if 'gc' in sys.argv[1:]:
+        print(f"{collect_garbage(sweep_orphans=True)} arquivos sem referencias removidos")
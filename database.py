@@ -1,42 +1,276 @@
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import sys
+from datetime import date, datetime, timedelta
 import json
 import threading
 import time
+import queue
+from contextlib import contextmanager
+from functools import lru_cache
+from bisect import bisect_right
 
 # SQLite Cloud connection string
 SQLITECLOUD_URL = os.environ.get('SQLITECLOUD_URL', 'sqlitecloud://ck43o40wdz.g4.sqlite.cloud:8860/mentormind.db?apikey=5uGL1tWmzFabimtNUzz0LGPLyKO7QKe6PiyIliCuboE')
 
+# DB_PATH permite apontar para outro arquivo (ex: benchmark_ai_routes.py usa um banco temporario)
+DB_PATH = os.environ.get('DB_PATH') or os.path.join(os.path.dirname(__file__), 'mentormind.db')
+
+# Tamanho maximo do pool de conexoes ociosas por processo
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+
+# PRAGMAs aplicados uma unica vez, quando a conexao e criada
+DB_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('cache_size', -32000),
+    ('temp_store', 'MEMORY'),
+)
+
+# (tabela, coluna de origem, coluna gerada com o numero do dia)
+DAY_COLUMNS = (
+    ('focus_sessions', 'started_at', 'started_day'),
+    ('flashcard_reviews', 'reviewed_at', 'reviewed_day'),
+    ('flashcards', 'next_review', 'next_review_day'),
+)
+
+# Contadores do rollup diario user_daily_stats, na ordem das colunas
+DAILY_STATS_COUNTERS = (
+    'focus_minutes',
+    'focus_sessions',
+    'reviews',
+    'correct_reviews',
+    'tasks_completed',
+    'summaries_generated',
+    'quizzes_taken',
+)
+
+# Cards por pagina da fila de revisao (due_flashcards)
+DUE_QUEUE_PAGE_SIZE = 20
+
+# Tabelas indexadas na busca (search_index): tipo, codigo no rowid, tabela, titulo, corpo
+# e colunas cuja alteracao reindexa a linha. rowid = id * 8 + codigo
+SEARCH_SOURCES = (
+    ('pdf', 1, 'pdfs', "{row}.original_name", "''", 'original_name'),
+    ('summary', 2, 'summaries', "{row}.title",
+     "COALESCE({row}.short_summary, '') || ' ' || COALESCE({row}.full_summary, '')", 'title, short_summary, full_summary'),
+    ('flashcard', 3, 'flashcards', "{row}.front", "{row}.back", 'front, back'),
+    ('chat', 4, 'chat_messages', "''", "{row}.content", 'content'),
+)
+# O texto dos PDFs entra pelos pedacos de pdf_chunks, uma linha por pedaco com kind 'pdf':
+# rowid = ((pdf_id << 16 | pagina) << 8 | chunk_no) << 3 | PDF_CHUNK_CODE
+PDF_CHUNK_CODE = 5
+PDF_CHUNK_ROWID = f'(((({{row}}.pdf_id << 16) | {{row}}.page) << 8 | {{row}}.chunk_no) << 3 | {PDF_CHUNK_CODE})'
+
+# Arvore de Fenwick da contagem de usuarios por XP (tabela xp_tree, mantida por triggers):
+# cobre XP de 0 a 2**XP_TREE_BITS - 1 e o no 2**XP_TREE_BITS (a raiz) tem o total
+XP_TREE_BITS = 31
+
+# Diferenca entre date.toordinal() e o dia juliano usado pelo SQLite
+_JULIAN_DAY_OFFSET = 1721425
+
 _db_initialized = False
 _ping_thread = None
 
-def dict_factory(cursor, row):
-    """Factory customizado para retornar dicionários ao invés de Row objects"""
-    fields = [column[0] for column in cursor.description]
-    return {key: value for key, value in zip(fields, row)}
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+_pool_pid = os.getpid()
+_local = threading.local()
+
+class Row:
+    """Linha de resultado compacta: a tupla de valores mais um mapa nome -> indice
+
+    O mapa e compartilhado por todas as linhas da mesma consulta, entao cada
+    linha custa apenas um objeto com dois slots. Suporta row['col'], row[0],
+    row.get(), dict(row), acesso por atributo nos templates e JSON (as_dict()).
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return default if position is None else self._values[position]
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return self._values
+
+    def items(self):
+        return zip(self._index, self._values)
+
+    def as_dict(self):
+        return dict(zip(self._index, self._values))
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._index.keys() == other._index.keys() and self._values == other._values
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f'Row({self.as_dict()!r})'
+
+@lru_cache(maxsize=512)
+def _row_index(names):
+    return {name: position for position, name in enumerate(names)}
+
+_row_cache = threading.local()
+
+def row_factory(cursor, row):
+    """Factory que monta Row reaproveitando os metadados de colunas da consulta
+
+    cursor.description e o mesmo objeto para todas as linhas de um statement,
+    entao o mapa de colunas so e recalculado quando a consulta muda.
+    """
+    description = cursor.description
+    if getattr(_row_cache, 'description', None) is not description:
+        _row_cache.description = description
+        _row_cache.index = _row_index(tuple(column[0] for column in description))
+    return Row(_row_cache.index, row)
+
+def _connect():
+    """Abre e configura uma nova conexao SQLite"""
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False, cached_statements=512)
+    # Row compacta ao invés de sqlite3.Row: também serializa em JSON
+    conn.row_factory = row_factory
+    conn.create_function('xp_level', 1, lambda xp: calculate_level(xp)[0], deterministic=True)
+    cursor = conn.cursor()
+    for name, value in DB_PRAGMAS:
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+    return conn
+
+def _acquire():
+    """Retira uma conexao do pool ou cria uma nova se ele estiver vazio"""
+    global _pool, _pool_pid
+
+    # Conexoes herdadas via fork (ex: gunicorn) nao podem ser reutilizadas
+    if _pool_pid != os.getpid():
+        _pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        _pool_pid = os.getpid()
+
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        return _connect()
 
 def get_db():
-    """Conecta ao banco de dados SQLite local"""
+    """Retorna a conexao SQLite da thread (ou requisicao) atual
+
+    A mesma conexao e reaproveitada por todas as chamadas ate release_db(),
+    que a devolve ao pool no teardown da requisicao.
+    """
     global _db_initialized
-    
+
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+
     try:
-        # Usar SQLite local ao invés de SQLite Cloud
-        db_path = os.path.join(os.path.dirname(__file__), 'mentormind.db')
-        conn = sqlite3.connect(db_path)
-        # Usa dict_factory ao invés de sqlite3.Row para compatibilidade
-        conn.row_factory = dict_factory
-        
+        conn = _acquire()
+
         # Inicializa o banco de dados na primeira conexão
         if not _db_initialized:
-            init_db_tables(conn)
+            migrate(conn)
             _db_initialized = True
-        
+
+        _local.conn = conn
         return conn
     except Exception as e:
         print(f"Erro ao conectar ao banco de dados: {e}")
         raise
 
+def release_db(exception=None):
+    """Devolve a conexao da thread atual ao pool
+
+    Transacoes deixadas abertas sao desfeitas para que a proxima requisicao
+    receba a conexao limpa. Registrado como teardown do Flask.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    _local.tx_depth = 0
+    _local.after_commit = []
+
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+        if _pool_pid != os.getpid():
+            conn.close()
+            return
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao liberar conexao: {e}")
+        conn.close()
+
+@contextmanager
+def transaction():
+    """Unidade de trabalho: todas as escritas feitas no cursor entram em um unico commit
+
+    Abre a transacao com BEGIN IMMEDIATE para pegar o lock de escrita logo no
+    inicio (evita 'database is locked' ao promover leitura para escrita).
+    Blocos aninhados reaproveitam a transacao mais externa.
+    """
+    conn = get_db()
+    depth = getattr(_local, 'tx_depth', 0)
+    cursor = conn.cursor()
+
+    if depth == 0 and not conn.in_transaction:
+        cursor.execute('BEGIN IMMEDIATE')
+
+    if depth == 0:
+        _local.after_commit = []
+    _local.tx_depth = depth + 1
+    try:
+        yield cursor
+    except Exception:
+        _local.tx_depth = depth
+        if depth == 0:
+            _local.after_commit = []
+            conn.rollback()
+        raise
+    _local.tx_depth = depth
+    if depth == 0:
+        conn.commit()
+        callbacks, _local.after_commit = _local.after_commit, []
+        for callback in callbacks:
+            callback()
+
+def after_commit(callback):
+    """Executa callback depois do commit da transacao atual (ou na hora, se nao houver)
+
+    Usado para atualizar caches em memoria somente com dados ja confirmados.
+    """
+    if getattr(_local, 'tx_depth', 0):
+        _local.after_commit.append(callback)
+    else:
+        callback()
+
 def ping_database():
     """Faz ping no banco de dados a cada 5 minutos para manter a conexão ativa"""
     while True:
@@ -44,7 +278,7 @@ def ping_database():
             conn = get_db()
             cursor = conn.cursor()
             cursor.execute('SELECT 1')
-            conn.close()
+            release_db()
             print(f"[{datetime.now()}] Ping ao SQLite Cloud realizado com sucesso")
         except Exception as e:
             print(f"[{datetime.now()}] Erro no ping ao SQLite Cloud: {e}")
@@ -60,9 +294,8 @@ def start_ping_thread():
         _ping_thread.start()
         print("Thread de ping ao SQLite Cloud iniciado")
 
-def init_db_tables(conn):
-    cursor = conn.cursor()
-    
+def _migration_1_base_schema(cursor):
+    """Schema inicial: tabelas e badges padrao"""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -314,307 +547,643 @@ def init_db_tables(conn):
             INSERT OR IGNORE INTO badges (name, description, icon, xp_reward, requirement_type, requirement_value)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', badge)
-    
-    conn.commit()
 
-def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
+def _migration_2_secondary_indexes(cursor):
+    """Indices compostos para as consultas por usuario + data das paginas"""
+    indexes = [
+        'CREATE INDEX IF NOT EXISTS idx_users_xp ON users (xp DESC)',
+        'CREATE INDEX IF NOT EXISTS idx_study_plans_user_active ON study_plans (user_id, is_active, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_study_tasks_user_date ON study_tasks (user_id, scheduled_date)',
+        'CREATE INDEX IF NOT EXISTS idx_focus_sessions_user_started ON focus_sessions (user_id, started_at)',
+        'CREATE INDEX IF NOT EXISTS idx_pdfs_user_uploaded ON pdfs (user_id, uploaded_at)',
+        'CREATE INDEX IF NOT EXISTS idx_summaries_user_created ON summaries (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_flashcards_user_next_review ON flashcards (user_id, next_review)',
+        'CREATE INDEX IF NOT EXISTS idx_flashcards_user_deck ON flashcards (user_id, deck_name)',
+        'CREATE INDEX IF NOT EXISTS idx_flashcard_reviews_user_reviewed ON flashcard_reviews (user_id, reviewed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_quizzes_user_created ON quizzes (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_quiz_attempts_user_completed ON quiz_attempts (user_id, completed_at)',
+        'CREATE INDEX IF NOT EXISTS idx_chat_messages_user_created ON chat_messages (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_mentor_messages_user_created ON mentor_messages (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_weak_points_user_subject ON weak_points (user_id, subject)',
+    ]
+    for statement in indexes:
+        cursor.execute(statement)
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            name TEXT NOT NULL,
-            level INTEGER DEFAULT 1,
-            xp INTEGER DEFAULT 0,
-            total_focus_time INTEGER DEFAULT 0,
-            streak_days INTEGER DEFAULT 0,
-            last_study_date TEXT,
-            is_premium INTEGER DEFAULT 0,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            preferences TEXT DEFAULT '{}'
-        )
-    ''')
+def _migration_3_day_columns(cursor):
+    """Colunas geradas com o numero do dia (juliano) ao lado dos timestamps TEXT
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS study_plans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            objective TEXT NOT NULL,
-            daily_hours REAL DEFAULT 2,
-            deadline TEXT,
-            subjects TEXT DEFAULT '[]',
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    ''')
+    Permitem filtrar e agrupar por dia com predicados de intervalo indexados
+    em vez de DATE(coluna), que nunca usa indice.
+    """
+    for table, source, column in DAY_COLUMNS:
+        cursor.execute(f'''
+            ALTER TABLE {table} ADD COLUMN {column} INTEGER
+            GENERATED ALWAYS AS (CAST(julianday({source}) + 0.5 AS INTEGER)) VIRTUAL
+        ''')
+
+    cursor.execute('DROP INDEX IF EXISTS idx_focus_sessions_user_started')
+    cursor.execute('DROP INDEX IF EXISTS idx_flashcard_reviews_user_reviewed')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_focus_sessions_user_day ON focus_sessions (user_id, started_day, duration_minutes)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcard_reviews_user_day ON flashcard_reviews (user_id, reviewed_day, quality)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcards_user_next_review_day ON flashcards (user_id, next_review_day)')
 
+def _migration_4_user_daily_stats(cursor):
+    """Rollup diario por usuario, mantido na mesma transacao de cada evento"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS study_tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            plan_id INTEGER NOT NULL,
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
             user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            subject TEXT,
-            description TEXT,
-            scheduled_date TEXT,
-            duration_minutes INTEGER DEFAULT 30,
-            is_completed INTEGER DEFAULT 0,
-            completed_at TEXT,
-            priority INTEGER DEFAULT 1,
-            FOREIGN KEY (plan_id) REFERENCES study_plans(id),
+            day INTEGER NOT NULL,
+            focus_minutes INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, day),
             FOREIGN KEY (user_id) REFERENCES users(id)
-        )
+        ) WITHOUT ROWID
     ''')
-
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_daily_stats_day ON user_daily_stats (day, user_id, focus_minutes)')
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS focus_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            duration_minutes INTEGER NOT NULL,
-            session_type TEXT DEFAULT 'pomodoro',
-            started_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            completed INTEGER DEFAULT 0,
-            xp_earned INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
+        INSERT OR REPLACE INTO user_daily_stats (user_id, day, focus_minutes)
+        SELECT user_id, started_day, SUM(duration_minutes)
+        FROM focus_sessions
+        WHERE started_day IS NOT NULL
+        GROUP BY user_id, started_day
     ''')
 
+def _migration_5_user_daily_stats_counters(cursor):
+    """Contadores de revisoes, tarefas, resumos e simulados no rollup diario"""
+    for column in DAILY_STATS_COUNTERS:
+        if column != 'focus_minutes':
+            cursor.execute(f'ALTER TABLE user_daily_stats ADD COLUMN {column} INTEGER DEFAULT 0')
+    backfill_daily_stats(cursor)
+
+def _migration_6_flashcards_next_review_not_null(cursor):
+    """Cards antigos sem next_review passam a vencer no dia em que foram criados
+
+    Assim a fila de revisao pode paginar por (next_review, id) sem tratar NULL.
+    """
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS pdfs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            filename TEXT NOT NULL,
-            original_name TEXT NOT NULL,
-            subject TEXT,
-            tags TEXT DEFAULT '[]',
-            content_text TEXT,
-            page_count INTEGER DEFAULT 0,
-            uploaded_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
+        UPDATE flashcards SET next_review = COALESCE(DATE(created_at), DATE('now'))
+        WHERE next_review IS NULL
     ''')
 
+def _migration_7_flashcard_dedup_index(cursor):
+    """Indice de quase duplicatas: hash do texto normalizado e baldes LSH da assinatura MinHash"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS summaries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS flashcard_signatures (
+            flashcard_id INTEGER PRIMARY KEY,
             user_id INTEGER NOT NULL,
-            pdf_id INTEGER,
-            title TEXT NOT NULL,
-            original_text TEXT,
-            short_summary TEXT,
-            full_summary TEXT,
-            topics TEXT DEFAULT '[]',
-            mind_map TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (pdf_id) REFERENCES pdfs(id)
+            text_hash INTEGER NOT NULL,
+            minhash BLOB NOT NULL,
+            FOREIGN KEY (flashcard_id) REFERENCES flashcards(id)
         )
     ''')
-
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcard_signatures_user_hash ON flashcard_signatures (user_id, text_hash)')
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS flashcards (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS flashcard_lsh (
             user_id INTEGER NOT NULL,
-            summary_id INTEGER,
-            deck_name TEXT DEFAULT 'Geral',
-            front TEXT NOT NULL,
-            back TEXT NOT NULL,
-            difficulty REAL DEFAULT 2.5,
-            interval_days INTEGER DEFAULT 1,
-            repetitions INTEGER DEFAULT 0,
-            next_review TEXT,
-            last_reviewed TEXT,
-            ease_factor REAL DEFAULT 2.5,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (summary_id) REFERENCES summaries(id)
-        )
+            bucket INTEGER NOT NULL,
+            flashcard_id INTEGER NOT NULL,
+            PRIMARY KEY (user_id, bucket, flashcard_id)
+        ) WITHOUT ROWID
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_flashcard_lsh_flashcard ON flashcard_lsh (flashcard_id)')
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS flashcard_reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            flashcard_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            quality INTEGER NOT NULL,
-            reviewed_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (flashcard_id) REFERENCES flashcards(id),
-            FOREIGN KEY (user_id) REFERENCES users(id)
+    # Assinaturas dos cards existentes: copia congelada de Signature.of() e
+    # Signature.buckets() do dedup.py do commit 32b85d7 (64 permutacoes, 16 faixas
+    # de 4 linhas, shingles de 4 bytes). A copia e intencional: a migracao nao pode
+    # mudar se o codigo do app mudar (tests/test_dedup.py confere que as duas
+    # ainda batem; um calculo novo pede uma migracao nova que reconstrua o indice).
+    import re
+    import unicodedata
+    from hashlib import blake2b
+    import numpy as np
+
+    prime = (1 << 31) - 1
+    rng = np.random.default_rng(20240601)
+    perm_a = rng.integers(1, prime, 64, dtype=np.uint64)
+    perm_b = rng.integers(0, prime, 64, dtype=np.uint64)
+
+    def hash64(data):
+        return int.from_bytes(blake2b(data, digest_size=8).digest(), 'big', signed=True)
+
+    cursor.execute('SELECT id, user_id, front FROM flashcards ORDER BY id')
+    for card in cursor.fetchall():
+        text = unicodedata.normalize('NFKD', card['front'] or '')
+        text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+        data = ' '.join(re.findall(r'\w+', text)).encode()
+        shingles = {data[i:i + 4] for i in range(max(len(data) - 3, 1))}
+        hashes = np.fromiter(
+            (int.from_bytes(blake2b(shingle, digest_size=4).digest(), 'big') for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        ) % prime
+        minhash = ((np.outer(hashes, perm_a) + perm_b) % prime).min(axis=0).astype(np.uint32)
+        cursor.execute(
+            'INSERT OR REPLACE INTO flashcard_signatures (flashcard_id, user_id, text_hash, minhash) VALUES (?, ?, ?, ?)',
+            (card['id'], card['user_id'], hash64(data), minhash.tobytes())
+        )
+        cursor.executemany(
+            'INSERT OR IGNORE INTO flashcard_lsh (user_id, bucket, flashcard_id) VALUES (?, ?, ?)',
+            [(card['user_id'], hash64(bytes([band]) + minhash[band * 4:(band + 1) * 4].tobytes()), card['id'])
+             for band in range(16)]
         )
-    ''')
 
+def _migration_8_ingest_jobs(cursor):
+    """Fila de extracao de PDFs, processada fora da requisicao (ver ingest.py)"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS quizzes (
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
+            pdf_id INTEGER NOT NULL UNIQUE,
             user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            subject TEXT,
-            questions TEXT NOT NULL,
-            total_questions INTEGER DEFAULT 0,
+            path TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            pages_done INTEGER DEFAULT 0,
+            pages_total INTEGER,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            started_at TEXT,
+            heartbeat_at TEXT,
+            finished_at TEXT,
+            FOREIGN KEY (pdf_id) REFERENCES pdfs(id),
             FOREIGN KEY (user_id) REFERENCES users(id)
         )
     ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ingest_jobs_pending ON ingest_jobs (status, id)
+        WHERE status IN ('queued', 'running')
+    ''')
+
+def _migration_9_pdf_chunks(cursor):
+    """Texto completo dos PDFs em pedacos por pagina, no lugar do content_text truncado
 
+    PDFs ja enviados voltam para a fila de ingestao para serem extraidos por inteiro.
+    """
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS quiz_attempts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            quiz_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            answers TEXT NOT NULL,
-            score INTEGER DEFAULT 0,
-            total INTEGER DEFAULT 0,
-            completed_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            time_spent_seconds INTEGER DEFAULT 0,
-            FOREIGN KEY (quiz_id) REFERENCES quizzes(id),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
+        CREATE TABLE IF NOT EXISTS pdf_chunks (
+            pdf_id INTEGER NOT NULL,
+            page INTEGER NOT NULL,
+            chunk_no INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (pdf_id, page, chunk_no),
+            FOREIGN KEY (pdf_id) REFERENCES pdfs(id)
+        ) WITHOUT ROWID
     ''')
+    cursor.execute("UPDATE ingest_jobs SET status = 'queued', attempts = 0 WHERE status = 'done'")
+    cursor.execute('''
+        INSERT INTO ingest_jobs (pdf_id, user_id, path)
+        SELECT id, user_id, ? || '/' || filename FROM pdfs
+        WHERE LOWER(filename) LIKE '%.pdf' AND id NOT IN (SELECT pdf_id FROM ingest_jobs)
+    ''', (os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'),))
 
+def _migration_10_blob_store(cursor):
+    """Uploads guardados por hash do conteudo (ver blobstore.py), com contagem de referencias
+
+    Arquivos ja enviados sao movidos para o store e os PDFs passam a apontar para o blob.
+    """
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
     ''')
+    cursor.execute('ALTER TABLE pdfs ADD COLUMN blob_sha256 TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_pdfs_blob ON pdfs (blob_sha256)')
+
+    from blobstore import UPLOAD_ROOT, blob_name, blob_path, import_file
+    cursor.execute('SELECT id, filename FROM pdfs')
+    for pdf in cursor.fetchall():
+        path = os.path.join(UPLOAD_ROOT, pdf['filename'])
+        if not os.path.isfile(path):
+            continue
+        sha256 = import_file(cursor, path)
+        cursor.execute('UPDATE pdfs SET blob_sha256 = ?, filename = ? WHERE id = ?',
+                       (sha256, blob_name(sha256), pdf['id']))
+        cursor.execute('UPDATE ingest_jobs SET path = ? WHERE pdf_id = ?', (blob_path(sha256), pdf['id']))
+
+def _search_triggers(cursor, kind, code, table, title, body, columns):
+    """Triggers que mantem as linhas de `table` no search_index"""
+    def values(row):
+        return (f"{row}.id * 8 + {code}, 'u' || {row}.user_id, '{kind}', "
+                f"{title.format(row=row)}, {body.format(row=row)}")
 
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_search_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO search_index (rowid, owner, kind, title, body) VALUES ({values('new')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_search_update AFTER UPDATE OF {columns} ON {table} BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 8 + {code};
+            INSERT INTO search_index (rowid, owner, kind, title, body) VALUES ({values('new')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table}_search_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 8 + {code};
+        END
+    ''')
+    cursor.execute(f'''
+        INSERT INTO search_index (rowid, owner, kind, title, body)
+        SELECT {values(table)} FROM {table}
+    ''')
+
+def _migration_11_search_index(cursor):
+    """Indice FTS5 unico para a busca, mantido por triggers em cada tabela de origem
+
+    owner ('u<id>') e kind sao colunas indexadas para que o filtro por usuario e
+    por tipo entre no MATCH, e nao seja aplicado depois sobre todos os resultados.
+    """
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS badges (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            description TEXT NOT NULL,
-            icon TEXT NOT NULL,
-            xp_reward INTEGER DEFAULT 50,
-            requirement_type TEXT NOT NULL,
-            requirement_value INTEGER NOT NULL
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            owner, kind, title, body,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
         )
     ''')
+    # Fontes como eram nesta versao; os PDFs indexavam a previa em content_text (ver migracao 15)
+    sources = (('pdf', 1, 'pdfs', "{row}.original_name", "COALESCE({row}.content_text, '')", 'original_name, content_text'),) + SEARCH_SOURCES[1:]
+    for source in sources:
+        _search_triggers(cursor, *source)
+
+def _migration_12_ingest_job_kind(cursor):
+    """A fila de ingestao tambem processa imagens (kind = 'image')"""
+    cursor.execute("ALTER TABLE ingest_jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'pdf'")
 
+def _migration_13_llm_cache(cursor):
+    """Nivel persistente do cache de respostas do modelo (ver llm_cache.py)"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_badges (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            badge_id INTEGER NOT NULL,
-            earned_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            FOREIGN KEY (badge_id) REFERENCES badges(id),
-            UNIQUE(user_id, badge_id)
-        )
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            endpoint TEXT NOT NULL,
+            model TEXT NOT NULL,
+            response TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            last_hit_at REAL NOT NULL,
+            hits INTEGER DEFAULT 0
+        ) WITHOUT ROWID
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit_at, size)')
 
+def _migration_14_ai_jobs(cursor):
+    """Fila de tarefas de IA, executadas pelo gateway fora da requisicao (ver ai_gateway.py)"""
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS mentor_messages (
+        CREATE TABLE IF NOT EXISTS ai_jobs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
-            message TEXT NOT NULL,
-            message_type TEXT DEFAULT 'motivation',
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            partial TEXT NOT NULL DEFAULT '',
+            result TEXT,
+            error TEXT,
+            error_status INTEGER,
             created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            is_read INTEGER DEFAULT 0,
+            started_at TEXT,
+            finished_at TEXT,
             FOREIGN KEY (user_id) REFERENCES users(id)
         )
     ''')
-
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS daily_goals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            focus_goal_minutes INTEGER DEFAULT 60,
-            focus_achieved_minutes INTEGER DEFAULT 0,
-            flashcards_goal INTEGER DEFAULT 10,
-            flashcards_done INTEGER DEFAULT 0,
-            tasks_goal INTEGER DEFAULT 3,
-            tasks_done INTEGER DEFAULT 0,
-            FOREIGN KEY (user_id) REFERENCES users(id),
-            UNIQUE(user_id, date)
-        )
+        CREATE INDEX IF NOT EXISTS idx_ai_jobs_pending ON ai_jobs (status, id)
+        WHERE status IN ('queued', 'running')
     ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_ai_jobs_finished ON ai_jobs (finished_at)')
 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weak_points (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            subject TEXT NOT NULL,
-            topic TEXT NOT NULL,
-            error_count INTEGER DEFAULT 1,
-            last_error_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
+def _migration_15_search_pdf_chunks(cursor):
+    """Busca no texto completo dos PDFs: uma linha do search_index por pedaco de pdf_chunks
+
+    Antes so os 10 mil caracteres de pdfs.content_text eram indexados. A linha do
+    PDF fica so com o nome; o texto vem dos pedacos, agrupados por PDF na busca.
+    """
+    for trigger in ('insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS pdfs_search_{trigger}')
+    cursor.execute("DELETE FROM search_index WHERE rowid IN (SELECT id * 8 + 1 FROM pdfs)")
+    _search_triggers(cursor, *SEARCH_SOURCES[0])
+
+    def values(row):
+        return (f"{PDF_CHUNK_ROWID.format(row=row)}, "
+                f"(SELECT 'u' || user_id FROM pdfs WHERE id = {row}.pdf_id), 'pdf', '', {row}.text")
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS pdf_chunks_search_insert AFTER INSERT ON pdf_chunks BEGIN
+            INSERT INTO search_index (rowid, owner, kind, title, body) VALUES ({values('new')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS pdf_chunks_search_update AFTER UPDATE OF text ON pdf_chunks BEGIN
+            DELETE FROM search_index WHERE rowid = {PDF_CHUNK_ROWID.format(row='old')};
+            INSERT INTO search_index (rowid, owner, kind, title, body) VALUES ({values('new')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS pdf_chunks_search_delete AFTER DELETE ON pdf_chunks BEGIN
+            DELETE FROM search_index WHERE rowid = {PDF_CHUNK_ROWID.format(row='old')};
+        END
+    ''')
+    cursor.execute(f'''
+        INSERT INTO search_index (rowid, owner, kind, title, body)
+        SELECT {values('pdf_chunks')} FROM pdf_chunks
     ''')
 
-    default_badges = [
-        ('Primeiro Passo', 'Complete sua primeira sessao de foco', 'fa-shoe-prints', 25, 'focus_sessions', 1),
-        ('Focado', 'Complete 10 sessoes de foco', 'fa-bullseye', 100, 'focus_sessions', 10),
-        ('Mestre do Foco', 'Complete 50 sessoes de foco', 'fa-brain', 500, 'focus_sessions', 50),
-        ('Leitor Iniciante', 'Adicione seu primeiro PDF', 'fa-book-open', 25, 'pdfs', 1),
-        ('Bibliotecario', 'Adicione 10 PDFs', 'fa-books', 150, 'pdfs', 10),
-        ('Memorias', 'Revise 50 flashcards', 'fa-cards', 100, 'flashcard_reviews', 50),
-        ('Memoria Fotografica', 'Revise 500 flashcards', 'fa-memory', 500, 'flashcard_reviews', 500),
-        ('Estudante Dedicado', 'Estude por 7 dias seguidos', 'fa-fire', 200, 'streak', 7),
-        ('Imparavel', 'Estude por 30 dias seguidos', 'fa-medal', 1000, 'streak', 30),
-        ('Resumidor', 'Gere 5 resumos com IA', 'fa-file-lines', 75, 'summaries', 5),
-        ('Nivel 5', 'Alcance o nivel 5', 'fa-star', 100, 'level', 5),
-        ('Nivel 10', 'Alcance o nivel 10', 'fa-crown', 300, 'level', 10),
-    ]
+def _migration_16_flashcards_version(cursor):
+    """Versao dos cards de cada usuario, incrementada a cada mudanca (ver scheduler.ForecastCache)"""
+    cursor.execute('ALTER TABLE users ADD COLUMN flashcards_version INTEGER NOT NULL DEFAULT 0')
 
-    for badge in default_badges:
-        cursor.execute('''
-            INSERT OR IGNORE INTO badges (name, description, icon, xp_reward, requirement_type, requirement_value)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', badge)
+def _migration_17_ai_jobs_heartbeat(cursor):
+    """Heartbeat dos jobs de IA: so os de processos mortos sao dados como perdidos (ver ai_gateway.claim_job)"""
+    cursor.execute('ALTER TABLE ai_jobs ADD COLUMN heartbeat_at TEXT')
+    cursor.execute("UPDATE ai_jobs SET heartbeat_at = started_at WHERE status = 'running'")
+
+def _xp_tree_update(xp, delta):
+    """SQL que soma delta aos nos da xp_tree que cobrem `xp` (um por bit, do indice ate a raiz)
 
-    conn.commit()
-    conn.close()
+    No indice i = xp + 1, os nos atualizados sao ((i - 1) | (2^b - 1)) + 1 para b
+    de 0 a XP_TREE_BITS; varios b dao o mesmo no, dai o DISTINCT.
+    """
+    clamped = f'MIN(MAX({xp}, 0), {(1 << XP_TREE_BITS) - 1})'
+    return f'''
+        INSERT INTO xp_tree (node, users)
+        SELECT DISTINCT ({clamped} | ((1 << value) - 1)) + 1, {delta}
+        FROM json_each('{json.dumps(list(range(XP_TREE_BITS + 1)))}') WHERE true
+        ON CONFLICT (node) DO UPDATE SET users = users + excluded.users;
+    '''
+
+def _migration_18_xp_tree(cursor):
+    """Contagem de usuarios por faixa de XP para a posicao no ranking em O(log XP) (ver leaderboard.XPRanking)
+
+    Triggers mantem a arvore na mesma transacao de qualquer escrita em
+    users.xp (add_xp, cadastro, exclusao), entao todos os workers veem o mesmo.
+    """
+    cursor.execute('CREATE TABLE IF NOT EXISTS xp_tree (node INTEGER PRIMARY KEY, users INTEGER NOT NULL)')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_xp_tree_insert AFTER INSERT ON users BEGIN
+            {_xp_tree_update('new.xp', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_xp_tree_update AFTER UPDATE OF xp ON users
+        WHEN old.xp IS NOT new.xp BEGIN
+            {_xp_tree_update('old.xp', -1)}
+            {_xp_tree_update('new.xp', 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS users_xp_tree_delete AFTER DELETE ON users BEGIN
+            {_xp_tree_update('old.xp', -1)}
+        END
+    ''')
+    cursor.execute(f'''
+        INSERT INTO xp_tree (node, users)
+        SELECT (MIN(MAX(users.xp, 0), {(1 << XP_TREE_BITS) - 1}) | ((1 << bits.value) - 1)) + 1 as node, COUNT(DISTINCT users.id)
+        FROM users, json_each('{json.dumps(list(range(XP_TREE_BITS + 1)))}') bits
+        GROUP BY node
+    ''')
+
+# Migracoes em ordem; a versao aplicada fica em PRAGMA user_version.
+# Nunca altere uma migracao ja publicada: adicione uma nova ao final.
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_secondary_indexes,
+    _migration_3_day_columns,
+    _migration_4_user_daily_stats,
+    _migration_5_user_daily_stats_counters,
+    _migration_6_flashcards_next_review_not_null,
+    _migration_7_flashcard_dedup_index,
+    _migration_8_ingest_jobs,
+    _migration_9_pdf_chunks,
+    _migration_10_blob_store,
+    _migration_11_search_index,
+    _migration_12_ingest_job_kind,
+    _migration_13_llm_cache,
+    _migration_14_ai_jobs,
+    _migration_15_search_pdf_chunks,
+    _migration_16_flashcards_version,
+    _migration_17_ai_jobs_heartbeat,
+    _migration_18_xp_tree,
+]
+
+def migrate(conn):
+    """Aplica as migracoes pendentes e retorna a versao final do schema
+
+    Com o banco atualizado custa apenas uma leitura de PRAGMA user_version.
+    """
+    cursor = conn.cursor()
+    version = cursor.execute('PRAGMA user_version').fetchone()['user_version']
+    if version >= len(MIGRATIONS):
+        return version
+
+    # BEGIN IMMEDIATE serializa workers que iniciam ao mesmo tempo
+    cursor.execute('BEGIN IMMEDIATE')
+    # after_commit() chamado por uma migracao (ex: apagar arquivos ja copiados) so roda apos o commit
+    _local.tx_depth, _local.after_commit = 1, []
+    try:
+        version = cursor.execute('PRAGMA user_version').fetchone()['user_version']
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(cursor)
+            cursor.execute(f'PRAGMA user_version = {number}')
+            print(f"Migracao {number} aplicada: {migration.__name__}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _local.tx_depth = 0
+        callbacks, _local.after_commit = _local.after_commit, []
+    for callback in callbacks:
+        callback()
+
+    cursor.execute('PRAGMA optimize')
+    return len(MIGRATIONS)
+
+def init_db():
+    migrate(get_db())
+    release_db()
+
+def day_number(value):
+    """Converte date/datetime no numero do dia usado pelas colunas *_day"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal() + _JULIAN_DAY_OFFSET
+
+def day_to_date(day):
+    """Inverso de day_number(): retorna a data no formato YYYY-MM-DD"""
+    return date.fromordinal(day - _JULIAN_DAY_OFFSET).strftime('%Y-%m-%d')
+
+def _build_level_table():
+    """Pre-calcula o XP acumulado no inicio de cada nivel e o XP de cada nivel
+
+    Mesma progressao do calculo original (100 XP no nivel 1, +50% por nivel),
+    ate o limite de um INTEGER do SQLite.
+    """
+    thresholds = [0]
+    needed = [100]
+    while thresholds[-1] + needed[-1] < 2 ** 63:
+        thresholds.append(thresholds[-1] + needed[-1])
+        needed.append(int(needed[-1] * 1.5))
+    return thresholds, needed
+
+# LEVEL_THRESHOLDS[n - 1] = XP total para chegar ao nivel n; LEVEL_XP_NEEDED[n - 1] = XP do nivel n
+LEVEL_THRESHOLDS, LEVEL_XP_NEEDED = _build_level_table()
+MAX_LEVEL = len(LEVEL_THRESHOLDS)
 
 def calculate_level(xp):
-    level = 1
-    xp_needed = 100
-    total_xp = 0
-    while total_xp + xp_needed <= xp:
-        total_xp += xp_needed
-        level += 1
-        xp_needed = int(xp_needed * 1.5)
-    return level, xp - total_xp, xp_needed
+    """Retorna (nivel, xp dentro do nivel, xp necessario para o proximo) em O(log n)"""
+    level = max(bisect_right(LEVEL_THRESHOLDS, xp), 1)
+    return level, xp - LEVEL_THRESHOLDS[level - 1], LEVEL_XP_NEEDED[level - 1]
+
+def calculate_levels(xp_values):
+    """Versao vetorizada de calculate_level() para rankings e recalculos em massa
+
+    Recebe uma sequencia de XP e retorna tres arrays NumPy: nivel, progresso
+    dentro do nivel e XP necessario.
+    """
+    import numpy as np
+
+    xp = np.asarray(xp_values, dtype=np.int64)
+    thresholds = np.asarray(LEVEL_THRESHOLDS, dtype=np.int64)
+    needed = np.asarray(LEVEL_XP_NEEDED, dtype=np.int64)
+
+    index = np.maximum(np.searchsorted(thresholds, xp, side='right'), 1) - 1
+    return index + 1, xp - thresholds[index], needed[index]
 
 def get_xp_for_level(level):
     if level <= 1:
         return 0, 100
-    xp_needed = 100
-    total_xp = 0
-    for l in range(1, level):
-        total_xp += xp_needed
-        xp_needed = int(xp_needed * 1.5)
-    return total_xp, xp_needed
-
-def add_xp(user_id, amount):
-    conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT xp, level FROM users WHERE id = ?', (user_id,))
-        user = cursor.fetchone()
-        if user:
-            new_xp = user['xp'] + amount
-            new_level = calculate_level(new_xp)[0]
-            cursor.execute('UPDATE users SET xp = ?, level = ? WHERE id = ?', (new_xp, new_level, user_id))
-            conn.commit()
-            return new_xp, new_level
-        return 0, 1
-    except Exception as e:
-        conn.rollback()
-        print(f"Erro ao adicionar XP: {e}")
-        return 0, 1
-    finally:
-        conn.close()
+    level = min(level, MAX_LEVEL)
+    return LEVEL_THRESHOLDS[level - 1], LEVEL_XP_NEEDED[level - 1]
+
+def add_xp(cursor, user_id, amount):
+    """Soma XP ao usuario dentro da transacao do cursor e recalcula o nivel
+
+    Um unico UPDATE atomico, sem ler o XP atual antes. O trigger
+    users_xp_tree_update reposiciona o usuario na xp_tree do ranking no mesmo commit.
+    """
+    cursor.execute('''
+        UPDATE users SET xp = xp + ?, level = xp_level(xp + ?)
+        WHERE id = ?
+        RETURNING xp, level
+    ''', (amount, amount, user_id))
+    user = cursor.fetchone()
+    if user:
+        return user['xp'], user['level']
+    return 0, 1
+
+def bump_daily_goals(cursor, user_id, focus_minutes=0, flashcards=0, tasks=0, day=None):
+    """Incrementa o progresso das metas do dia (date local, padrao hoje) do usuario"""
+    today = (day or datetime.now()).strftime('%Y-%m-%d')
+    cursor.execute('''
+        INSERT INTO daily_goals (user_id, date, focus_achieved_minutes, flashcards_done, tasks_done)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, date) DO UPDATE SET
+        focus_achieved_minutes = focus_achieved_minutes + excluded.focus_achieved_minutes,
+        flashcards_done = flashcards_done + excluded.flashcards_done,
+        tasks_done = tasks_done + excluded.tasks_done
+    ''', (user_id, today, focus_minutes, flashcards, tasks))
+
+def bump_daily_stats(cursor, user_id, day=None, **counters):
+    """Incrementa contadores do rollup user_daily_stats do dia (date local, padrao hoje)
+
+    Os nomes aceitos estao em DAILY_STATS_COUNTERS, ex:
+    bump_daily_stats(cursor, user_id, reviews=1, correct_reviews=1)
+    """
+    values = [counters.pop(column, 0) for column in DAILY_STATS_COUNTERS]
+    if counters:
+        raise ValueError(f"Contadores desconhecidos: {', '.join(counters)}")
+
+    columns = ', '.join(DAILY_STATS_COUNTERS)
+    updates = ',\n        '.join(f'{column} = {column} + excluded.{column}' for column in DAILY_STATS_COUNTERS)
+    cursor.execute(f'''
+        INSERT INTO user_daily_stats (user_id, day, {columns})
+        VALUES (?, ?, {', '.join('?' * len(values))})
+        ON CONFLICT(user_id, day) DO UPDATE SET
+        {updates}
+    ''', [user_id, day_number(day or datetime.now())] + values)
+
+def backfill_daily_stats(cursor, user_id=None):
+    """Reconstroi user_daily_stats a partir do historico bruto de eventos
+
+    Sem user_id reconstroi todos os usuarios. Retorna o numero de linhas geradas.
+    """
+    where = '' if user_id is None else 'WHERE user_id = ?'
+    params = () if user_id is None else (user_id,) * 5
+
+    cursor.execute(f'DELETE FROM user_daily_stats {where}', params[:1])
+    cursor.execute(f'''
+        INSERT INTO user_daily_stats (user_id, day, {', '.join(DAILY_STATS_COUNTERS)})
+        SELECT user_id, day, SUM(focus_minutes), SUM(focus_sessions), SUM(reviews), SUM(correct_reviews),
+               SUM(tasks_completed), SUM(summaries_generated), SUM(quizzes_taken)
+        FROM (
+            SELECT user_id, started_day AS day, duration_minutes AS focus_minutes, 1 AS focus_sessions,
+                   0 AS reviews, 0 AS correct_reviews, 0 AS tasks_completed, 0 AS summaries_generated, 0 AS quizzes_taken
+            FROM focus_sessions {where}
+            UNION ALL
+            SELECT user_id, reviewed_day, 0, 0, 1, quality >= 3, 0, 0, 0
+            FROM flashcard_reviews {where}
+            UNION ALL
+            SELECT user_id, CAST(julianday(completed_at) + 0.5 AS INTEGER), 0, 0, 0, 0, 1, 0, 0
+            FROM study_tasks WHERE is_completed = 1 {'AND user_id = ?' if user_id is not None else ''}
+            UNION ALL
+            SELECT user_id, CAST(julianday(created_at) + 0.5 AS INTEGER), 0, 0, 0, 0, 0, 1, 0
+            FROM summaries {where}
+            UNION ALL
+            SELECT user_id, CAST(julianday(completed_at) + 0.5 AS INTEGER), 0, 0, 0, 0, 0, 0, 1
+            FROM quiz_attempts {where}
+        )
+        WHERE day IS NOT NULL
+        GROUP BY user_id, day
+    ''', params)
+    return cursor.rowcount
+
+def due_flashcards(cursor, user_id, after=None, limit=DUE_QUEUE_PAGE_SIZE):
+    """Uma pagina da fila de revisao de hoje, ordenada por (next_review, id)
+
+    Paginacao por keyset: after e o cursor retornado pela pagina anterior, e a
+    busca anda direto no indice (user_id, next_review), que carrega o id.
+    Retorna (cards, cursor da proxima pagina ou None).
+    """
+    last_review, last_id = '', 0
+    if after:
+        last_review, _, last_id = after.rpartition(':')
+        last_id = int(last_id)
+
+    cursor.execute('''
+        SELECT id, deck_name, front, back, next_review, repetitions, ease_factor, interval_days
+        FROM flashcards
+        WHERE user_id = ? AND next_review <= ? AND (next_review, id) > (?, ?)
+        ORDER BY next_review, id
+        LIMIT ?
+    ''', (user_id, datetime.now().strftime('%Y-%m-%d'), last_review, last_id, limit + 1))
+    cards = cursor.fetchall()
+
+    if len(cards) <= limit:
+        return cards, None
+    cards = cards[:limit]
+    return cards, f"{cards[-1]['next_review']}:{cards[-1]['id']}"
+
+def count_due_flashcards(cursor, user_id):
+    """Total de cards vencidos ate hoje, contado so pelo indice"""
+    cursor.execute('SELECT COUNT(*) as count FROM flashcards WHERE user_id = ? AND next_review <= ?',
+                   (user_id, datetime.now().strftime('%Y-%m-%d')))
+    return cursor.fetchone()['count']
+
+def record_study_day(cursor, user_id, focus_minutes=0):
+    """Atualiza streak, ultimo dia de estudo e tempo total de foco em um unico UPDATE"""
+    today = datetime.now().strftime('%Y-%m-%d')
+    yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    cursor.execute('''
+        UPDATE users SET
+            streak_days = CASE
+                WHEN last_study_date = ? THEN streak_days
+                WHEN last_study_date = ? THEN streak_days + 1
+                ELSE 1
+            END,
+            last_study_date = ?,
+            total_focus_time = total_focus_time + ?
+        WHERE id = ?
+    ''', (today, yesterday, today, focus_minutes, user_id))
 
 def sm2_algorithm(quality, repetitions, ease_factor, interval):
     if quality < 3:
@@ -637,4 +1206,9 @@ def sm2_algorithm(quality, repetitions, ease_factor, interval):
 
 if __name__ == '__main__':
     init_db()
-    print("Database initialized successfully!")
\ No newline at end of file
+    print("Database initialized successfully!")
+
+    if 'backfill-stats' in sys.argv[1:]:
+        with transaction() as cursor:
+            rows = backfill_daily_stats(cursor)
+        print(f"user_daily_stats reconstruida: {rows} linhas")
\ No newline at end of file
@@ -0,0 +1,173 @@
+import re
+import sys
+import unicodedata
+from hashlib import blake2b
+
+import numpy as np
+
+from database import init_db, transaction
+
+# Assinatura MinHash de MINHASH_PERMUTATIONS valores, dividida em LSH_BANDS faixas
+# de LSH_ROWS linhas: pares com Jaccard acima de ~0.5 caem no mesmo balde em pelo
+# menos uma faixa com alta probabilidade
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+SHINGLE_SIZE = 4
+# Similaridade (Jaccard estimado) a partir da qual dois cards sao considerados o mesmo
+DUPLICATE_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def _hash64(data):
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), 'big', signed=True)
+
+def normalize_text(text):
+    """Minusculas, sem acentos e sem pontuacao, com espacos simples"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.findall(r'\w+', text))
+
+class Signature:
+    """Hash do texto normalizado e assinatura MinHash da frente de um card"""
+
+    __slots__ = ('text_hash', 'minhash')
+
+    def __init__(self, text_hash, minhash):
+        self.text_hash = text_hash
+        self.minhash = minhash
+
+    @classmethod
+    def of(cls, text):
+        normalized = normalize_text(text)
+        data = normalized.encode()
+        shingles = {data[i:i + SHINGLE_SIZE] for i in range(max(len(data) - SHINGLE_SIZE + 1, 1))}
+        hashes = np.fromiter(
+            (int.from_bytes(blake2b(shingle, digest_size=4).digest(), 'big') for shingle in shingles),
+            dtype=np.uint64, count=len(shingles)
+        ) % _MERSENNE_PRIME
+        # (a * h + b) mod p para todas as permutacoes e shingles de uma vez; cabe em 63 bits
+        minhash = ((np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME).min(axis=0).astype(np.uint32)
+        return cls(_hash64(data), minhash)
+
+    @classmethod
+    def from_blob(cls, text_hash, blob):
+        return cls(text_hash, np.frombuffer(blob, dtype=np.uint32))
+
+    def buckets(self):
+        """Uma chave de balde LSH por faixa da assinatura"""
+        return [
+            _hash64(bytes([band]) + self.minhash[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes())
+            for band in range(LSH_BANDS)
+        ]
+
+    def similarity(self, other):
+        if self.text_hash == other.text_hash:
+            return 1.0
+        return float(np.count_nonzero(self.minhash == other.minhash)) / MINHASH_PERMUTATIONS
+
+def find_duplicate(cursor, user_id, front, signature=None):
+    """Id de um card do usuario quase igual a `front`, ou None
+
+    Primeiro procura o mesmo texto normalizado; depois compara a assinatura
+    so com os candidatos que dividem algum balde LSH, todos por indice.
+    """
+    signature = signature or Signature.of(front)
+    cursor.execute(
+        'SELECT flashcard_id FROM flashcard_signatures WHERE user_id = ? AND text_hash = ? LIMIT 1',
+        (user_id, signature.text_hash)
+    )
+    row = cursor.fetchone()
+    if row:
+        return row['flashcard_id']
+
+    buckets = signature.buckets()
+    placeholders = ','.join('?' * len(buckets))
+    cursor.execute(f'''
+        SELECT s.flashcard_id, s.text_hash, s.minhash
+        FROM flashcard_signatures s
+        WHERE s.flashcard_id IN (
+            SELECT flashcard_id FROM flashcard_lsh WHERE user_id = ? AND bucket IN ({placeholders})
+        )
+        ORDER BY s.flashcard_id
+    ''', [user_id] + buckets)
+    for row in cursor.fetchall():
+        if signature.similarity(Signature.from_blob(row['text_hash'], row['minhash'])) >= DUPLICATE_THRESHOLD:
+            return row['flashcard_id']
+    return None
+
+def index_flashcard(cursor, user_id, flashcard_id, front, signature=None):
+    """Registra um card recem-criado no indice de duplicatas, na mesma transacao"""
+    signature = signature or Signature.of(front)
+    cursor.execute('''
+        INSERT OR REPLACE INTO flashcard_signatures (flashcard_id, user_id, text_hash, minhash)
+        VALUES (?, ?, ?, ?)
+    ''', (flashcard_id, user_id, signature.text_hash, signature.minhash.tobytes()))
+    cursor.executemany(
+        'INSERT OR IGNORE INTO flashcard_lsh (user_id, bucket, flashcard_id) VALUES (?, ?, ?)',
+        [(user_id, bucket, flashcard_id) for bucket in signature.buckets()]
+    )
+
+def rebuild_index(cursor, user_id=None):
+    """Recalcula as assinaturas de todos os cards (de um usuario ou de todos)"""
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    cursor.execute(f'DELETE FROM flashcard_signatures {where}', params)
+    cursor.execute(f'DELETE FROM flashcard_lsh {where}', params)
+    cursor.execute(f'SELECT id, user_id, front FROM flashcards {where} ORDER BY id', params)
+    cards = cursor.fetchall()
+    for card in cards:
+        index_flashcard(cursor, card['user_id'], card['id'], card['front'])
+    return len(cards)
+
+def dedup_flashcards(cursor, user_id=None, dry_run=False):
+    """Remove os cards quase duplicados, mantendo o mais antigo de cada grupo
+
+    Os candidatos saem de baldes LSH montados em memoria, entao com dry_run nada
+    e escrito. Sem dry_run o historico de revisoes dos removidos passa para o card
+    mantido e o indice do banco e reconstruido no fim (tambem serve para montar o
+    indice de um banco existente). Retorna a lista de pares (removido, mantido).
+    """
+    where, params = ('WHERE user_id = ?', (user_id,)) if user_id is not None else ('', ())
+    cursor.execute(f'SELECT id, user_id, front FROM flashcards {where} ORDER BY id', params)
+    cards = cursor.fetchall()
+
+    # (user_id, balde) -> [(id, assinatura)] dos cards mantidos ate aqui, em ordem de id
+    buckets = {}
+    duplicates = []
+    for card in cards:
+        signature = Signature.of(card['front'])
+        keys = [(card['user_id'], bucket) for bucket in signature.buckets()]
+        candidates = {}
+        for key in keys:
+            candidates.update(buckets.get(key, ()))
+        kept = next((flashcard_id for flashcard_id in sorted(candidates)
+                     if signature.similarity(candidates[flashcard_id]) >= DUPLICATE_THRESHOLD), None)
+        if kept is not None:
+            duplicates.append((card['id'], kept))
+            continue
+        for key in keys:
+            buckets.setdefault(key, []).append((card['id'], signature))
+
+    if dry_run:
+        return duplicates
+
+    if duplicates:
+        cursor.executemany('UPDATE flashcard_reviews SET flashcard_id = ? WHERE flashcard_id = ?',
+                           [(kept, duplicate) for duplicate, kept in duplicates])
+        cursor.executemany('DELETE FROM flashcards WHERE id = ?', [(duplicate,) for duplicate, _ in duplicates])
+    rebuild_index(cursor, user_id)
+    return duplicates
+
+if __name__ == '__main__':
+    # python dedup.py [user_id] [--dry-run]
+    init_db()
+    args = [arg for arg in sys.argv[1:] if arg != '--dry-run']
+    dry_run = '--dry-run' in sys.argv[1:]
+    with transaction() as cursor:
+        duplicates = dedup_flashcards(cursor, int(args[0]) if args else None, dry_run)
+    for duplicate, kept in duplicates:
+        print(f"Card {duplicate} duplica o card {kept}")
+    print(f"{len(duplicates)} cards duplicados {'encontrados' if dry_run else 'removidos'}")
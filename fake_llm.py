@@ -0,0 +1,137 @@
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+# Distribuicoes de latencia: "fixed:S", "uniform:MIN:MAX", "normal:MEDIA:DESVIO" ou
+# "lognormal:MEDIANA:SIGMA", em segundos
+FAKE_LLM_LATENCY = os.environ.get('FAKE_LLM_LATENCY', 'lognormal:1.5:0.5')
+# Tempo ate a primeira parte de uma resposta em stream; o resto chega ao longo de FAKE_LLM_LATENCY
+FAKE_LLM_FIRST_TOKEN = os.environ.get('FAKE_LLM_FIRST_TOKEN', 'lognormal:0.4:0.3')
+# Fracao das chamadas que falham com erro do servidor e com cota esgotada (429)
+FAKE_LLM_ERROR_RATE = float(os.environ.get('FAKE_LLM_ERROR_RATE', 0))
+FAKE_LLM_QUOTA_RATE = float(os.environ.get('FAKE_LLM_QUOTA_RATE', 0))
+FAKE_LLM_SEED = os.environ.get('FAKE_LLM_SEED')
+# Caracteres por parte nas respostas em stream
+STREAM_CHUNK_CHARS = 24
+
+class FakeServerError(Exception):
+    pass
+
+class FakeQuotaError(Exception):
+    pass
+
+def parse_distribution(spec):
+    """Funcao rng -> segundos a partir de uma especificacao como 'lognormal:1.5:0.5'"""
+    name, *params = spec.split(':')
+    params = [float(param) for param in params]
+    if name == 'fixed':
+        return lambda rng: params[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == 'normal':
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if name == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f'Distribuicao de latencia desconhecida: {spec}')
+
+class FakeResponse:
+    """Mesma interface (.text) das respostas e das partes de stream do SDK"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+def _seed_words(prompt, count):
+    digest = hashlib.sha256(prompt.encode()).hexdigest()
+    return [digest[i * 6:(i + 1) * 6] for i in range(count)]
+
+def _number(pattern, prompt, default):
+    match = re.search(pattern, prompt)
+    return int(match.group(1)) if match else default
+
+def fake_payload(prompt):
+    """Resposta deterministica para o prompt, no schema que a rota espera
+
+    Reconhece os prompts do app pelo formato de JSON pedido (resumo, parte de
+    resumo, quiz e plano); o resto recebe texto livre. O mesmo prompt sempre
+    gera a mesma resposta, entao o cache de respostas funciona como em producao.
+    """
+    words = _seed_words(prompt, 8)
+    if '"questions"' in prompt:
+        count = _number(r'Crie (\d+) questoes', prompt, 5)
+        return json.dumps({'questions': [{
+            'question': f'Questao {i + 1} ({words[i % 8]})?',
+            'options': [f'Alternativa {letter}' for letter in 'abcd'],
+            'correct': i % 4,
+            'explanation': f'Explicacao da questao {i + 1}.',
+        } for i in range(count)]}, ensure_ascii=False)
+    if '"tasks"' in prompt:
+        return json.dumps({'tasks': [{
+            'title': f'Tarefa {i + 1} ({words[i % 8]})', 'subject': 'Geral',
+            'description': 'Revisar o conteudo e fazer exercicios.',
+            'duration_minutes': 30 + 15 * (i % 3), 'priority': 1 + i % 5,
+        } for i in range(10)]}, ensure_ascii=False)
+    if '"summary": "resumo detalhado desta parte"' in prompt:
+        return json.dumps({
+            'title': f'Parte {words[0]}', 'summary': ' '.join(words) * 4,
+            'topics': words[:3], 'flashcards': [{'front': f'Pergunta {w}?', 'back': f'Resposta {w}.'} for w in words[:3]],
+        }, ensure_ascii=False)
+    if '"short_summary"' in prompt:
+        return json.dumps({
+            'title': f'Resumo {words[0]}', 'short_summary': f'Resumo curto {words[1]}.',
+            'full_summary': ' '.join(words) * 8, 'topics': words[:4],
+            'flashcards': [{'front': f'Pergunta {w}?', 'back': f'Resposta {w}.'} for w in words],
+            'mind_map': {'central': words[0], 'branches': [{'name': w, 'items': words[:2]} for w in words[2:5]]},
+        }, ensure_ascii=False)
+    return ' '.join(f'Texto {word} de exemplo para a resposta.' for word in words * 3)
+
+class FakeModel:
+    """Modelo local no lugar do GenerativeModel, para testes de carga sem gastar cota"""
+
+    def __init__(self, model_name, latency=FAKE_LLM_LATENCY, first_token=FAKE_LLM_FIRST_TOKEN,
+                 error_rate=FAKE_LLM_ERROR_RATE, quota_rate=FAKE_LLM_QUOTA_RATE, seed=FAKE_LLM_SEED):
+        self.model_name = f'fake/{model_name}'
+        self.latency = parse_distribution(latency)
+        self.first_token = parse_distribution(first_token)
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        with self._lock:
+            failure = self._rng.random()
+            return self.latency(self._rng), self.first_token(self._rng), failure
+
+    def _fail(self, failure):
+        if failure < self.quota_rate:
+            raise FakeQuotaError('429 Resource has been exhausted (e.g. check quota).')
+        if failure < self.quota_rate + self.error_rate:
+            raise FakeServerError('500 An internal error has occurred (fake)')
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        latency, first_token, failure = self._sample()
+        text = fake_payload(prompt)
+        if stream:
+            return self._stream(text, latency, first_token, failure)
+
+        time.sleep(latency)
+        self._fail(failure)
+        return FakeResponse(text)
+
+    def _stream(self, text, latency, first_token, failure):
+        # Como no SDK, erros aparecem antes da primeira parte
+        time.sleep(min(first_token, latency))
+        self._fail(failure)
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)]
+        interval = max(latency - first_token, 0) / max(len(chunks) - 1, 1)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(interval)
+            yield FakeResponse(chunk)
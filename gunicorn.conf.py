@@ -0,0 +1,18 @@
+# Configuracao do gunicorn, lida automaticamente quando ele roda na raiz do projeto
+#
+# As rotas de IA respondem 202 e o cliente acompanha o job, mas o stream SSE
+# (chat e explicacoes) segura a resposta enquanto o modelo gera. No worker sync
+# cada stream ocuparia um processo inteiro, entao usamos gthread: cada processo
+# atende `threads` requisicoes ao mesmo tempo. streaming.stream_supported recusa
+# o stream (e volta 202) em workers que nao aguentam.
+import os
+
+bind = '0.0.0.0:5000'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+timeout = 120
+
+def post_fork(server, worker):
+    # Classe do worker para streaming.stream_supported (ThreadWorker, SyncWorker...)
+    os.environ['GUNICORN_WORKER_CLASS'] = type(worker).__name__
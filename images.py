@@ -0,0 +1,55 @@
+import io
+import os
+
+from PIL import Image, ImageOps
+
+# Maior lado (px) da imagem guardada; fotos de celular chegam com 4000+ px
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2048))
+# WEBP ou JPEG
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'WEBP').upper()
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+# Variantes em cache, geradas junto com a imagem: nome -> (maior lado, qualidade)
+IMAGE_VARIANTS = {
+    'thumb': (320, 70),
+}
+
+MIMETYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg', 'PNG': 'image/png', 'GIF': 'image/gif'}
+
+def _encode(image, quality):
+    if IMAGE_FORMAT == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    options = {'optimize': True, 'progressive': True} if IMAGE_FORMAT == 'JPEG' else {'method': 4}
+    buffer = io.BytesIO()
+    # Sem exif/icc_profile nos parametros o Pillow nao copia metadados para a saida
+    image.save(buffer, IMAGE_FORMAT, quality=quality, **options)
+    return buffer.getvalue()
+
+def process_image(path):
+    """Reduz, remove metadados e recodifica a imagem; retorna (imagem, {variante: bytes})
+
+    A orientacao do EXIF e aplicada nos pixels antes de os metadados serem descartados.
+    """
+    with Image.open(path) as image:
+        # JPEG: decodifica direto em escala reduzida (DCT), bem mais rapido para fotos grandes
+        image.draft('RGB', (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        processed = _encode(image, IMAGE_QUALITY)
+
+        variants = {}
+        for name, (dimension, quality) in IMAGE_VARIANTS.items():
+            variant = image.copy()
+            variant.thumbnail((dimension, dimension), Image.LANCZOS)
+            variants[name] = _encode(variant, quality)
+    return processed, variants
+
+def sniff_mimetype(path):
+    """Tipo da imagem pelo conteudo (blobs e variantes sao guardados sem extensao)"""
+    try:
+        with Image.open(path) as image:
+            return MIMETYPES.get(image.format, 'application/octet-stream')
+    except OSError:
+        return 'application/octet-stream'
@@ -0,0 +1,351 @@
+import io
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import PyPDF2
+
+import blobstore
+from database import get_db, release_db, transaction, after_commit
+from images import process_image
+
+# Threads extratoras por processo; 0 desliga (ex: quando `python ingest.py` roda a parte)
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+# Intervalo (segundos) para procurar jobs enfileirados por outros processos ou antes de um restart
+INGEST_POLL_INTERVAL = float(os.environ.get('INGEST_POLL_INTERVAL', 5))
+# Job 'running' sem heartbeat ha mais que isso e considerado abandonado (worker morreu)
+INGEST_STALE_SECONDS = int(os.environ.get('INGEST_STALE_SECONDS', 300))
+# Intervalo do heartbeat de um job em execucao, bem abaixo de INGEST_STALE_SECONDS
+INGEST_HEARTBEAT_SECONDS = 30
+INGEST_MAX_ATTEMPTS = 3
+# Processos extratores, compartilhados pelas threads do processo
+EXTRACT_PROCESSES = int(os.environ.get('EXTRACT_PROCESSES', os.cpu_count() or 1))
+# PDFs com ate essa quantidade de paginas sao extraidos na propria thread, sem IPC
+PARALLEL_MIN_PAGES = 16
+# Tamanho alvo (caracteres) de cada linha de pdf_chunks
+CHUNK_CHARS = 2000
+# Quantos caracteres do inicio do texto ficam em pdfs.content_text, como previa
+PREVIEW_CHARS = 10000
+
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+_executor = None
+_executor_pid = None
+
+def enqueue_pdf(cursor, user_id, pdf_id, path):
+    """Enfileira a extracao do PDF na transacao atual e acorda os workers apos o commit
+
+    Se o mesmo conteudo ja foi extraido para outro upload, o resultado e copiado
+    na hora e o job ja nasce concluido.
+    """
+    job_id = _enqueue(cursor, user_id, pdf_id, path, 'pdf')
+    page_count = reuse_extraction(cursor, pdf_id)
+    if page_count is not None:
+        _finish_job(cursor, job_id, page_count)
+        return job_id
+
+    _notify_workers()
+    return job_id
+
+def enqueue_image(cursor, user_id, pdf_id, path):
+    """Enfileira a reducao/recodificacao de uma imagem enviada (ver images.py)"""
+    job_id = _enqueue(cursor, user_id, pdf_id, path, 'image')
+    _notify_workers()
+    return job_id
+
+def _enqueue(cursor, user_id, pdf_id, path, kind):
+    cursor.execute('''
+        INSERT INTO ingest_jobs (pdf_id, user_id, path, kind)
+        VALUES (?, ?, ?, ?)
+    ''', (pdf_id, user_id, path, kind))
+    return cursor.lastrowid
+
+def _notify_workers():
+    after_commit(_wakeup.set)
+    start_workers()
+
+def reuse_extraction(cursor, pdf_id):
+    """Copia texto e paginas de outro PDF ja extraido com o mesmo blob; None se nao houver"""
+    cursor.execute('''
+        SELECT source.id, source.page_count, source.content_text
+        FROM pdfs target
+        JOIN pdfs source ON source.blob_sha256 = target.blob_sha256 AND source.id != target.id
+        JOIN ingest_jobs j ON j.pdf_id = source.id AND j.status = 'done'
+        WHERE target.id = ?
+        LIMIT 1
+    ''', (pdf_id,))
+    source = cursor.fetchone()
+    if source is None:
+        return None
+
+    cursor.execute('DELETE FROM pdf_chunks WHERE pdf_id = ?', (pdf_id,))
+    cursor.execute('''
+        INSERT INTO pdf_chunks (pdf_id, page, chunk_no, text)
+        SELECT ?, page, chunk_no, text FROM pdf_chunks WHERE pdf_id = ?
+    ''', (pdf_id, source['id']))
+    cursor.execute('UPDATE pdfs SET content_text = ?, page_count = ? WHERE id = ?',
+                   (source['content_text'], source['page_count'], pdf_id))
+    return source['page_count']
+
+def _finish_job(cursor, job_id, page_count, attempt=None):
+    """Marca o job como concluido; False se ele nao existe mais (PDF apagado)
+
+    Com attempt (a tentativa devolvida por claim_job), so conclui se o job ainda
+    for dessa tentativa: um worker que perdeu o job para outro nao grava nada.
+    """
+    cursor.execute('''
+        UPDATE ingest_jobs
+        SET status = 'done', pages_done = ?, pages_total = ?, error = NULL, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND (? IS NULL OR (status = 'running' AND attempts = ?))
+        RETURNING id
+    ''', (page_count, page_count, job_id, attempt, attempt))
+    return cursor.fetchone() is not None
+
+def job_status(cursor, job_id, user_id):
+    """Estado do job com o resultado da extracao quando concluido; None se nao for do usuario"""
+    cursor.execute('''
+        SELECT j.id, j.pdf_id, j.status, j.pages_done, j.pages_total, j.error,
+               p.page_count, p.content_text
+        FROM ingest_jobs j JOIN pdfs p ON p.id = j.pdf_id
+        WHERE j.id = ? AND j.user_id = ?
+    ''', (job_id, user_id))
+    job = cursor.fetchone()
+    if job is None:
+        return None
+
+    status = job.as_dict()
+    if job['status'] != 'done':
+        del status['page_count'], status['content_text']
+    return status
+
+def _extract_pages(path, start, stop):
+    """Texto das paginas [start, stop) do PDF; roda nos processos extratores"""
+    with open(path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        return [(number, reader.pages[number].extract_text() or '') for number in range(start, stop)]
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _workers_lock:
+            if _executor_pid != os.getpid():
+                # spawn: processos novos, sem herdar threads e conexoes do worker
+                _executor = ProcessPoolExecutor(EXTRACT_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+                _executor_pid = os.getpid()
+    return _executor
+
+def split_chunks(text, size=CHUNK_CHARS):
+    """Divide o texto de uma pagina em pedacos de ate ~size caracteres, quebrando em espacos"""
+    chunks = []
+    text = text.strip()
+    while len(text) > size:
+        cut = text.rfind('\n', size // 2, size)
+        if cut == -1:
+            cut = text.rfind(' ', size // 2, size)
+        if cut == -1:
+            cut = size
+        chunks.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+def extract_pdf(path, progress=None):
+    """Extrai o texto de todas as paginas; retorna (page_count, [(page, chunk_no, texto)])
+
+    Documentos grandes sao divididos em faixas de paginas distribuidas entre os
+    processos extratores (a extracao e CPU pura, entao threads nao escalariam).
+    """
+    with open(path, 'rb') as f:
+        page_count = len(PyPDF2.PdfReader(f).pages)
+
+    if page_count <= PARALLEL_MIN_PAGES or EXTRACT_PROCESSES <= 1:
+        pages = _extract_pages(path, 0, page_count)
+    else:
+        # Cerca de duas faixas por processo equilibra a carga sem reabrir o PDF demais
+        step = -(-page_count // (EXTRACT_PROCESSES * 2))
+        futures = [_get_executor().submit(_extract_pages, path, start, min(start + step, page_count))
+                   for start in range(0, page_count, step)]
+        pages = []
+        for future in as_completed(futures):
+            pages += future.result()
+            if progress:
+                progress(len(pages), page_count)
+        pages.sort()
+
+    chunks = [
+        (number + 1, chunk_no, chunk)
+        for number, text in pages
+        for chunk_no, chunk in enumerate(split_chunks(text))
+    ]
+    return page_count, chunks
+
+def pdf_text(cursor, pdf_id):
+    """Texto completo do PDF, remontado a partir de pdf_chunks"""
+    cursor.execute('SELECT text FROM pdf_chunks WHERE pdf_id = ? ORDER BY page, chunk_no', (pdf_id,))
+    return '\n'.join(row['text'] for row in cursor.fetchall())
+
+def _fail_job(job, error):
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE ingest_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'running' AND attempts = ?
+        ''', (str(error)[:500], job['id'], job['attempts']))
+    print(f"[{datetime.now()}] Erro ao processar o arquivo {job['pdf_id']}: {error}")
+
+def claim_job():
+    """Pega o proximo job da fila (ou um abandonado) de forma atomica entre processos"""
+    stale = f'-{INGEST_STALE_SECONDS} seconds'
+    with transaction() as cursor:
+        cursor.execute('''
+            UPDATE ingest_jobs SET status = 'failed', error = 'Tentativas esgotadas', finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND heartbeat_at < datetime('now', ?) AND attempts >= ?
+        ''', (stale, INGEST_MAX_ATTEMPTS))
+        cursor.execute('''
+            UPDATE ingest_jobs
+            SET status = 'running', attempts = attempts + 1, pages_done = 0,
+                started_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+            WHERE id = (
+                SELECT id FROM ingest_jobs
+                WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < datetime('now', ?))
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, pdf_id, path, kind, attempts
+        ''', (stale,))
+        return cursor.fetchone()
+
+@contextmanager
+def _heartbeat(job):
+    """Renova heartbeat_at do job a cada INGEST_HEARTBEAT_SECONDS enquanto o bloco roda
+
+    Independe do progresso da extracao: PDFs pequenos (extraidos sem o pool, sem
+    progresso nenhum) e faixas de paginas lentas nao deixam o job parecer
+    abandonado e ser pego por outro worker.
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(INGEST_HEARTBEAT_SECONDS):
+            try:
+                with transaction() as cursor:
+                    cursor.execute('''
+                        UPDATE ingest_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                        WHERE id = ? AND status = 'running' AND attempts = ?
+                    ''', (job['id'], job['attempts']))
+            except Exception as e:
+                print(f"[{datetime.now()}] Erro no heartbeat do job {job['id']}: {e}")
+            finally:
+                release_db()
+
+    thread = threading.Thread(target=beat, name=f"ingest-heartbeat-{job['id']}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+def run_image_job(job):
+    """Substitui o blob original pela versao reduzida e grava as variantes em cache"""
+    processed, variants = process_image(job['path'])
+    sha256, size, temp_path = blobstore.save_stream(io.BytesIO(processed))
+    for name, data in variants.items():
+        blobstore.write_variant(sha256, name, data)
+
+    with transaction() as cursor:
+        cursor.execute('SELECT blob_sha256 FROM pdfs WHERE id = ?', (job['pdf_id'],))
+        pdf = cursor.fetchone()
+        if pdf is None or not _finish_job(cursor, job['id'], 0, job['attempts']):
+            os.remove(temp_path)
+            return
+        path = blobstore.store(cursor, sha256, size, temp_path)
+        cursor.execute('UPDATE pdfs SET blob_sha256 = ?, filename = ? WHERE id = ?',
+                       (sha256, blobstore.blob_name(sha256), job['pdf_id']))
+        cursor.execute('UPDATE ingest_jobs SET path = ? WHERE id = ?', (path, job['id']))
+        if pdf['blob_sha256']:
+            blobstore.release(cursor, pdf['blob_sha256'])
+
+def run_job(job):
+    with _heartbeat(job):
+        _run_job(job)
+
+def _run_job(job):
+    if job['kind'] == 'image':
+        try:
+            run_image_job(job)
+        except Exception as e:
+            _fail_job(job, e)
+        return
+
+    def progress(pages_done, pages_total):
+        with transaction() as cursor:
+            cursor.execute('''
+                UPDATE ingest_jobs SET pages_done = ?, pages_total = ?, heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running' AND attempts = ?
+            ''', (pages_done, pages_total, job['id'], job['attempts']))
+
+    with transaction() as cursor:
+        page_count = reuse_extraction(cursor, job['pdf_id'])
+        if page_count is not None:
+            _finish_job(cursor, job['id'], page_count, job['attempts'])
+            return
+
+    try:
+        page_count, chunks = extract_pdf(job['path'], progress)
+    except Exception as e:
+        _fail_job(job, e)
+        return
+
+    preview = '\n'.join(text for _, _, text in chunks[:PREVIEW_CHARS // CHUNK_CHARS + 1])[:PREVIEW_CHARS]
+    with transaction() as cursor:
+        if not _finish_job(cursor, job['id'], page_count, job['attempts']):
+            return
+        cursor.execute('DELETE FROM pdf_chunks WHERE pdf_id = ?', (job['pdf_id'],))
+        cursor.executemany(
+            'INSERT INTO pdf_chunks (pdf_id, page, chunk_no, text) VALUES (?, ?, ?, ?)',
+            [(job['pdf_id'], page, chunk_no, text) for page, chunk_no, text in chunks]
+        )
+        cursor.execute('UPDATE pdfs SET content_text = ?, page_count = ? WHERE id = ?',
+                       (preview, page_count, job['pdf_id']))
+
+def _worker_loop():
+    while True:
+        try:
+            job = claim_job()
+            if job is not None:
+                run_job(job)
+        except Exception as e:
+            job = None
+            print(f"[{datetime.now()}] Erro no worker de ingestao: {e}")
+        finally:
+            release_db()
+
+        if job is None:
+            _wakeup.wait(INGEST_POLL_INTERVAL)
+            _wakeup.clear()
+
+def start_workers(count=INGEST_WORKERS):
+    """Inicia as threads extratoras deste processo (de novo apos um fork)"""
+    global _workers, _workers_pid
+    if _workers_pid == os.getpid() or count <= 0:
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers = [threading.Thread(target=_worker_loop, name=f'ingest-{i}', daemon=True) for i in range(count)]
+        for worker in _workers:
+            worker.start()
+        _workers_pid = os.getpid()
+
+if __name__ == '__main__':
+    # Processo dedicado de ingestao; rode o app com INGEST_WORKERS=0 para usar so este
+    start_workers(max(INGEST_WORKERS, 1))
+    print(f"{len(_workers)} workers de ingestao rodando")
+    while True:
+        time.sleep(3600)
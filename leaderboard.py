@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+from database import XP_TREE_BITS, get_db, day_number
+
+# Tempo maximo (segundos) que um worker serve o ranking semanal sem reconsultar o banco
+FOCUS_RANKING_TTL = int(os.environ.get('FOCUS_RANKING_TTL', 30))
+FOCUS_RANKING_SIZE = 10
+
+# Tempo maximo (segundos) que um worker serve o topo do ranking de XP sem reconsultar
+# o banco; posicoes, total e demais paginas sao sempre consultados
+XP_RANKING_TTL = int(os.environ.get('XP_RANKING_TTL', 5))
+XP_RANKING_CACHED = 20
+
+class WeeklyFocusRanking:
+    """Ranking semanal de foco servido a partir de um snapshot em memoria
+
+    O snapshot e montado com uma unica agregacao sobre user_daily_stats
+    (no maximo 8 linhas por usuario ativo) e guarda o top-K ja com os nomes,
+    mais a lista ordenada de totais para responder a posicao de qualquer
+    usuario com bisect. E reconstruido quando expira o TTL, quando a semana
+    muda ou quando invalidate() e chamado apos uma nova sessao de foco.
+    """
+
+    def __init__(self, ttl=FOCUS_RANKING_TTL, size=FOCUS_RANKING_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _current(self):
+        week_start = day_number(datetime.now() - timedelta(days=7))
+        snapshot = self._snapshot
+        if snapshot and snapshot['week_start'] == week_start and snapshot['expires_at'] > time.monotonic():
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot and snapshot['week_start'] == week_start and snapshot['expires_at'] > time.monotonic():
+                return snapshot
+            snapshot = self._build(week_start)
+            self._snapshot = snapshot
+            return snapshot
+
+    def _build(self, week_start):
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT user_id, SUM(focus_minutes) as total
+            FROM user_daily_stats
+            WHERE day >= ?
+            GROUP BY user_id
+            HAVING total > 0
+            ORDER BY total DESC
+        ''', (week_start,))
+        rows = cursor.fetchall()
+
+        totals = {row['user_id']: row['total'] for row in rows}
+        # Totais negados em ordem crescente, para bisect
+        ordered = [-row['total'] for row in rows]
+
+        top_ids = [row['user_id'] for row in rows[:self.size]]
+        users = {}
+        if top_ids:
+            placeholders = ','.join('?' * len(top_ids))
+            cursor.execute(f'SELECT id, username, name FROM users WHERE id IN ({placeholders})', top_ids)
+            users = {user['id']: user for user in cursor.fetchall()}
+
+        ranking = [
+            {'user_id': user_id, 'username': users[user_id]['username'],
+             'name': users[user_id]['name'], 'total_focus': totals[user_id]}
+            for user_id in top_ids if user_id in users
+        ]
+
+        # Completa o ranking com usuarios sem foco na semana, como antes
+        if len(ranking) < self.size:
+            placeholders = ','.join('?' * len(top_ids))
+            cursor.execute(f'''
+                SELECT id, username, name FROM users
+                WHERE id NOT IN ({placeholders})
+                ORDER BY id LIMIT ?
+            ''', top_ids + [self.size - len(ranking)])
+            ranking += [
+                {'user_id': user['id'], 'username': user['username'], 'name': user['name'], 'total_focus': 0}
+                for user in cursor.fetchall()
+            ]
+
+        return {
+            'week_start': week_start,
+            'expires_at': time.monotonic() + self.ttl,
+            'ranking': ranking,
+            'totals': totals,
+            'ordered': ordered,
+        }
+
+    def top(self):
+        return self._current()['ranking']
+
+    def rank_of(self, user_id):
+        """Retorna (posicao, minutos na semana) do usuario; empates dividem a posicao"""
+        snapshot = self._current()
+        total = snapshot['totals'].get(user_id, 0)
+        return bisect_left(snapshot['ordered'], -total) + 1, total
+
+class XPRanking:
+    """Ranking global por XP, consultado no banco por todos os workers
+
+    A posicao vem da arvore de Fenwick xp_tree, que os triggers de users mantem
+    na mesma transacao de add_xp: quantos usuarios tem mais XP e a raiz menos
+    a soma de no maximo XP_TREE_BITS nos, lidos pela chave primaria. Empates
+    dividem a posicao. As paginas seguem por keyset no indice idx_users_xp a
+    partir do (xp, id) do ultimo usuario da anterior, sem OFFSET. So o topo fica
+    em memoria, por XP_RANKING_TTL segundos.
+    """
+
+    def __init__(self, ttl=XP_RANKING_TTL, cached_size=XP_RANKING_CACHED):
+        self.ttl = ttl
+        self.cached_size = cached_size
+        self._cache = {}
+
+    def invalidate(self):
+        self._cache = {}
+
+    def _cached(self, key, load):
+        entry = self._cache.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        value = load()
+        self._cache[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    @staticmethod
+    def _prefix_nodes(xp):
+        """Nos da xp_tree cuja soma e o numero de usuarios com XP <= xp"""
+        index = min(max(xp, 0), (1 << XP_TREE_BITS) - 1) + 1
+        nodes = []
+        while index:
+            nodes.append(index)
+            index &= index - 1
+        return nodes
+
+    def _positions(self, cursor, xp_values):
+        """Posicao (1 + usuarios com mais XP) para cada XP, com uma unica consulta"""
+        root = 1 << XP_TREE_BITS
+        wanted = {xp: self._prefix_nodes(xp) for xp in set(xp_values)}
+        nodes = sorted({root}.union(*wanted.values()))
+        cursor.execute(f'SELECT node, users FROM xp_tree WHERE node IN ({",".join("?" * len(nodes))})', nodes)
+        users = {row['node']: row['users'] for row in cursor.fetchall()}
+        total = users.get(root, 0)
+        return {xp: 1 + total - sum(users.get(node, 0) for node in prefix) for xp, prefix in wanted.items()}
+
+    def count(self):
+        cursor = get_db().cursor()
+        cursor.execute('SELECT users FROM xp_tree WHERE node = ?', (1 << XP_TREE_BITS,))
+        row = cursor.fetchone()
+        return row['users'] if row else 0
+
+    def rank_of(self, user_id):
+        """Retorna (posicao, xp) do usuario"""
+        cursor = get_db().cursor()
+        cursor.execute('SELECT xp FROM users WHERE id = ?', (user_id,))
+        user = cursor.fetchone()
+        xp = user['xp'] if user else 0
+        return self._positions(cursor, [xp])[xp], xp
+
+    def _entries(self, cursor, rows):
+        positions = self._positions(cursor, [row['xp'] for row in rows]) if rows else {}
+        return [
+            {'position': positions[row['xp']], 'username': row['username'], 'name': row['name'],
+             'level': row['level'], 'xp': row['xp'], 'streak_days': row['streak_days'],
+             'cursor': f"{row['xp']}:{row['id']}"}
+            for row in rows
+        ]
+
+    def _first(self, limit):
+        cursor = get_db().cursor()
+        cursor.execute('''
+            SELECT id, username, name, level, xp, streak_days
+            FROM users ORDER BY xp DESC, id LIMIT ?
+        ''', (limit,))
+        return self._entries(cursor, cursor.fetchall())
+
+    def page(self, limit=20):
+        """Primeira pagina do ranking; as seguintes vem de page_after"""
+        if limit <= self.cached_size:
+            return self._cached('top', lambda: self._first(self.cached_size))[:limit]
+        return self._first(limit)
+
+    def page_after(self, after, limit=20):
+        """Pagina seguinte ao cursor "xp:id" (campo 'cursor' do ultimo item); ValueError se invalido"""
+        xp, user_id = (int(part) for part in after.split(':'))
+        cursor = get_db().cursor()
+        # xp <= ? limita a faixa do indice; os empates com o cursor sao filtrados pelo id
+        cursor.execute('''
+            SELECT id, username, name, level, xp, streak_days
+            FROM users WHERE xp <= ? AND (xp < ? OR id > ?)
+            ORDER BY xp DESC, id LIMIT ?
+        ''', (xp, xp, user_id, limit))
+        return self._entries(cursor, cursor.fetchall())
+
+focus_ranking = WeeklyFocusRanking()
+xp_ranking = XPRanking()
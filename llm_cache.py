@@ -0,0 +1,217 @@
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from database import get_db, transaction
+from summarizer import parse_json_response
+
+DAY = 24 * 3600
+# Por endpoint: validade (segundos) das respostas, None = nunca usar cache, e se a
+# resposta precisa ser um JSON valido para ser guardada
+CACHE_POLICIES = {
+    'explain': {'ttl': 30 * DAY, 'json': False},
+    'summary': {'ttl': 30 * DAY, 'json': True},
+    # Quizzes repetem por um dia; depois o mesmo tema gera questoes novas
+    'quiz': {'ttl': DAY, 'json': True},
+    'chat': {'ttl': None, 'json': False},
+    'mentor': {'ttl': None, 'json': False},
+    'plan': {'ttl': None, 'json': False},
+}
+LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get('LLM_CACHE_MEMORY_ENTRIES', 512))
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# A cada quantas gravacoes a tabela e podada (expiradas + excesso de tamanho)
+EVICT_EVERY = 50
+
+def cache_key(model_name, prompt):
+    """SHA-256 do modelo + prompt normalizado (NFC, espacos colapsados)"""
+    normalized = ' '.join(unicodedata.normalize('NFC', prompt).split())
+    return hashlib.sha256(f'{model_name}\0{normalized}'.encode()).hexdigest()
+
+class CachedResponse:
+    """Resposta servida do cache, com a mesma interface (.text) da resposta do SDK"""
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+def stream_parts(response):
+    """Texto de cada parte de uma resposta em stream do SDK, pulando as sem texto"""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Partes so com metadados (ex: finish_reason no fim) nao tem texto
+            continue
+        if text:
+            yield text
+
+class ResponseCache:
+    """Cache de respostas do modelo em dois niveis
+
+    LRU em memoria por processo (sem I/O) na frente de uma tabela SQLite
+    compartilhada pelos workers e que sobrevive a restarts. A tabela expira por
+    TTL e e podada pelo tamanho total, removendo primeiro as menos usadas.
+    """
+
+    def __init__(self, max_entries=LLM_CACHE_MEMORY_ENTRIES, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._stats = {}
+        self._writes = 0
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            counters = self._stats.setdefault(endpoint, {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'bypass': 0})
+            counters[outcome] += 1
+
+    def get(self, endpoint, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+            else:
+                entry = None
+        if entry:
+            self._count(endpoint, 'memory_hits')
+            return entry[1]
+
+        cursor = get_db().cursor()
+        cursor.execute('SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?', (key, now))
+        row = cursor.fetchone()
+        if row is None:
+            self._count(endpoint, 'misses')
+            return None
+
+        with transaction() as cursor:
+            cursor.execute('UPDATE llm_cache SET hits = hits + 1, last_hit_at = ? WHERE key = ?', (now, key))
+        self._remember(key, row['expires_at'], row['response'])
+        self._count(endpoint, 'db_hits')
+        return row['response']
+
+    def put(self, endpoint, key, model_name, response, ttl):
+        now = time.time()
+        with transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO llm_cache (key, endpoint, model, response, size, created_at, expires_at, last_hit_at, hits)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ''', (key, endpoint, model_name, response, len(response.encode()), now, now + ttl, now))
+            with self._lock:
+                self._writes += 1
+                evict = self._writes % EVICT_EVERY == 0
+            if evict:
+                self._evict(cursor, now)
+        self._remember(key, now + ttl, response)
+
+    def _remember(self, key, expires_at, response):
+        with self._lock:
+            self._memory[key] = (expires_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _evict(self, cursor, now):
+        cursor.execute('DELETE FROM llm_cache WHERE expires_at <= ?', (now,))
+        # Mantem as entradas usadas mais recentemente ate somar max_bytes
+        cursor.execute('''
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY last_hit_at DESC, key) as running
+                    FROM llm_cache
+                ) WHERE running > ?
+            )
+        ''', (self.max_bytes,))
+
+    def generate(self, client, endpoint, prompt, **kwargs):
+        """client.generate_content(prompt) passando pelo cache, conforme a politica do endpoint"""
+        policy = CACHE_POLICIES.get(endpoint, {'ttl': None})
+        if policy['ttl'] is None or kwargs:
+            self._count(endpoint, 'bypass')
+            return client.generate_content(prompt, **kwargs)
+
+        model_name = getattr(client, 'model_name', '')
+        key = cache_key(model_name, prompt)
+        text = self.get(endpoint, key)
+        if text is not None:
+            return CachedResponse(text)
+
+        response = client.generate_content(prompt)
+        text = response.text
+        if text and self._cacheable(text, policy):
+            self.put(endpoint, key, model_name, text, policy['ttl'])
+        return response
+
+    def stream(self, client, endpoint, prompt):
+        """Partes do texto da resposta, com generate_content(stream=True), passando pelo cache
+
+        Uma resposta em cache sai em uma parte so. Uma nova so e guardada se o
+        stream chegar ao fim; fechar o gerador no meio (cliente desconectou) para
+        de consumir o modelo e nao grava nada.
+        """
+        policy = CACHE_POLICIES.get(endpoint, {'ttl': None})
+        if policy['ttl'] is None:
+            self._count(endpoint, 'bypass')
+            yield from stream_parts(client.generate_content(prompt, stream=True))
+            return
+
+        model_name = getattr(client, 'model_name', '')
+        key = cache_key(model_name, prompt)
+        text = self.get(endpoint, key)
+        if text is not None:
+            yield text
+            return
+
+        parts = []
+        for part in stream_parts(client.generate_content(prompt, stream=True)):
+            parts.append(part)
+            yield part
+        text = ''.join(parts)
+        if text and self._cacheable(text, policy):
+            self.put(endpoint, key, model_name, text, policy['ttl'])
+
+    @staticmethod
+    def _cacheable(text, policy):
+        if not policy['json']:
+            return True
+        try:
+            parse_json_response(text)
+            return True
+        except ValueError:
+            return False
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for endpoint, counters in sorted(self._stats.items()):
+                hits = counters['memory_hits'] + counters['db_hits']
+                lookups = hits + counters['misses']
+                stats[endpoint] = dict(counters, hit_rate=round(hits / lookups, 3) if lookups else None)
+            return {'memory_entries': len(self._memory), 'endpoints': stats}
+
+class CachedModel:
+    """Modelo com generate_content atras do cache, para codigo que recebe um client"""
+
+    def __init__(self, client, endpoint, cache):
+        self._client = client
+        self._endpoint = endpoint
+        self._cache = cache
+
+    def generate_content(self, prompt, **kwargs):
+        return self._cache.generate(self._client, self._endpoint, prompt, **kwargs)
+
+    def stream(self, prompt):
+        return self._cache.stream(self._client, self._endpoint, prompt)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+response_cache = ResponseCache()
+
+def cached(client, endpoint):
+    return CachedModel(client, endpoint, response_cache)
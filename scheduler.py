@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from database import day_number, day_to_date
+
+def sm2_batch(quality, repetitions, ease_factor, interval):
+    """sm2_algorithm() aplicado a arrays inteiros de uma vez
+
+    Retorna (repetitions, ease_factor, interval) com exatamente os mesmos
+    valores da versao escalar, card a card.
+    """
+    quality = np.asarray(quality, dtype=np.int64)
+    repetitions = np.asarray(repetitions, dtype=np.int64)
+    ease_factor = np.asarray(ease_factor, dtype=np.float64)
+    interval = np.asarray(interval, dtype=np.int64)
+
+    failed = quality < 3
+    grown = (interval * ease_factor).astype(np.int64)
+    new_interval = np.where(failed | (repetitions == 0), 1, np.where(repetitions == 1, 6, grown))
+    new_repetitions = np.where(failed, 0, repetitions + 1)
+
+    penalty = 5 - quality
+    new_ease = np.maximum(ease_factor + (0.1 - penalty * (0.08 + penalty * 0.02)), 1.3)
+
+    return new_repetitions, new_ease, new_interval
+
+class Deck:
+    """Colunas de agendamento dos flashcards de um usuario como arrays NumPy"""
+
+    def __init__(self, ids, repetitions, ease_factor, interval_days, due_day):
+        self.ids = ids
+        self.repetitions = repetitions
+        self.ease_factor = ease_factor
+        self.interval_days = interval_days
+        # Dia juliano da proxima revisao; cards sem data ficam com o dia de hoje
+        self.due_day = due_day
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, cursor, user_id, deck_name=None):
+        query = '''
+            SELECT id, repetitions, ease_factor, interval_days, next_review_day
+            FROM flashcards WHERE user_id = ?
+        '''
+        params = [user_id]
+        if deck_name:
+            query += ' AND deck_name = ?'
+            params.append(deck_name)
+        cursor.execute(query + ' ORDER BY id', params)
+        rows = [row.values() for row in cursor.fetchall()]
+
+        today = day_number(datetime.now())
+        if not rows:
+            empty = np.empty(0, dtype=np.int64)
+            return cls(empty, empty, np.empty(0, dtype=np.float64), empty, empty)
+
+        ids, repetitions, ease_factor, interval_days, due_day = zip(*rows)
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(repetitions, dtype=np.int64),
+            np.array(ease_factor, dtype=np.float64),
+            np.array(interval_days, dtype=np.int64),
+            np.array([today if day is None else day for day in due_day], dtype=np.int64),
+        )
+
+    def save(self, cursor, mask=None):
+        """Grava os cards selecionados por mask (todos, por padrao) com um unico executemany"""
+        index = np.arange(len(self.ids)) if mask is None else np.flatnonzero(mask)
+        cursor.executemany('''
+            UPDATE flashcards
+            SET repetitions = ?, ease_factor = ?, interval_days = ?, next_review = ?
+            WHERE id = ?
+        ''', [
+            (int(self.repetitions[i]), float(self.ease_factor[i]), int(self.interval_days[i]),
+             day_to_date(int(self.due_day[i])), int(self.ids[i]))
+            for i in index
+        ])
+        return len(index)
+
+def review_deck(deck, quality, today=None):
+    """Aplica uma nota (escalar ou array) a todos os cards do deck e reagenda a partir de hoje"""
+    today = day_number(datetime.now()) if today is None else today
+    deck.repetitions, deck.ease_factor, deck.interval_days = sm2_batch(
+        np.broadcast_to(quality, deck.ids.shape), deck.repetitions, deck.ease_factor, deck.interval_days
+    )
+    deck.due_day = today + deck.interval_days
+    return deck
+
+def shift_overdue(deck, days, today=None):
+    """Empurra os cards atrasados em `days` dias, como se a pausa nao tivesse acontecido
+
+    Cards que continuariam atrasados ficam para hoje. Retorna a mascara dos cards alterados.
+    """
+    today = day_number(datetime.now()) if today is None else today
+    overdue = deck.due_day < today
+    deck.due_day = np.where(overdue, np.maximum(deck.due_day + days, today), deck.due_day)
+    return overdue
+
+def balance_due_dates(deck, max_per_day, today=None):
+    """Redistribui as datas para que nenhum dia tenha mais de max_per_day cards
+
+    Os cards atrasados contam como devidos hoje. A ordem de vencimento e mantida
+    (fila FIFO): o excedente de um dia passa para o seguinte. O carry-over dia a
+    dia e a recursao de Lindley, calculada sem loop como
+    S_t - min(0, min S_s) sobre S = cumsum(devidos - capacidade).
+    Retorna a mascara dos cards que mudaram de data.
+    """
+    if max_per_day < 1:
+        raise ValueError('max_per_day deve ser pelo menos 1')
+    if not len(deck):
+        return np.zeros(0, dtype=bool)
+
+    today = day_number(datetime.now()) if today is None else today
+    due = np.maximum(deck.due_day, today)
+    order = np.lexsort((deck.ids, due))
+
+    # Horizonte grande o bastante para absorver todo o excedente
+    offsets = due - today
+    horizon = int(offsets.max()) + 1 + -(-len(due) // max_per_day)
+    arrivals = np.bincount(offsets, minlength=horizon)
+
+    walk = np.cumsum(arrivals - max_per_day)
+    backlog = walk - np.minimum(np.minimum.accumulate(walk), 0)
+    served = arrivals + np.concatenate(([0], backlog[:-1])) - backlog
+
+    new_due = np.empty_like(due)
+    new_due[order] = today + np.repeat(np.arange(horizon), served)
+
+    changed = new_due != deck.due_day
+    deck.due_day = np.where(changed, new_due, deck.due_day)
+    return changed
+
+# Nota assumida para cada revisao futura na projecao (4 = lembrou com alguma hesitacao)
+FORECAST_QUALITY = 4
+# Tempo (segundos) que uma previsao fica em cache; mudancas nos cards do usuario a invalidam antes
+FORECAST_TTL = int(os.environ.get('FORECAST_TTL', 600))
+
+def forecast_due(cursor, user_id, days, project=False, today=None):
+    """Quantos cards vencem em cada um dos proximos `days` dias
+
+    O histograma do que ja esta agendado sai de uma unica agregacao no indice
+    (user_id, next_review_day); atrasados contam para hoje. Com project=True
+    tambem simula, de forma vetorizada sobre todos os cards, as revisoes
+    seguintes (nota FORECAST_QUALITY, modelo SM-2) que caem dentro do periodo.
+    Retorna uma lista de dicts {date, due[, projected]}.
+    """
+    today = day_number(datetime.now()) if today is None else today
+    cursor.execute('''
+        SELECT MAX(next_review_day, ?) as day, COUNT(*) as count
+        FROM flashcards
+        WHERE user_id = ? AND next_review_day < ?
+        GROUP BY 1
+    ''', (today, user_id, today + days))
+    scheduled = np.zeros(days, dtype=np.int64)
+    for row in cursor.fetchall():
+        scheduled[row['day'] - today] = row['count']
+
+    forecast = [{'date': day_to_date(today + offset), 'due': int(scheduled[offset])} for offset in range(days)]
+    if not project:
+        return forecast
+
+    deck = Deck.load(cursor, user_id)
+    offset = np.maximum(deck.due_day, today) - today
+    repetitions, ease_factor, interval = deck.repetitions, deck.ease_factor, deck.interval_days
+    projected = np.zeros(days, dtype=np.int64)
+
+    # Cada rodada revisa os cards que ainda vencem dentro do periodo; avancando pelo
+    # menos um dia por rodada sao no maximo `days` rodadas, normalmente bem menos
+    active = np.flatnonzero(offset < days)
+    while len(active):
+        projected += np.bincount(offset[active], minlength=days)
+        repetitions[active], ease_factor[active], interval[active] = sm2_batch(
+            FORECAST_QUALITY, repetitions[active], ease_factor[active], interval[active]
+        )
+        offset[active] += np.maximum(interval[active], 1)
+        active = active[offset[active] < days]
+
+    for day, count in zip(forecast, projected):
+        day['projected'] = int(count)
+    return forecast
+
+class ForecastCache:
+    """Cache em memoria das previsoes, conferido contra users.flashcards_version
+
+    A versao fica no banco e invalidate() a incrementa na mesma transacao que
+    muda os cards, entao uma revisao feita em qualquer worker (ou no gateway de
+    IA) vale para o cache de todos na leitura seguinte. Cada usuario guarda so as
+    previsoes da versao atual; as expiradas saem na varredura feita a cada TTL.
+    """
+
+    def __init__(self, ttl=FORECAST_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + ttl
+
+    def get(self, cursor, user_id, days, project, compute):
+        cursor.execute('SELECT flashcards_version FROM users WHERE id = ?', (user_id,))
+        user = cursor.fetchone()
+        version = (user['flashcards_version'] if user else 0, day_number(datetime.now()))
+        key = (days, project)
+        cached_version, entries = self._entries.get(user_id, (None, {}))
+        entry = entries.get(key) if cached_version == version else None
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        value = compute()
+        now = time.monotonic()
+        with self._lock:
+            # Uma versao nova (ou um novo dia) descarta as previsoes anteriores do usuario
+            cached_version, entries = self._entries.get(user_id, (None, {}))
+            if cached_version != version:
+                entries = {}
+                self._entries[user_id] = (version, entries)
+            entries[key] = (now + self.ttl, value)
+            if now >= self._next_sweep:
+                self._sweep(now)
+        return value
+
+    def _sweep(self, now):
+        for user_id, (_, entries) in list(self._entries.items()):
+            for key, entry in list(entries.items()):
+                if entry[0] <= now:
+                    del entries[key]
+            if not entries:
+                del self._entries[user_id]
+        self._next_sweep = now + self.ttl
+
+    def invalidate(self, cursor, user_id):
+        """Invalida as previsoes do usuario em todos os processos quando a transacao do cursor confirmar"""
+        cursor.execute('UPDATE users SET flashcards_version = flashcards_version + 1 WHERE id = ?', (user_id,))
+
+forecast_cache = ForecastCache()
@@ -0,0 +1,79 @@
+import html
+import re
+
+from database import SEARCH_SOURCES, PDF_CHUNK_CODE
+
+SEARCH_KINDS = tuple(kind for kind, *_ in SEARCH_SOURCES)
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_TERMS = 10
+# Peso do titulo e do corpo no bm25; owner e kind so filtram
+TITLE_WEIGHT = 4.0
+BODY_WEIGHT = 1.0
+
+# Marcadores que nao aparecem no texto, trocados por <mark> depois do escape do HTML
+_OPEN, _CLOSE = '\x02', '\x03'
+
+def build_match(text, user_id, kinds=None):
+    """Monta a expressao MATCH do FTS5 a partir do texto digitado; None se nao ha termos
+
+    Cada palavra vira um termo entre aspas (sem sintaxe do usuario no MATCH) e a
+    ultima casa por prefixo, para a busca funcionar enquanto se digita.
+    """
+    terms = re.findall(r'\w+', text.lower())[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+
+    query = ' '.join(f'"{term}"' for term in terms) + '*'
+    match = f'owner : "u{int(user_id)}" AND {{title body}} : ({query})'
+    if kinds:
+        match += ' AND kind : (' + ' OR '.join(f'"{kind}"' for kind in kinds) + ')'
+    return match
+
+def _highlight(text):
+    return html.escape(text or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+def search(cursor, user_id, text, kinds=None, offset=0, limit=SEARCH_PAGE_SIZE):
+    """Resultados do usuario ordenados por bm25, com trechos destacados
+
+    Os pedacos de um mesmo PDF viram um resultado so, com a nota e o trecho do
+    melhor pedaco (e a pagina dele). Retorna (resultados, has_more). Os trechos
+    ja vem com o HTML escapado.
+    """
+    match = build_match(text, user_id, kinds)
+    if match is None:
+        return [], False
+
+    # Nos pedacos de PDF o id do PDF e a pagina estao no rowid (ver database.PDF_CHUNK_ROWID)
+    cursor.execute(f'''
+        WITH hits AS MATERIALIZED (
+            SELECT kind, rowid & 7 = {PDF_CHUNK_CODE} as is_chunk,
+                   CASE WHEN rowid & 7 = {PDF_CHUNK_CODE} THEN rowid >> 27 ELSE rowid >> 3 END as id,
+                   CASE WHEN rowid & 7 = {PDF_CHUNK_CODE} THEN (rowid >> 11) & 65535 END as page,
+                   highlight(search_index, 2, '{_OPEN}', '{_CLOSE}') as title,
+                   snippet(search_index, 3, '{_OPEN}', '{_CLOSE}', '...', 16) as snippet,
+                   bm25(search_index, 0, 0, {TITLE_WEIGHT}, {BODY_WEIGHT}) as score
+            FROM search_index
+            WHERE search_index MATCH ?
+        ), grouped AS (
+            SELECT kind, id, MIN(score) as score, page, snippet,
+                   MAX(CASE WHEN is_chunk THEN NULL ELSE title END) as title
+            FROM hits
+            GROUP BY kind, id
+        )
+        SELECT grouped.kind, grouped.id, grouped.page, grouped.snippet, grouped.score,
+               COALESCE(grouped.title, pdfs.original_name) as title
+        FROM grouped
+        LEFT JOIN pdfs ON grouped.kind = 'pdf' AND pdfs.id = grouped.id
+        ORDER BY grouped.score
+        LIMIT ? OFFSET ?
+    ''', (match, limit + 1, offset))
+    rows = cursor.fetchall()
+
+    results = []
+    for row in rows[:limit]:
+        result = {'type': row['kind'], 'id': row['id'], 'title': _highlight(row['title']),
+                  'snippet': _highlight(row['snippet']), 'score': round(-row['score'], 4)}
+        if row['page'] is not None:
+            result['page'] = row['page']
+        results.append(result)
+    return results, len(rows) > limit
@@ -231,4 +231,72 @@ document.querySelectorAll('.card, .stat-card, .feature-card').forEach(el => {
     el.style.transform = 'translateY(20px)';
     el.style.transition = 'opacity 0.5s ease, transform 0.5s ease';
     observer.observe(el);
-});
\ No newline at end of file
+});
+// Rotas de IA rodam como jobs no gateway: a requisicao volta 202 na hora e o
+// resultado e buscado em /api/ai/jobs/<id>. Com onText (chat e explicacoes) o
+// texto chega em server-sent events pela propria requisicao, direto do worker
+// que roda o job; se o servidor nao puder fazer stream, ele volta 202 e o texto
+// parcial vem do polling. Retorna o mesmo JSON da rota sincrona.
+async function aiRequest(url, options = {}, onText = null) {
+    if (onText) {
+        options = Object.assign({}, options, {
+            headers: Object.assign({}, options.headers, { 'Accept': 'text/event-stream' })
+        });
+    }
+    const response = await fetch(url, options);
+    if (onText && (response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+        return readEventStream(response, onText);
+    }
+    const data = await response.json().catch(() => ({ error: 'Erro de comunicacao com o servidor' }));
+    if (response.status !== 202 || !data.status_url) {
+        return response.ok ? data : Object.assign({ success: false }, data);
+    }
+
+    let offset = 0;
+    let text = '';
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, onText ? 300 : 1000));
+        const poll = await fetch(`${data.status_url}?after=${offset}`);
+        const { job, error } = await poll.json();
+        if (!job) return { success: false, error: error || 'Tarefa nao encontrada' };
+
+        offset = job.offset;
+        if (job.text && onText) {
+            text += job.text;
+            onText(text);
+        }
+        if (job.status === 'done') return Object.assign({ success: true }, job.result);
+        if (job.status === 'failed' || job.status === 'cancelled') return { success: false, error: job.error };
+    }
+}
+
+// Eventos 'token' ({text}), 'done' (resultado do job) e 'error' ({error, status}) de streaming.sse_response
+async function readEventStream(response, onText) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            const event = (block.match(/^event: (.*)$/m) || [])[1];
+            const payload = (block.match(/^data: (.*)$/m) || [])[1];
+            if (!payload) continue;
+            const data = JSON.parse(payload);
+            if (event === 'token') {
+                text += data.text;
+                onText(text);
+            } else if (event === 'done') {
+                return data;
+            } else if (event === 'error') {
+                return { success: false, error: data.error };
+            }
+        }
+    }
+    return { success: false, error: 'Conexao encerrada antes do fim da resposta' };
+}
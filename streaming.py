@@ -0,0 +1,91 @@
+import json
+import os
+import re
+from datetime import datetime
+
+from flask import Response, request, stream_with_context
+
+from ai_tasks import describe_ai_error
+
+# Sem buffer no caminho: proxies (nginx e afins) seguram a resposta inteira sem isso
+SSE_HEADERS = {'X-Accel-Buffering': 'no'}
+# Workers do gunicorn que seguram uma resposta longa sem parar de atender as outras
+# requisicoes; no worker sync (o padrao) cada stream ocupa o processo inteiro
+STREAMING_WORKERS = ('ThreadWorker', 'GeventWorker', 'GeventPyWSGIWorker', 'EventletWorker', 'TornadoWorker')
+
+def wants_stream(data=None):
+    """Cliente pediu a resposta em server-sent events (Accept ou "stream": true no corpo)"""
+    if data and data.get('stream'):
+        return True
+    return request.accept_mimetypes.best == 'text/event-stream'
+
+def stream_supported():
+    """O worker atual pode segurar um stream SSE
+
+    A classe do worker e gravada em GUNICORN_WORKER_CLASS pelo post_fork de
+    gunicorn.conf.py. Sob o gunicorn sem essa informacao (ex: outro arquivo de
+    configuracao) o stream e recusado. Fora do gunicorn (servidor de
+    desenvolvimento, testes) e permitido.
+    """
+    worker = os.environ.get('GUNICORN_WORKER_CLASS')
+    if worker is None:
+        return 'gunicorn.socket' not in request.environ
+    return worker in STREAMING_WORKERS
+
+def requested_wait(limit, data=None):
+    """Segundos (ate `limit`) que o cliente aceita esperar pela resposta; None se nao pediu
+
+    Esperar e opt-in: Prefer: wait=<segundos> (RFC 7240) ou "wait" no corpo,
+    com os segundos ou true para esperar ate o limite.
+    """
+    wait = data.get('wait') if data else None
+    if wait is True or wait == 'true':
+        return limit
+    if wait in (None, False, '', 'false'):
+        match = re.search(r'\bwait=([\d.]+)', request.headers.get('Prefer', ''))
+        if not match:
+            return None
+        wait = match.group(1)
+    try:
+        seconds = float(wait)
+    except (TypeError, ValueError):
+        return None
+    return min(seconds, limit) if seconds > 0 else None
+
+def sse_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+def sse_response(parts, on_complete=None):
+    """Resposta text/event-stream com cada parte do texto em um evento 'token'
+
+    Quando o texto termina, on_complete(texto) roda (ex: gravar a mensagem) e o
+    dict que ele retornar vai no evento 'done'. Erros do modelo viram um evento
+    'error'. Se o cliente desconecta, o servidor fecha este gerador no proximo
+    yield: o stream do modelo e fechado junto e on_complete nao roda.
+    """
+    def events():
+        chunks = []
+        try:
+            for part in parts:
+                chunks.append(part)
+                yield sse_event('token', {'text': part})
+        except GeneratorExit:
+            print(f"[{datetime.now()}] Cliente desconectou durante o stream de {request.path}")
+            raise
+        except Exception as e:
+            print(f"Erro no stream de {request.path}: {e}")
+            message, status = describe_ai_error(e)
+            yield sse_event('error', {'error': message, 'status': status})
+            return
+        finally:
+            if hasattr(parts, 'close'):
+                parts.close()
+
+        text = ''.join(chunks)
+        if not text:
+            yield sse_event('error', {'error': 'API retornou resposta vazia. Tente novamente.', 'status': 500})
+            return
+        extra = on_complete(text) if on_complete else None
+        yield sse_event('done', {'success': True, **(extra or {})})
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=SSE_HEADERS)
@@ -0,0 +1,136 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from database import release_db
+
+# Caracteres de texto por chamada ao modelo (o mesmo limite do resumo em uma chamada so)
+SUMMARY_CHUNK_CHARS = 8000
+# Chamadas simultaneas ao modelo por resumo; um documento longo vira no maximo essa
+# quantidade de partes, para o map terminar em uma so leva
+SUMMARY_MAX_PARALLEL = int(os.environ.get('SUMMARY_MAX_PARALLEL', 8))
+# Teto de cada parte; so documentos perto de SUMMARY_MAX_PARALLEL * isso passam de uma leva
+SUMMARY_MAX_CHUNK_CHARS = 32000
+SUMMARY_MAX_FLASHCARDS = 10
+
+SUMMARY_SCHEMA = '''{{
+            "title": "titulo do conteudo",
+            "short_summary": "resumo curto em 2-3 frases",
+            "full_summary": "resumo completo e detalhado",
+            "topics": ["topico 1", "topico 2", "topico 3"],
+            "flashcards": [{{"front": "pergunta", "back": "resposta"}}],
+            "mind_map": {{"central": "tema central", "branches": [{{"name": "subtema", "items": ["item1", "item2"]}}]}}
+        }}'''
+
+SUMMARY_PROMPT = '''Voce e um assistente educacional especializado em criar resumos de estudo.
+        Responda sempre em portugues brasileiro.
+        Retorne APENAS um JSON valido, sem texto adicional, com a seguinte estrutura:
+        ''' + SUMMARY_SCHEMA + '''
+
+        Crie um resumo educacional completo do seguinte texto:
+
+        {text}'''
+
+MAP_PROMPT = '''Voce e um assistente educacional especializado em criar resumos de estudo.
+        Responda sempre em portugues brasileiro.
+        O texto abaixo e a parte {part} de {total} de um documento maior.
+        Retorne APENAS um JSON valido, sem texto adicional, com a seguinte estrutura:
+        {{
+            "title": "titulo desta parte",
+            "summary": "resumo detalhado desta parte",
+            "topics": ["topico 1", "topico 2"],
+            "flashcards": [{{"front": "pergunta", "back": "resposta"}}]
+        }}
+
+        Texto da parte {part}:
+
+        {text}'''
+
+REDUCE_PROMPT = '''Voce e um assistente educacional especializado em criar resumos de estudo.
+        Responda sempre em portugues brasileiro.
+        Abaixo estao os resumos parciais, em ordem, de cada parte de um mesmo documento.
+        Junte-os em um unico resumo do documento inteiro, sem repetir conteudo, escolhendo
+        os {max_flashcards} melhores flashcards.
+        Retorne APENAS um JSON valido, sem texto adicional, com a seguinte estrutura:
+        ''' + SUMMARY_SCHEMA + '''
+
+        Resumos parciais:
+
+        {partials}'''
+
+def parse_json_response(response_text):
+    """JSON da resposta do modelo, sem as cercas ``` e texto em volta"""
+    response_text = response_text.strip()
+    if response_text.startswith('```json'):
+        response_text = response_text[7:]
+    if response_text.startswith('```'):
+        response_text = response_text[3:]
+    if response_text.endswith('```'):
+        response_text = response_text[:-3]
+    response_text = response_text.strip()
+
+    start_idx = response_text.find('{')
+    end_idx = response_text.rfind('}')
+    if start_idx != -1 and end_idx != -1:
+        response_text = response_text[start_idx:end_idx + 1]
+    return json.loads(response_text)
+
+def split_text(text, chunk_chars=SUMMARY_CHUNK_CHARS, parts=SUMMARY_MAX_PARALLEL,
+               max_chunk_chars=SUMMARY_MAX_CHUNK_CHARS):
+    """Divide o texto em ate `parts` partes de tamanho parecido, quebrando em paragrafos
+
+    As partes ficam com ate chunk_chars caracteres enquanto couberem em `parts`;
+    textos maiores dividem o tamanho por `parts`, ate max_chunk_chars. O tamanho
+    e recalculado a cada corte, para a sobra caber nas partes restantes.
+    """
+    chunks = []
+    while text.strip():
+        slots = max(min(parts - len(chunks), -(-len(text) // chunk_chars)), 1)
+        size = min(-(-len(text) // slots), max_chunk_chars)
+        if len(text) <= size:
+            chunks.append(text)
+            break
+        cut = text.rfind('\n', size // 2, size)
+        if cut == -1:
+            cut = text.rfind(' ', size // 2, size)
+        if cut == -1:
+            cut = size
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    return chunks
+
+def _generate(client, prompt):
+    return parse_json_response(client.generate_content(prompt).text)
+
+def summarize(client, text):
+    """Resumo no schema de SUMMARY_SCHEMA, para textos de qualquer tamanho
+
+    Textos que cabem em uma chamada vao direto. Os maiores sao divididos em ate
+    SUMMARY_MAX_PARALLEL partes, resumidas todas ao mesmo tempo (map, em uma so
+    leva), e uma ultima chamada junta os resumos parciais (reduce). A latencia
+    fica perto da de duas chamadas, e nao da soma de todas as partes.
+    """
+    chunks = split_text(text)
+    if len(chunks) <= 1:
+        return _generate(client, SUMMARY_PROMPT.format(text=text[:SUMMARY_CHUNK_CHARS]))
+
+    def summarize_part(numbered):
+        part, chunk = numbered
+        try:
+            return _generate(client, MAP_PROMPT.format(part=part, total=len(chunks), text=chunk))
+        except Exception as e:
+            print(f"Erro ao resumir a parte {part} de {len(chunks)}: {e}")
+            return None
+        finally:
+            # O client pode usar o banco (cache de respostas); devolve a conexao da thread
+            release_db()
+
+    with ThreadPoolExecutor(max_workers=min(SUMMARY_MAX_PARALLEL, len(chunks))) as executor:
+        partials = [partial for partial in executor.map(summarize_part, enumerate(chunks, start=1)) if partial]
+    if not partials:
+        raise ValueError('Nenhuma parte do documento pode ser resumida')
+
+    return _generate(client, REDUCE_PROMPT.format(
+        max_flashcards=SUMMARY_MAX_FLASHCARDS,
+        partials=json.dumps(partials, ensure_ascii=False, indent=1)
+    ))
@@ -3,7 +3,7 @@
 """Script para testar a conexão com SQLite Cloud"""
 
 import os
-from database import get_db
+from database import get_db, release_db
 
 def test_connection():
     print("Testando conexão com SQLite Cloud...")
@@ -27,7 +27,7 @@ def test_connection():
             for table in tables:
                 print(f"  - {table['name']}")
         
-        conn.close()
+        release_db()
         return True
         
     except Exception as e:
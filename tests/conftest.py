@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Banco temporario e modelo local, definidos antes de importar qualquer modulo do app
+os.environ['DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='mentormind-testes-'), 'testes.db')
+os.environ['AI_BACKEND'] = 'fake'
+os.environ.setdefault('SESSION_SECRET', 'testes')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import get_db, release_db, transaction
+
+@pytest.fixture
+def cursor():
+    """Cursor da conexao da thread; a conexao volta ao pool no fim do teste"""
+    yield get_db().cursor()
+    release_db()
+
+@pytest.fixture
+def user_id(cursor):
+    """Usuario novo por teste, para nao depender do que outros testes gravaram"""
+    with transaction() as tx:
+        tx.execute("SELECT COUNT(*) as count FROM users")
+        name = f"teste{tx.fetchone()['count'] + 1}"
+        tx.execute("INSERT INTO users (username, email, password_hash, name) VALUES (?, ?, 'x', ?)",
+                   (name, f'{name}@teste', name))
+        return tx.lastrowid
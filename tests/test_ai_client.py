@@ -0,0 +1,54 @@
+import pytest
+
+from ai_client import ClientRegistry, TimedModel
+
+class Model:
+    def __init__(self, parts, fail_at=None):
+        self.parts = parts
+        self.fail_at = fail_at
+
+    def generate_content(self, prompt, stream=False):
+        if not stream:
+            return ''.join(self.parts)
+        return self._stream()
+
+    def _stream(self):
+        for i, part in enumerate(self.parts):
+            if i == self.fail_at:
+                raise RuntimeError('500 fake')
+            yield part
+
+def timings(registry):
+    return {name: timing.as_dict() for name, timing in registry._timings.items()}
+
+def test_stream_is_timed_when_iteration_ends():
+    registry = ClientRegistry()
+    response = TimedModel(Model(['a', 'b']), 'm', registry).generate_content('p', stream=True)
+    # Ainda nada: o stream so comecou
+    assert 'generate:m' not in timings(registry)
+
+    assert list(response) == ['a', 'b']
+    assert timings(registry)['generate:m']['count'] == 1
+    assert timings(registry)['generate:m']['errors'] == 0
+    assert timings(registry)['first_chunk:m']['count'] == 1
+
+def test_stream_error_is_recorded():
+    registry = ClientRegistry()
+    response = TimedModel(Model(['a', 'b'], fail_at=1), 'm', registry).generate_content('p', stream=True)
+    with pytest.raises(RuntimeError):
+        list(response)
+    assert timings(registry)['generate:m']['errors'] == 1
+
+def test_closed_stream_is_recorded_without_error():
+    registry = ClientRegistry()
+    parts = iter(TimedModel(Model(['a', 'b']), 'm', registry).generate_content('p', stream=True))
+    next(parts)
+    parts.close()
+    assert timings(registry)['generate:m']['count'] == 1
+    assert timings(registry)['generate:m']['errors'] == 0
+
+def test_plain_call_is_timed_on_return():
+    registry = ClientRegistry()
+    assert TimedModel(Model(['a']), 'm', registry).generate_content('p') == 'a'
+    assert timings(registry)['generate:m']['count'] == 1
+    assert 'first_chunk:m' not in timings(registry)
@@ -0,0 +1,145 @@
+import json
+
+import pytest
+
+import ai_gateway
+from ai_gateway import JobCancelled, JobContext
+from database import add_xp, get_db, transaction
+
+STALE = f'-{ai_gateway.AI_JOB_STALE_SECONDS + 60} seconds'
+
+def clear_jobs():
+    with transaction() as tx:
+        tx.execute('DELETE FROM ai_jobs')
+
+def add_job(user_id, kind='teste', status='queued', heartbeat='+0 seconds', partial=''):
+    with transaction() as tx:
+        tx.execute('''
+            INSERT INTO ai_jobs (user_id, kind, payload, status, partial, started_at, heartbeat_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now', ?), datetime('now', ?))
+        ''', (user_id, kind, json.dumps({'text': 'trecho'}), status, partial, heartbeat, heartbeat))
+        return tx.lastrowid
+
+def make_stale(job_id):
+    with transaction() as tx:
+        tx.execute("UPDATE ai_jobs SET heartbeat_at = datetime('now', ?) WHERE id = ?", (STALE, job_id))
+
+def job(job_id):
+    return get_db().execute('SELECT * FROM ai_jobs WHERE id = ?', (job_id,)).fetchone()
+
+def xp_of(user_id):
+    return get_db().execute('SELECT xp FROM users WHERE id = ?', (user_id,)).fetchone()['xp']
+
+@pytest.fixture
+def task(monkeypatch):
+    """Registra a tarefa 'teste'; o teste define o corpo com task(funcao)"""
+    def register(body):
+        monkeypatch.setitem(ai_gateway.AI_TASKS, 'teste', body)
+    return register
+
+def test_heartbeat_keeps_a_live_job_from_being_reaped(cursor, user_id):
+    clear_jobs()
+    live = add_job(user_id, status='running', heartbeat=STALE)
+
+    ai_gateway.heartbeat([live])
+    assert ai_gateway.claim_job() is None
+    assert job(live)['status'] == 'running'
+
+def test_reaped_job_rolls_back_the_task_writes(cursor, user_id, task):
+    clear_jobs()
+    job_id = add_job(user_id)
+    xp = xp_of(user_id)
+
+    def body(context):
+        context.progress('texto gerado')
+        # O gateway parou de renovar o heartbeat (processo travado) e outro worker reaproveitou a vaga
+        make_stale(context.id)
+        ai_gateway.claim_job()
+
+        def save(cursor):
+            add_xp(cursor, context.user_id, 50)
+            cursor.execute("INSERT INTO chat_messages (user_id, role, content) VALUES (?, 'assistant', 'gerada')",
+                           (context.user_id,))
+            return {'ok': True}
+        return context.commit(save)
+
+    task(body)
+    ai_gateway.run_job(ai_gateway.claim_job())
+
+    assert job(job_id)['status'] == 'failed'
+    assert job(job_id)['error_status'] == 504
+    assert job(job_id)['result'] is None
+    assert xp_of(user_id) == xp
+    assert get_db().execute('SELECT COUNT(*) as count FROM chat_messages WHERE user_id = ?',
+                            (user_id,)).fetchone()['count'] == 0
+
+def test_cancelled_queued_job_is_never_claimed(cursor, user_id):
+    clear_jobs()
+    job_id = add_job(user_id)
+
+    ai_gateway.cancel_job(job_id)
+    assert ai_gateway.claim_job() is None
+    assert ai_gateway.job_status(cursor, job_id, user_id)['status'] == 'cancelled'
+
+def test_cancel_stops_a_job_running_in_this_process(cursor, user_id, task):
+    clear_jobs()
+    job_id = add_job(user_id)
+    parts = []
+
+    def body(context):
+        context.progress('primeira parte')
+        ai_gateway.cancel_job(context.id)
+        parts.append('cancelado')
+        context.progress('depois do cancelamento')
+        parts.append('continuou')
+
+    task(body)
+    ai_gateway.run_job(ai_gateway.claim_job())
+
+    assert parts == ['cancelado']
+    assert job(job_id)['status'] == 'cancelled'
+    assert job(job_id)['partial'] == 'primeira parte'
+
+def test_cancel_reaches_a_job_running_in_another_process(cursor, user_id):
+    clear_jobs()
+    job_id = add_job(user_id)
+    # Sem entrada em _live: o job roda em outro worker
+    context = JobContext(ai_gateway.claim_job(), None)
+
+    ai_gateway.cancel_job(job_id)
+    context.text = 'texto'
+    with pytest.raises(JobCancelled):
+        context.flush()
+    with pytest.raises(JobCancelled):
+        context.commit(lambda cursor: {'ok': True})
+    assert job(job_id)['status'] == 'cancelled'
+
+def test_job_status_of_a_job_running_in_another_process(cursor, user_id):
+    clear_jobs()
+    job_id = add_job(user_id, status='running', partial='abcdef')
+
+    status = ai_gateway.job_status(cursor, job_id, user_id)
+    assert (status['text'], status['offset']) == ('abcdef', 6)
+    status = ai_gateway.job_status(cursor, job_id, user_id, after=4)
+    assert (status['text'], status['offset']) == ('ef', 6)
+    # O cliente leu mais do que o banco tem (pela memoria do processo que roda o job):
+    # nada se repete e o offset nao volta
+    status = ai_gateway.job_status(cursor, job_id, user_id, after=9)
+    assert (status['text'], status['offset']) == ('', 9)
+
+def test_job_status_of_a_job_running_in_this_process(cursor, user_id):
+    clear_jobs()
+    job_id = add_job(user_id)
+    context = JobContext(ai_gateway.claim_job(), None)
+    context.progress('abc')
+    context.text += 'def'
+    ai_gateway._live[job_id] = context
+    try:
+        # O banco tem so a primeira parte; a memoria esta a frente
+        assert job(job_id)['partial'] == 'abc'
+        status = ai_gateway.job_status(cursor, job_id, user_id, after=2)
+        assert (status['text'], status['offset']) == ('cdef', 6)
+    finally:
+        ai_gateway._live.pop(job_id)
+
+    assert ai_gateway.job_status(cursor, job_id, user_id + 1000) is None
@@ -0,0 +1,48 @@
+import io
+import os
+
+import pytest
+
+import blobstore
+from database import transaction
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    """Pasta de uploads temporaria, para nao tocar em uploads/ do repositorio"""
+    monkeypatch.setattr(blobstore, 'UPLOAD_ROOT', str(tmp_path))
+    monkeypatch.setattr(blobstore, 'BLOB_FOLDER', str(tmp_path / 'blobs'))
+    monkeypatch.setattr(blobstore, 'VARIANT_FOLDER', str(tmp_path / 'variants'))
+    return tmp_path
+
+def test_blob_is_in_place_before_the_commit(cursor, uploads):
+    sha256, size, temp_path = blobstore.save_stream(io.BytesIO(b'conteudo antes do commit'))
+    with transaction() as tx:
+        path = blobstore.store(tx, sha256, size, temp_path)
+        # Um worker de outro processo pode abrir o caminho assim que o job for confirmado
+        assert os.path.exists(path)
+        assert not os.path.exists(temp_path)
+    with open(path, 'rb') as f:
+        assert f.read() == b'conteudo antes do commit'
+
+def test_blob_of_a_rolled_back_transaction_is_swept_as_orphan(cursor, uploads, monkeypatch):
+    sha256, size, temp_path = blobstore.save_stream(io.BytesIO(b'conteudo desfeito'))
+    with pytest.raises(RuntimeError):
+        with transaction() as tx:
+            path = blobstore.store(tx, sha256, size, temp_path)
+            raise RuntimeError('desfaz')
+    assert os.path.exists(path)
+    assert cursor.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone() is None
+
+    monkeypatch.setattr(blobstore, 'ORPHAN_GRACE_SECONDS', -1)
+    assert blobstore.collect_garbage(sweep_orphans=True) == 1
+    assert not os.path.exists(path)
+
+def test_second_reference_discards_the_temporary_copy(cursor, uploads):
+    data = b'conteudo repetido'
+    with transaction() as tx:
+        first = blobstore.store(tx, *blobstore.save_stream(io.BytesIO(data)))
+    sha256, size, temp_path = blobstore.save_stream(io.BytesIO(data))
+    with transaction() as tx:
+        assert blobstore.store(tx, sha256, size, temp_path) == first
+    assert not os.path.exists(temp_path)
+    assert cursor.execute('SELECT refcount FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()['refcount'] == 2
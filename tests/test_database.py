@@ -0,0 +1,110 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import get_db, transaction, after_commit, due_flashcards
+
+def xp_of(user_id):
+    return get_db().execute('SELECT xp FROM users WHERE id = ?', (user_id,)).fetchone()['xp']
+
+def test_transaction_commits_on_success(cursor, user_id):
+    with transaction() as tx:
+        tx.execute('UPDATE users SET xp = 10 WHERE id = ?', (user_id,))
+    assert not get_db().in_transaction
+    assert xp_of(user_id) == 10
+
+def test_transaction_rolls_back_on_error(cursor, user_id):
+    with pytest.raises(RuntimeError):
+        with transaction() as tx:
+            tx.execute('UPDATE users SET xp = 10 WHERE id = ?', (user_id,))
+            raise RuntimeError('falhou')
+    assert not get_db().in_transaction
+    assert xp_of(user_id) == 0
+
+def test_nested_transaction_commits_with_the_outer_one(cursor, user_id):
+    with transaction() as outer:
+        outer.execute('UPDATE users SET xp = 10 WHERE id = ?', (user_id,))
+        with transaction() as inner:
+            inner.execute('UPDATE users SET xp = xp + 5 WHERE id = ?', (user_id,))
+        # O bloco interno nao faz commit sozinho
+        assert get_db().in_transaction
+    assert xp_of(user_id) == 15
+
+def test_error_in_nested_transaction_rolls_back_everything(cursor, user_id):
+    with pytest.raises(RuntimeError):
+        with transaction() as outer:
+            outer.execute('UPDATE users SET xp = 10 WHERE id = ?', (user_id,))
+            with transaction() as inner:
+                inner.execute('UPDATE users SET xp = xp + 5 WHERE id = ?', (user_id,))
+                raise RuntimeError('falhou')
+    assert xp_of(user_id) == 0
+
+    # O nivel volta a zero: a proxima transacao faz commit normalmente
+    with transaction() as tx:
+        tx.execute('UPDATE users SET xp = 1 WHERE id = ?', (user_id,))
+    assert not get_db().in_transaction
+
+def test_after_commit_runs_only_after_the_outermost_commit(cursor, user_id):
+    seen = []
+    with transaction() as outer:
+        with transaction() as inner:
+            inner.execute('UPDATE users SET xp = 7 WHERE id = ?', (user_id,))
+            after_commit(lambda: seen.append(xp_of(user_id)))
+        assert seen == []
+    assert seen == [7]
+
+def test_after_commit_is_dropped_on_rollback(cursor, user_id):
+    seen = []
+    with pytest.raises(RuntimeError):
+        with transaction():
+            after_commit(lambda: seen.append('commit'))
+            raise RuntimeError('falhou')
+    with transaction():
+        pass
+    assert seen == []
+
+def test_after_commit_runs_immediately_outside_a_transaction(cursor):
+    seen = []
+    after_commit(lambda: seen.append('agora'))
+    assert seen == ['agora']
+
+def add_cards(user_id, dates):
+    with transaction() as tx:
+        for next_review in dates:
+            tx.execute("INSERT INTO flashcards (user_id, front, back, next_review) VALUES (?, 'f', 'v', ?)",
+                       (user_id, next_review))
+
+def test_due_flashcards_pages_through_the_whole_queue_in_order(cursor, user_id):
+    today = date.today()
+    past = [(today - timedelta(days=offset)).isoformat() for offset in (3, 1, 3, 0, 2, 0, 1)]
+    future = [(today + timedelta(days=offset)).isoformat() for offset in (1, 5)]
+    add_cards(user_id, past + future)
+
+    pages, after = [], None
+    while True:
+        cards, after = due_flashcards(cursor, user_id, after, limit=3)
+        pages.append(cards)
+        if after is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    keys = [(card['next_review'], card['id']) for page in pages for card in page]
+    assert keys == sorted(keys)
+    assert len(set(keys)) == len(past)
+    assert all(review <= today.isoformat() for review, _ in keys)
+
+def test_due_flashcards_last_full_page_has_no_cursor(cursor, user_id):
+    add_cards(user_id, [date.today().isoformat()] * 4)
+    cards, after = due_flashcards(cursor, user_id, limit=2)
+    cards, after = due_flashcards(cursor, user_id, after, limit=2)
+    assert len(cards) == 2
+    assert after is None
+
+def test_due_flashcards_only_returns_the_users_cards(cursor, user_id):
+    add_cards(user_id, [date.today().isoformat()])
+    with transaction() as tx:
+        tx.execute("INSERT INTO users (username, email, password_hash, name) VALUES ('outro', 'outro@teste', 'x', 'outro')")
+        add_cards(tx.lastrowid, [date.today().isoformat()] * 3)
+    cards, after = due_flashcards(cursor, user_id)
+    assert len(cards) == 1
+    assert after is None
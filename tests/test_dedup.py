@@ -0,0 +1,46 @@
+import sqlite3
+
+import database
+from dedup import Signature, dedup_flashcards
+
+FRONTS = [
+    'Qual é a função da mitocôndria?',
+    'qual e a funcao da mitocondria',
+    '',
+    '?!',
+    'Fotossíntese ocorre onde?',
+    'x' * 300,
+]
+
+def test_migration_7_backfill_matches_dedup_signatures():
+    """A copia congelada na migracao 7 gera as mesmas linhas que o dedup.py de hoje"""
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = database.row_factory
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE flashcards (id INTEGER PRIMARY KEY, user_id INTEGER, front TEXT)')
+    cursor.executemany('INSERT INTO flashcards (user_id, front) VALUES (?, ?)',
+                       [(1 + i % 2, front) for i, front in enumerate(FRONTS)])
+
+    database._migration_7_flashcard_dedup_index(cursor)
+
+    cursor.execute('SELECT flashcard_id, text_hash, minhash FROM flashcard_signatures ORDER BY flashcard_id')
+    migrated = [(row['flashcard_id'], row['text_hash'], row['minhash']) for row in cursor.fetchall()]
+    signatures = [Signature.of(front) for front in FRONTS]
+    assert migrated == [(i + 1, s.text_hash, s.minhash.tobytes()) for i, s in enumerate(signatures)]
+
+    cursor.execute('SELECT user_id, bucket, flashcard_id FROM flashcard_lsh ORDER BY flashcard_id, bucket')
+    expected = sorted(((1 + i % 2, bucket, i + 1) for i, s in enumerate(signatures) for bucket in s.buckets()),
+                      key=lambda row: (row[2], row[1]))
+    assert [tuple(row.values()) for row in cursor.fetchall()] == expected
+
+def test_dry_run_writes_nothing(cursor, user_id):
+    with database.transaction() as tx:
+        for front in ('Qual e a capital da Franca?', 'qual é a capital da frança', 'Outra pergunta'):
+            tx.execute("INSERT INTO flashcards (user_id, front, back, next_review) VALUES (?, ?, 'b', date('now'))",
+                       (user_id, front))
+    conn = database.get_db()
+    before = conn.total_changes
+    with database.transaction() as tx:
+        duplicates = dedup_flashcards(tx, user_id, dry_run=True)
+    assert len(duplicates) == 1
+    assert conn.total_changes == before
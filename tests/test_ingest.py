@@ -0,0 +1,103 @@
+import time
+
+import ingest
+from database import get_db, transaction
+
+STALE = f'-{ingest.INGEST_STALE_SECONDS + 60} seconds'
+
+def clear_queue():
+    with transaction() as tx:
+        tx.execute('DELETE FROM ingest_jobs')
+
+def enqueue(user_id, status='queued', attempts=0, heartbeat='+0 seconds'):
+    with transaction() as tx:
+        tx.execute("INSERT INTO pdfs (user_id, filename, original_name) VALUES (?, 'a.pdf', 'a.pdf')", (user_id,))
+        tx.execute('''
+            INSERT INTO ingest_jobs (pdf_id, user_id, path, status, attempts, heartbeat_at)
+            VALUES (?, ?, '/tmp/a.pdf', ?, ?, datetime('now', ?))
+        ''', (tx.lastrowid, user_id, status, attempts, heartbeat))
+        return tx.lastrowid
+
+def make_stale(job_id):
+    with transaction() as tx:
+        tx.execute("UPDATE ingest_jobs SET heartbeat_at = datetime('now', ?) WHERE id = ?", (STALE, job_id))
+
+def job(job_id):
+    return get_db().execute('SELECT * FROM ingest_jobs WHERE id = ?', (job_id,)).fetchone()
+
+def chunks_of(job_id):
+    return get_db().execute('''
+        SELECT COUNT(*) as count FROM pdf_chunks WHERE pdf_id = (SELECT pdf_id FROM ingest_jobs WHERE id = ?)
+    ''', (job_id,)).fetchone()['count']
+
+def test_live_job_keeps_its_heartbeat_while_extraction_is_slow(cursor, user_id, monkeypatch):
+    clear_queue()
+    job_id = enqueue(user_id)
+    claimed = ingest.claim_job()
+    # Como se o ultimo heartbeat estivesse quase vencendo
+    make_stale(job_id)
+
+    monkeypatch.setattr(ingest, 'INGEST_HEARTBEAT_SECONDS', 0.05)
+    reclaimed = []
+
+    def slow_extract(path, progress=None):
+        # Caminho sequencial: nenhum progresso e reportado
+        time.sleep(0.3)
+        reclaimed.append(ingest.claim_job())
+        ingest.release_db()
+        return 1, [(1, 0, 'texto')]
+
+    monkeypatch.setattr(ingest, 'extract_pdf', slow_extract)
+    ingest.run_job(claimed)
+
+    assert reclaimed == [None]
+    assert job(job_id)['status'] == 'done'
+    assert job(job_id)['attempts'] == 1
+    assert chunks_of(job_id) == 1
+
+def test_superseded_worker_does_not_finish_a_reclaimed_job(cursor, user_id, monkeypatch):
+    clear_queue()
+    job_id = enqueue(user_id)
+    first = ingest.claim_job()
+    second = []
+
+    def stalled_extract(path, progress=None):
+        # O worker travou alem de INGEST_STALE_SECONDS e outro pegou o job
+        make_stale(job_id)
+        second.append(ingest.claim_job())
+        ingest.release_db()
+        progress(1, 1)
+        return 1, [(1, 0, 'texto')]
+
+    monkeypatch.setattr(ingest, 'extract_pdf', stalled_extract)
+    ingest.run_job(first)
+
+    assert second[0]['id'] == job_id and second[0]['attempts'] == 2
+    assert job(job_id)['status'] == 'running'
+    assert job(job_id)['pages_done'] == 0
+    assert chunks_of(job_id) == 0
+
+def test_superseded_worker_does_not_fail_a_reclaimed_job(cursor, user_id, monkeypatch):
+    clear_queue()
+    job_id = enqueue(user_id)
+    first = ingest.claim_job()
+
+    def failing_extract(path, progress=None):
+        make_stale(job_id)
+        ingest.claim_job()
+        ingest.release_db()
+        raise ValueError('PDF corrompido')
+
+    monkeypatch.setattr(ingest, 'extract_pdf', failing_extract)
+    ingest.run_job(first)
+
+    assert job(job_id)['status'] == 'running'
+    assert job(job_id)['error'] is None
+
+def test_stale_job_out_of_attempts_fails(cursor, user_id):
+    clear_queue()
+    stale = enqueue(user_id, status='running', attempts=ingest.INGEST_MAX_ATTEMPTS, heartbeat=STALE)
+
+    assert ingest.claim_job() is None
+    assert job(stale)['status'] == 'failed'
+    assert job(stale)['error'] == 'Tentativas esgotadas'
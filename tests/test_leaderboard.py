@@ -0,0 +1,87 @@
+import random
+import sqlite3
+
+import database
+from database import transaction, add_xp
+from leaderboard import XPRanking
+
+def positions_by_sort(cursor):
+    """Posicao de cada usuario pela definicao: 1 + quantos tem mais XP"""
+    cursor.execute('SELECT id, xp FROM users')
+    users = cursor.fetchall()
+    return {user['id']: 1 + sum(other['xp'] > user['xp'] for other in users) for user in users}
+
+def add_users(count, rng):
+    ids = []
+    with transaction() as tx:
+        for _ in range(count):
+            name = f'rank{rng.randrange(10 ** 12)}'
+            tx.execute("INSERT INTO users (username, email, password_hash, name) VALUES (?, ?, 'x', ?)",
+                       (name, f'{name}@teste', name))
+            ids.append(tx.lastrowid)
+    return ids
+
+def test_rank_follows_add_xp_and_deletes(cursor):
+    rng = random.Random(8)
+    ids = add_users(60, rng)
+    with transaction() as tx:
+        for _ in range(200):
+            add_xp(tx, rng.choice(ids), rng.choice([0, 1, 5, 25, 2500]))
+        tx.execute('DELETE FROM users WHERE id = ?', (ids.pop(),))
+        # XP alterado fora de add_xp tambem passa pelos triggers
+        tx.execute('UPDATE users SET xp = 3 WHERE id = ?', (ids[0],))
+
+    ranking = XPRanking()
+    expected = positions_by_sort(cursor)
+    for user_id, position in expected.items():
+        assert ranking.rank_of(user_id)[0] == position
+    assert ranking.count() == len(expected)
+
+def test_rolled_back_xp_does_not_move_the_rank(cursor):
+    (user_id,) = add_users(1, random.Random(1))
+    ranking = XPRanking()
+    before = ranking.rank_of(user_id)
+    try:
+        with transaction() as tx:
+            add_xp(tx, user_id, 10 ** 6)
+            raise RuntimeError('falhou')
+    except RuntimeError:
+        pass
+    assert ranking.rank_of(user_id) == before
+
+def test_keyset_pages_cover_the_ranking_in_order(cursor):
+    rng = random.Random(2)
+    ids = add_users(30, rng)
+    with transaction() as tx:
+        for user_id in ids:
+            add_xp(tx, user_id, rng.choice([0, 10, 10, 40]))
+
+    ranking = XPRanking(cached_size=7)
+    pages = [ranking.page(7)]
+    while len(pages[-1]) == 7:
+        pages.append(ranking.page_after(pages[-1][-1]['cursor'], 7))
+    entries = [entry for page in pages for entry in page]
+
+    cursor.execute('SELECT id, xp FROM users ORDER BY xp DESC, id')
+    rows = cursor.fetchall()
+    assert [entry['cursor'] for entry in entries] == [f"{row['xp']}:{row['id']}" for row in rows]
+    expected = positions_by_sort(cursor)
+    assert [entry['position'] for entry in entries] == [expected[row['id']] for row in rows]
+
+def test_migration_backfills_existing_users():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = database.row_factory
+    cursor = conn.cursor()
+    cursor.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, xp INTEGER DEFAULT 0)')
+    cursor.executemany('INSERT INTO users (xp) VALUES (?)', [(xp,) for xp in (0, 0, 7, 7, 7, 300, -5, 2 ** 40)])
+    database._migration_18_xp_tree(cursor)
+    cursor.execute('INSERT INTO users (xp) VALUES (7)')
+
+    # XP negativo conta como 0 e acima da faixa como o maximo
+    clamp = lambda xp: min(max(xp, 0), (1 << database.XP_TREE_BITS) - 1)
+    cursor.execute('SELECT xp FROM users')
+    stored = [clamp(row['xp']) for row in cursor.fetchall()]
+    for xp in (-1, 0, 6, 7, 8, 300, 2 ** 40):
+        nodes = XPRanking._prefix_nodes(xp)
+        cursor.execute(f'SELECT COALESCE(SUM(users), 0) FROM xp_tree WHERE node IN ({",".join("?" * len(nodes))})', nodes)
+        assert cursor.fetchone()[0] == sum(value <= clamp(xp) for value in stored)
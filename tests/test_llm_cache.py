@@ -0,0 +1,80 @@
+import time
+
+import llm_cache
+from database import get_db, transaction
+from llm_cache import ResponseCache, cache_key
+
+def cache_rows():
+    return {row['key']: row for row in get_db().execute('SELECT key, size, expires_at FROM llm_cache')}
+
+def clear_table():
+    with transaction() as tx:
+        tx.execute('DELETE FROM llm_cache')
+
+def test_memory_keeps_only_the_most_recently_used_entries(cursor):
+    clear_table()
+    cache = ResponseCache(max_entries=2)
+    for key in 'abc':
+        cache._remember(key, time.time() + 60, f'resposta {key}')
+    assert list(cache._memory) == ['b', 'c']
+
+    # Um acerto move a entrada para o fim da fila
+    assert cache.get('explain', 'b') == 'resposta b'
+    cache._remember('d', time.time() + 60, 'resposta d')
+    assert list(cache._memory) == ['b', 'd']
+
+def test_evicted_memory_entry_is_served_from_the_table(cursor):
+    clear_table()
+    cache = ResponseCache(max_entries=1)
+    cache.put('explain', 'a', 'fake', 'resposta a', ttl=60)
+    cache.put('explain', 'b', 'fake', 'resposta b', ttl=60)
+    assert 'a' not in cache._memory
+
+    assert cache.get('explain', 'a') == 'resposta a'
+    assert cache.stats()['endpoints']['explain']['db_hits'] == 1
+    assert list(cache._memory) == ['a']
+
+def test_expired_entries_are_misses(cursor):
+    clear_table()
+    cache = ResponseCache()
+    cache.put('explain', 'a', 'fake', 'resposta a', ttl=-1)
+    assert cache.get('explain', 'a') is None
+    assert cache.stats()['endpoints']['explain']['misses'] == 1
+
+def test_evict_removes_expired_and_least_recently_used_rows(cursor, monkeypatch):
+    clear_table()
+    cache = ResponseCache(max_bytes=25)
+    now = time.time()
+    cache.put('explain', 'velha', 'fake', 'x' * 10, ttl=-1)
+    for key in ('a', 'b', 'c'):
+        cache.put('explain', key, 'fake', 'x' * 10, ttl=60)
+    with transaction() as tx:
+        # 'a' foi a mais usada recentemente; 'b' a menos
+        tx.execute('UPDATE llm_cache SET last_hit_at = ? WHERE key = ?', (now + 3, 'a'))
+        tx.execute('UPDATE llm_cache SET last_hit_at = ? WHERE key = ?', (now + 1, 'b'))
+        tx.execute('UPDATE llm_cache SET last_hit_at = ? WHERE key = ?', (now + 2, 'c'))
+
+    # A poda roda na proxima gravacao
+    monkeypatch.setattr(llm_cache, 'EVICT_EVERY', 1)
+    cache.put('explain', 'd', 'fake', 'x' * 5, ttl=60)
+    # Das mais recentes para as menos: a, c, b, d; so as que cabem em 25 bytes ficam
+    assert set(cache_rows()) == {'a', 'c'}
+
+def test_generate_uses_the_cache_only_for_cacheable_endpoints(cursor):
+    clear_table()
+
+    class Model:
+        model_name = 'fake/teste'
+        calls = 0
+
+        def generate_content(self, prompt, **kwargs):
+            Model.calls += 1
+            return llm_cache.CachedResponse(f'resposta {Model.calls}')
+
+    cache = ResponseCache()
+    model = Model()
+    assert cache.generate(model, 'explain', 'mesmo  texto').text == 'resposta 1'
+    assert cache.generate(model, 'explain', 'mesmo texto').text == 'resposta 1'
+    assert cache.generate(model, 'chat', 'mesmo texto').text == 'resposta 2'
+    assert cache.generate(model, 'chat', 'mesmo texto').text == 'resposta 3'
+    assert cache_key('fake/teste', 'mesmo  texto') in cache_rows()
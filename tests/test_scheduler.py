@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from scheduler import Deck, balance_due_dates
+
+TODAY = 740000
+
+def make_deck(due_day):
+    due_day = np.asarray(due_day, dtype=np.int64)
+    ids = np.arange(1, len(due_day) + 1, dtype=np.int64)
+    ones = np.ones(len(due_day), dtype=np.int64)
+    return Deck(ids, ones, np.full(len(due_day), 2.5), ones, due_day)
+
+def balance_by_loop(due_day, max_per_day):
+    """Mesma redistribuicao, dia a dia: fila FIFO por (vencimento, id)"""
+    due = [max(day, TODAY) for day in due_day]
+    order = sorted(range(len(due)), key=lambda i: (due[i], i))
+    new_due, day, used = [0] * len(due), TODAY, 0
+    for i in order:
+        if due[i] > day:
+            day, used = due[i], 0
+        if used == max_per_day:
+            day, used = day + 1, 0
+        new_due[i] = day
+        used += 1
+    return new_due
+
+def test_caps_each_day_and_carries_the_excess_forward():
+    deck = make_deck([TODAY] * 5 + [TODAY + 1] + [TODAY + 4])
+    balance_due_dates(deck, 2, today=TODAY)
+    assert deck.due_day.tolist() == [TODAY, TODAY, TODAY + 1, TODAY + 1, TODAY + 2, TODAY + 2, TODAY + 4]
+
+def test_overdue_cards_count_as_due_today():
+    deck = make_deck([TODAY - 10, TODAY - 1, TODAY])
+    changed = balance_due_dates(deck, 1, today=TODAY)
+    assert deck.due_day.tolist() == [TODAY, TODAY + 1, TODAY + 2]
+    assert changed.tolist() == [True, True, True]
+
+def test_returns_mask_of_changed_cards_only():
+    deck = make_deck([TODAY, TODAY + 1, TODAY + 1, TODAY + 5])
+    changed = balance_due_dates(deck, 1, today=TODAY)
+    assert changed.tolist() == [False, False, True, False]
+    assert deck.due_day.tolist() == [TODAY, TODAY + 1, TODAY + 2, TODAY + 5]
+
+@pytest.mark.parametrize('max_per_day', [1, 3, 10])
+def test_matches_a_day_by_day_simulation(max_per_day):
+    rng = np.random.default_rng(max_per_day)
+    due_day = rng.integers(TODAY - 5, TODAY + 15, 200)
+    deck = make_deck(due_day)
+    balance_due_dates(deck, max_per_day, today=TODAY)
+    assert deck.due_day.tolist() == balance_by_loop(due_day.tolist(), max_per_day)
+    assert np.bincount(deck.due_day - TODAY).max() <= max_per_day
+
+def test_empty_deck():
+    deck = make_deck([])
+    assert balance_due_dates(deck, 3, today=TODAY).tolist() == []
+
+def test_rejects_capacity_below_one():
+    with pytest.raises(ValueError):
+        balance_due_dates(make_deck([TODAY]), 0, today=TODAY)
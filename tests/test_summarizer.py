@@ -0,0 +1,24 @@
+from summarizer import split_text
+
+def paragraphs(count, size=100):
+    return '\n'.join('x' * (size - 1) for _ in range(count))
+
+def test_short_text_is_a_single_part():
+    assert split_text('texto curto', chunk_chars=1000, parts=4) == ['texto curto']
+
+def test_parts_stay_under_chunk_chars_while_they_fit_in_one_wave():
+    chunks = split_text(paragraphs(25), chunk_chars=1000, parts=4, max_chunk_chars=4000)
+    assert len(chunks) == 3
+    assert max(map(len, chunks)) <= 1000
+
+def test_long_text_grows_the_parts_instead_of_adding_waves():
+    chunks = split_text(paragraphs(100), chunk_chars=1000, parts=4, max_chunk_chars=4000)
+    assert len(chunks) == 4
+    assert max(map(len, chunks)) <= 4000
+    # Cortes nas quebras de paragrafo, sem perder texto
+    assert '\n'.join(chunks) == paragraphs(100)
+
+def test_parts_never_pass_max_chunk_chars():
+    chunks = split_text(paragraphs(200), chunk_chars=1000, parts=4, max_chunk_chars=4000)
+    assert len(chunks) > 4
+    assert max(map(len, chunks)) <= 4000